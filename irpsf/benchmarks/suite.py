@@ -0,0 +1,518 @@
+"""Offline benchmarks of the hot paths of the pipeline.
+
+Each benchmark generates its synthetic inputs (see
+``irpsf.benchmarks.synthetic``) in a workspace, then times one hot path
+over them:
+
+    1) xym_parsing: reading stardb_xym files and applying the quality cuts
+    2) ras_conversion: converting stardb_ras files into the cutout store
+    3) wcs: computing the RA and Dec of stars from FLT headers
+    4) focus_file_parsing: reading Focus<year>.txt files
+    5) focus_interpolation: interpolating the focus model at many times
+    6) database_insert: inserting exposures into ir_psf_mast
+    7) ql_metadata: fetching the QL metadata of many exposures
+    8) deliverable_diff: diffing two ir_psf_mast dumps
+    9) hst1pass_launcher: running hst1pass jobs, with a stub executable
+
+Both databases are SQLite files in the workspace: ir_psf through the
+``psf_connection_string`` setting, and QL through stand-in tables
+holding the columns of the pyql tables that are queried.  ql_metadata
+is skipped if pyql cannot be imported.
+
+Each benchmark runs in its own process, and reports its number of
+rows, rows per second and peak memory: the growth of the peak resident
+memory above what was held before the timed part.  The timed part is
+repeated, each time in a process forked once the synthetic inputs are
+prepared, so every repeat starts from the same state: the prepare_
+functions return the timed function, and a function resetting the
+files it changes, or None.  The fastest repeat is kept.  The settings
+must point to the workspace before this module is imported (see
+``run_benchmarks.py``).
+
+Use
+---
+    This module is intended to be imported by run_benchmarks.py:
+
+        from irpsf.benchmarks.suite import BENCHMARKS, run_benchmark
+        result = run_benchmark('xym_parsing', scale=1.)
+"""
+
+from collections import OrderedDict
+import contextlib
+import glob
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+import traceback
+
+import numpy as np
+
+from irpsf.benchmarks import synthetic
+from irpsf.settings.settings import SETTINGS
+
+
+def _workspace_dir(name):
+    """Return (and create) a directory of the benchmark workspace.
+
+    Parameters
+    ----------
+    name : str
+        The name of the directory.
+
+    Returns
+    -------
+    path : str
+        The path of the directory.
+    """
+
+    path = os.path.join(os.path.dirname(SETTINGS['output_dir'].rstrip('/')), 'benchmarks', name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def prepare_xym_parsing(scale, rng):
+    """Write stardb_xym files and return the function parsing them."""
+
+    from irpsf.ingest.xym_parser import apply_quality_cuts, read_xym_file
+
+    directory = _workspace_dir('xym')
+    paths = []
+    for rootname in synthetic.make_rootnames(int(20 * scale)):
+        paths.append(os.path.join(directory, '{}_flt.stardb_xym'.format(rootname)))
+        synthetic.write_xym_file(paths[-1], 2000, rng)
+
+    def run():
+        n_stars = 0
+        for path in paths:
+            stars = read_xym_file(path)
+            apply_quality_cuts(stars)
+            n_stars += len(stars)
+        return n_stars
+
+    return run, None
+
+
+def prepare_ras_conversion(scale, rng):
+    """Write stardb_ras files and return the function converting them."""
+
+    from irpsf.cutouts.ras_store import convert_ras_file
+
+    directory = _workspace_dir('ras')
+    paths = []
+    for rootname in synthetic.make_rootnames(int(5 * scale)):
+        paths.append(os.path.join(directory, '{}_flt.stardb_ras'.format(rootname)))
+        synthetic.write_ras_file(paths[-1], 500, rng)
+
+    def run():
+        return sum(len(np.load(convert_ras_file(path, 'F160W'), mmap_mode='r'))
+                   for path in paths)
+
+    return run, None
+
+
+def prepare_wcs(scale, rng):
+    """Write FLT files and return the function computing star positions, and its reset."""
+
+    from irpsf.ingest.wcs_service import get_header_cache_path, get_ra_dec
+    # get_wcs imports astropy.wcs on its first call; keep that out of the timing
+    import astropy.wcs  # noqa: F401
+
+    directory = _workspace_dir('ql')
+    rootnames = synthetic.make_rootnames(int(20 * scale))
+    for rootname in rootnames:
+        synthetic.write_flt_file(os.path.join(directory, '{}_flt.fits'.format(rootname)), rng)
+    x, y = rng.uniform(1, 1014, (2, 2000))
+
+    def run():
+        for rootname in rootnames:
+            get_ra_dec(rootname, directory, x, y)
+        return len(rootnames) * len(x)
+
+    def reset():
+        # Headers are read from the FLT files, not from a previous run's cache
+        for path in glob.glob(get_header_cache_path('*')):
+            os.remove(path)
+
+    return run, reset
+
+
+def prepare_focus_file_parsing(scale, rng):
+    """Write focus model files and return the function parsing them."""
+
+    from irpsf.scripts.make_focus_model_table import parse_focus_file
+
+    directory = _workspace_dir('focus')
+    paths = []
+    for year in range(2010, 2010 + max(int(scale), 1)):
+        paths.append(os.path.join(directory, 'Focus{}.txt'.format(year)))
+        synthetic.write_focus_file(paths[-1], year, n_lines=int(50000 * min(scale, 1.)))
+
+    def run():
+        return sum(len(parse_focus_file(path)[1]) for path in paths)
+
+    return run, None
+
+
+def prepare_focus_interpolation(scale, rng):
+    """Make a focus model and return the function interpolating it."""
+
+    from irpsf.ingest.focus_model import interpolate_focus
+
+    model_mjds = 55000. + np.arange(100000) * 5. / 1440.
+    model_focus = 4 * np.sin(np.arange(100000) / 97.)
+    midexps = rng.uniform(model_mjds[0] - 1, model_mjds[-1] + 1, int(200000 * scale))
+
+    def run():
+        interpolate_focus(model_mjds, model_focus, midexps)
+        return len(midexps)
+
+    return run, None
+
+
+def prepare_database_insert(scale, rng):
+    """Return the function inserting exposures, and its reset creating empty ir_psf tables."""
+
+    from irpsf.database.bulk_ingest import write_psf_batches
+    from irpsf.database.ir_psf_database_interface import Base, get_engine
+
+    engine = get_engine()
+    batches = synthetic.make_exposure_batches(int(50 * scale), 2000, rng)
+    batch_size = SETTINGS.get('insert_batch_exposures', 10)
+
+    def run():
+        n_inserted = 0
+        for start in range(0, len(batches), batch_size):
+            counts = write_psf_batches(engine, batches[start:start + batch_size])
+            n_inserted += sum(inserted for inserted, _ in counts.values())
+        return n_inserted
+
+    def reset():
+        Base.metadata.drop_all(engine)
+        Base.metadata.create_all(engine)
+        engine.dispose()
+
+    return run, reset
+
+
+def prepare_ql_metadata(scale, rng):
+    """Fill the QL stand-in tables and return the function querying them."""
+
+    from pyql.database.ql_database_interface import IR_flt_0, Master
+    from sqlalchemy import Column, MetaData, Table
+
+    from irpsf.database.ir_psf_database_interface import get_engine, get_ql_session
+    from irpsf.database.ql_metadata import get_ql_metadata
+
+    # Only the columns that irpsf queries, so that the stand-in does not
+    # depend on the rest of the QL schema
+    columns = {Master.__table__.name: ['id', 'ql_root', 'dir'],
+               IR_flt_0.__table__.name: ['id', 'master_id', 'ql_root', 'expstart', 'expend',
+                                         'filter', 'aperture', 'sunangle', 'exptime',
+                                         'fgslock', 'date_obs', 'targname', 'imagetyp',
+                                         'quality']}
+    metadata = MetaData()
+    for table in (Master.__table__, IR_flt_0.__table__):
+        Table(table.name, metadata, *[Column(column.name, column.type, primary_key=column.primary_key)
+                                      for column in table.columns if column.name in columns[table.name]])
+
+    ql_engine = get_engine('ql')
+    metadata.drop_all(ql_engine)
+    metadata.create_all(ql_engine)
+    rootnames = synthetic.make_rootnames(int(10000 * scale))
+    with ql_engine.begin() as connection:
+        connection.execute(metadata.tables[Master.__table__.name].insert(), [
+            {'id': i + 1, 'ql_root': rootname[:8], 'dir': '/ql/{}'.format(rootname[:4])}
+            for i, rootname in enumerate(rootnames)])
+        connection.execute(metadata.tables[IR_flt_0.__table__.name].insert(), [
+            {'id': i + 1, 'master_id': i + 1, 'ql_root': rootname[:8],
+             'expstart': 55000. + i, 'expend': 55000.01 + i, 'filter': 'F160W',
+             'aperture': 'IR', 'sunangle': 90., 'exptime': 300., 'fgslock': 'FINE'}
+            for i, rootname in enumerate(rootnames)])
+    ql_session = get_ql_session()
+
+    def run():
+        metadata, missing = get_ql_metadata(ql_session, rootnames,
+                                            SETTINGS.get('ql_chunk_size', 1000))
+        return len(metadata['rootname'])
+
+    return run, None
+
+
+def prepare_deliverable_diff(scale, rng):
+    """Write two ir_psf_mast dumps and return the function diffing them."""
+
+    from irpsf.scripts.make_mast_deliverable import make_mast_deliverable
+
+    directory = _workspace_dir('deliverable')
+    old_path = os.path.join(directory, 'ir_psf_mast_old.txt')
+    new_path = os.path.join(directory, 'ir_psf_mast_new.txt')
+    synthetic.write_mast_dumps(old_path, new_path, int(200000 * scale), 0.1, rng)
+
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            make_mast_deliverable(old_path, new_path)
+        with open(new_path) as f:
+            return sum(1 for _ in f)
+
+    return run, None
+
+
+def prepare_hst1pass_launcher(scale, rng):
+    """Write the hst1pass stub and return the function running jobs with it, and its reset."""
+
+    from irpsf.hst1pass.launcher import run_jobs
+
+    executable = os.path.join(_workspace_dir('bin'), 'hst1pass.e')
+    synthetic.write_hst1pass_stub(executable, 200)
+    jobs = [('F160W', rootname[:8], [executable, 'STARDB+', 'HMIN=7', 'FMIN=10000',
+                                     'PSF=model.fits,', '/ql/{}_flt.fits'.format(rootname)])
+            for rootname in synthetic.make_rootnames(int(40 * scale))]
+    def run():
+        counts = run_jobs(jobs, SETTINGS['cores'], timeout=60, retries=0)
+        if counts.get('succeeded', 0) != len(jobs):
+            raise RuntimeError('hst1pass stub jobs did not all succeed: {}'.format(counts))
+        return len(jobs)
+
+    def reset():
+        for path in glob.glob(os.path.join(SETTINGS['output_dir'], 'F160W', '*')):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    return run, reset
+
+
+BENCHMARKS = OrderedDict([
+    ('xym_parsing', prepare_xym_parsing),
+    ('ras_conversion', prepare_ras_conversion),
+    ('wcs', prepare_wcs),
+    ('focus_file_parsing', prepare_focus_file_parsing),
+    ('focus_interpolation', prepare_focus_interpolation),
+    ('database_insert', prepare_database_insert),
+    ('ql_metadata', prepare_ql_metadata),
+    ('deliverable_diff', prepare_deliverable_diff),
+    ('hst1pass_launcher', prepare_hst1pass_launcher)])
+
+
+def get_current_rss_mb():
+    """Return the current resident memory of this process, in MB."""
+
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def _run_prepared(run, result_queue):
+    """Time a prepared benchmark, putting its result on a queue.
+
+    This runs in a process forked after the synthetic inputs were
+    prepared, whose peak resident memory starts at its current one, so
+    the peak of the timed part is not hidden by the preparation's.
+
+    Parameters
+    ----------
+    run : callable
+        The prepared benchmark, returning its number of rows.
+    result_queue : multiprocessing.Queue
+        The queue the result is put on.
+    """
+
+    try:
+        rss_before = get_current_rss_mb()
+        start = time.perf_counter()
+        n_rows = run()
+        seconds = time.perf_counter() - start
+        # ru_maxrss is in kilobytes on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+        result_queue.put({'rows': n_rows, 'seconds': seconds,
+                          'rows_per_s': n_rows / seconds,
+                          'peak_mb': max(peak_mb - rss_before, 0.)})
+    except Exception:
+        result_queue.put({'error': traceback.format_exc()})
+
+
+def _measure(name, scale, repeats, result_queue):
+    """Prepare and time a benchmark, putting its result on a queue.
+
+    The timed part is repeated, each time in a process forked from the
+    prepared one after resetting the files the previous repeat changed.
+    The fastest repeat gives the rows per second, which is the least
+    affected by other load on the machine, and the median of the
+    repeats gives the peak memory.
+
+    Parameters
+    ----------
+    name : str
+        The name of the benchmark.
+    scale : float
+        The scale of its synthetic inputs.
+    repeats : int
+        The number of times the timed part is run.
+    result_queue : multiprocessing.Queue
+        The queue the result is put on.
+    """
+
+    try:
+        run, reset = BENCHMARKS[name](scale, np.random.default_rng(0))
+    except ImportError as error:
+        result_queue.put({'skipped': str(error)})
+        return
+    except Exception:
+        result_queue.put({'error': traceback.format_exc()})
+        return
+
+    context = multiprocessing.get_context('fork')
+    repeat_queue = context.Queue()
+    results = []
+    for _ in range(repeats):
+        try:
+            if reset is not None:
+                reset()
+        except Exception:
+            result_queue.put({'error': traceback.format_exc()})
+            return
+        process = context.Process(target=_run_prepared, args=(run, repeat_queue))
+        process.start()
+        results.append(repeat_queue.get())
+        process.join()
+        if 'error' in results[-1]:
+            result_queue.put(results[-1])
+            return
+
+    result = dict(max(results, key=lambda result: result['rows_per_s']))
+    result['peak_mb'] = float(np.median([result['peak_mb'] for result in results]))
+    result['repeats'] = repeats
+    result_queue.put(result)
+
+
+def run_benchmark(name, scale=1., repeats=5):
+    """Run a benchmark in its own process.
+
+    Parameters
+    ----------
+    name : str
+        The name of the benchmark, one of ``BENCHMARKS``.
+    scale : float, default=1.
+        The scale of its synthetic inputs.
+    repeats : int, default=5
+        The number of times the timed part is run.
+
+    Returns
+    -------
+    result : dict
+        The rows, seconds and rows_per_s of the fastest repeat and the
+        median peak_mb of the repeats, or 'skipped' or 'error' with the
+        reason.
+    """
+
+    context = multiprocessing.get_context('fork')
+    result_queue = context.Queue()
+    process = context.Process(target=_measure, args=(name, scale, repeats, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+
+    return result
+
+
+def get_environment():
+    """Return a description of the machine and software the benchmarks run on.
+
+    Returns
+    -------
+    environment : dict
+        The python and numpy versions, the platform, the CPU model and
+        the number of CPUs.
+    """
+
+    cpu = platform.processor()
+    if os.path.exists('/proc/cpuinfo'):
+        with open('/proc/cpuinfo') as f:
+            models = [line.split(':', 1)[1].strip() for line in f if line.startswith('model name')]
+        cpu = models[0] if models else cpu
+
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpu': cpu, 'cpu_count': os.cpu_count()}
+
+
+def load_baselines(path):
+    """Read the stored baselines.
+
+    Parameters
+    ----------
+    path : str
+        The path of the JSON file.
+
+    Returns
+    -------
+    baselines : dict
+        The ``scale`` and ``environment`` the baselines were measured
+        at, and their ``rows_per_s`` and ``peak_mb`` keyed by benchmark
+        name.  Empty
+        if the file does not exist.
+    """
+
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(path, results, scale):
+    """Store results as the new baselines.
+
+    Parameters
+    ----------
+    path : str
+        The path of the JSON file.
+    results : dict
+        The results, keyed by benchmark name.  Skipped and failed
+        benchmarks keep their previous baseline.
+    scale : float
+        The scale the results were measured at.
+    """
+
+    baselines = load_baselines(path)
+    if baselines.get('scale') != scale:
+        baselines = {}
+    baselines['scale'] = scale
+    baselines['environment'] = get_environment()
+    for name, result in results.items():
+        if 'rows_per_s' in result:
+            baselines.setdefault('benchmarks', {})[name] = {
+                'rows_per_s': round(result['rows_per_s'], 1),
+                'peak_mb': round(result['peak_mb'], 1)}
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=4, sort_keys=True)
+        f.write('\n')
+
+
+def compare_to_baseline(result, baseline, tolerance, memory_slack_mb=2.):
+    """Return the regressions of a result against its baseline.
+
+    Parameters
+    ----------
+    result : dict
+        The result of a benchmark.
+    baseline : dict
+        Its baseline ``rows_per_s`` and ``peak_mb``.
+    tolerance : float
+        The allowed fractional slowdown and memory growth.
+    memory_slack_mb : float, default=2.
+        Memory growth always allowed, as peaks of a few MB are noisy.
+
+    Returns
+    -------
+    regressions : list
+        Descriptions of the regressions, empty if there are none.
+    """
+
+    regressions = []
+    if result['rows_per_s'] < baseline['rows_per_s'] * (1 - tolerance):
+        regressions.append('{:.0f} rows/s, baseline {:.0f}'.format(
+            result['rows_per_s'], baseline['rows_per_s']))
+    if result['peak_mb'] > baseline['peak_mb'] * (1 + tolerance) + memory_slack_mb:
+        regressions.append('{:.0f} MB, baseline {:.0f}'.format(
+            result['peak_mb'], baseline['peak_mb']))
+    return regressions
@@ -0,0 +1,290 @@
+"""Synthetic inputs for the benchmarks.
+
+Every input of the pipeline can be generated here at any scale, so the
+hot paths can be measured without the psf filesystem, the QL archive or
+hst1pass:
+
+    1) ``*.stardb_xym`` and ``*.stardb_ras`` files, as written by hst1pass
+    2) FLT files holding only the headers, with a TAN WCS in the SCI
+       extension
+    3) ``Focus<year>.txt`` focus model files
+    4) ir_psf_mast table dumps, as read by make_mast_deliverable.py
+    5) column batches of exposures, as inserted by make_ir_psf_table.py
+    6) a stand-in for the hst1pass executable, writing synthetic outputs
+
+This module only depends on NumPy and astropy, so it can be imported
+before the settings are set up.
+
+Use
+---
+    This module is intended to be imported by the benchmarks:
+
+        from irpsf.benchmarks.synthetic import write_xym_file
+        write_xym_file(path, n_stars, np.random.default_rng(0))
+"""
+
+import datetime
+import os
+import stat
+import sys
+
+from astropy.io import fits
+import numpy as np
+
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+HST1PASS_STUB = '''#! {python}
+"""Stand-in for hst1pass.e: writes synthetic outputs for its last argument."""
+import os
+import sys
+
+root = os.path.basename(sys.argv[-1]).replace('.fits', '')
+with open(root + '.stardb_xym', 'w') as f:
+    for star in range(1, {n_stars} + 1):
+        f.write('{{:9.3f}} {{:9.3f}} -12.000  0.050    63095.73     1.000     12619.15  0.200 N{{:05d}} 0  0.050  0.050\\n'.format(
+            star % 1000 + 10.5, star // 1000 + 10.5, star))
+with open(root + '.stardb_ras', 'w') as f:
+    for star in range(1, {n_stars} + 1):
+        for j in range(11):
+            for i in range(11):
+                f.write('{{:5d}} {{:5d}}     100.00    15.500    15.500     63095.73    1.000  0.0100 N{{:05d}}\\n'.format(
+                    10 + i, 10 + j, star))
+'''
+
+
+def make_rootnames(n_exposures, prefix='ibz'):
+    """Return distinct 9-character rootnames.
+
+    Parameters
+    ----------
+    n_exposures : int
+        The number of rootnames.
+    prefix : str, default='ibz'
+        The first three characters.
+
+    Returns
+    -------
+    rootnames : list
+        The rootnames, ending in 'q'.
+    """
+
+    return ['{}{:05d}q'.format(prefix, i) for i in range(n_exposures)]
+
+
+def write_xym_file(path, n_stars, rng):
+    """Write a stardb_xym file with random stars.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to write.
+    n_stars : int
+        The number of stars.
+    rng : numpy.random.Generator
+        The random number generator.
+    """
+
+    x, y = rng.uniform(1, 1014, (2, n_stars))
+    mfit = rng.uniform(-16, -8, n_stars)
+    qfit, g1, g2 = rng.uniform(0, 0.3, (3, n_stars))
+    sky = rng.normal(1., 0.2, n_stars)
+    sat = (rng.uniform(size=n_stars) < 0.05).astype(int)
+    flux = 10**(-mfit / 2.5)
+    with open(path, 'w') as f:
+        for i in range(n_stars):
+            f.write('{:9.3f} {:9.3f} {:8.3f} {:6.3f} {:14.2f} {:9.3f} {:12.2f} {:6.3f} N{:05d} {:d} {:6.3f} {:6.3f}\n'.format(
+                x[i], y[i], mfit[i], qfit[i], flux[i], sky[i], 0.2 * flux[i], 0.2, i + 1,
+                sat[i], g1[i], g2[i]))
+
+
+def write_ras_file(path, n_stars, rng, size=11):
+    """Write a stardb_ras file with random 11x11 cutouts.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to write.
+    n_stars : int
+        The number of stars.
+    rng : numpy.random.Generator
+        The random number generator.
+    size : int, default=11
+        The size of the cutouts.
+    """
+
+    offsets = np.arange(size) - size // 2
+    with open(path, 'w') as f:
+        for star in range(1, n_stars + 1):
+            xfit, yfit = rng.uniform(10, 1004, 2)
+            zfit, sfit = rng.uniform(1e3, 1e5), rng.normal(1., 0.2)
+            i0, j0 = int(xfit), int(yfit)
+            pixels = rng.normal(sfit, 1., (size, size))
+            fexp = rng.uniform(0, 0.2, (size, size))
+            for row, dj in enumerate(offsets):
+                for col, di in enumerate(offsets):
+                    f.write('{:5d} {:5d} {:10.2f} {:9.3f} {:9.3f} {:12.2f} {:8.3f} {:7.4f} N{:05d}\n'.format(
+                        i0 + di, j0 + dj, pixels[row, col], xfit, yfit, zfit, sfit,
+                        fexp[row, col], star))
+
+
+def write_flt_file(path, rng):
+    """Write an FLT file with headers only and a TAN WCS in its SCI extension.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to write.
+    rng : numpy.random.Generator
+        The random number generator.
+    """
+
+    scale = 0.128 / 3600.
+    theta = rng.uniform(0, 2 * np.pi)
+    header = fits.Header()
+    header['EXTNAME'] = 'SCI'
+    header['CTYPE1'], header['CTYPE2'] = 'RA---TAN', 'DEC--TAN'
+    header['CRPIX1'], header['CRPIX2'] = 507., 507.
+    header['CRVAL1'], header['CRVAL2'] = rng.uniform(0, 360), rng.uniform(-80, 80)
+    header['CD1_1'], header['CD1_2'] = -scale * np.cos(theta), scale * np.sin(theta)
+    header['CD2_1'], header['CD2_2'] = scale * np.sin(theta), scale * np.cos(theta)
+    data = np.zeros((1014, 1014), dtype=np.uint8)
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(data, header=header)]).writeto(path, overwrite=True)
+
+
+def write_focus_file(path, year, n_lines=None, step_minutes=5):
+    """Write a Focus<year>.txt focus model file.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to write.
+    year : int
+        The year of the measurements.
+    n_lines : int, optional
+        The number of measurements.  Defaults to a full year.
+    step_minutes : int, default=5
+        The time between measurements.
+
+    Returns
+    -------
+    mjds : numpy.ndarray
+        The MJDs of the measurements.
+    """
+
+    start = datetime.datetime(year, 1, 1)
+    if n_lines is None:
+        n_lines = int((datetime.datetime(year + 1, 1, 1) - start).total_seconds() // (60 * step_minutes))
+    mjd_start = (start - datetime.datetime(1858, 11, 17)).days
+    minutes = np.arange(n_lines) * step_minutes
+    mjds = mjd_start + minutes / 1440.
+    focus = np.round(4 * np.sin(minutes / 97.), 2)
+
+    with open(path, 'w') as f:
+        for minute, mjd, value in zip(minutes.tolist(), mjds.tolist(), focus.tolist()):
+            t = start + datetime.timedelta(minutes=minute)
+            f.write('{:.5f}, {} {} {} {:02d}:{:02d}:{:02d} {:.2f}\n'.format(
+                mjd, MONTHS[t.month - 1], t.day, t.year, t.hour, t.minute, t.second, value))
+
+    return mjds
+
+
+def make_exposure_batches(n_exposures, n_stars, rng, filt='F160W'):
+    """Return column batches of exposures, as built by make_ir_psf_table.py.
+
+    Parameters
+    ----------
+    n_exposures : int
+        The number of exposures.
+    n_stars : int
+        The number of stars per exposure.
+    rng : numpy.random.Generator
+        The random number generator.
+    filt : str, default='F160W'
+        The filter of the exposures.
+
+    Returns
+    -------
+    batches : list
+        One dict of columns per exposure.
+    """
+
+    batches = []
+    for i, rootname in enumerate(make_rootnames(n_exposures)):
+        midexp = 55000. + i / 10.
+        batches.append({
+            'rootname': rootname, 'filter': filt, 'aperture': 'IR',
+            'psf_x_center': rng.uniform(1, 1014, n_stars),
+            'psf_y_center': rng.uniform(1, 1014, n_stars),
+            'psf_ra': rng.uniform(0, 360, n_stars),
+            'psf_dec': rng.uniform(-80, 80, n_stars),
+            'psf_flux': rng.uniform(1e3, 1e5, n_stars),
+            'sky': rng.normal(1., 0.2, n_stars),
+            'qfit': rng.uniform(0, 0.15, n_stars),
+            'pixc': rng.uniform(1e2, 1e4, n_stars),
+            'midexp': midexp, 'mjd': midexp,
+            'date': datetime.datetime(2009, 6, 18) + datetime.timedelta(days=midexp - 55000.),
+            'focus': rng.normal(0, 2)})
+    return batches
+
+
+def write_mast_dumps(old_path, new_path, n_rows, new_fraction, rng):
+    """Write a delivered and a new ir_psf_mast dump sharing most rows.
+
+    Parameters
+    ----------
+    old_path : str
+        The path of the previously delivered dump.
+    new_path : str
+        The path of the new dump, holding every old row, in another
+        order, and ``new_fraction * n_rows`` more.
+    n_rows : int
+        The number of rows of the old dump.
+    new_fraction : float
+        The fraction of rows added to the new dump.
+    rng : numpy.random.Generator
+        The random number generator.
+
+    Returns
+    -------
+    n_new : int
+        The number of rows only in the new dump.
+    """
+
+    n_new = int(n_rows * new_fraction)
+    n_total = n_rows + n_new
+    x, y = rng.uniform(1, 1014, (2, n_total))
+    ra, dec = rng.uniform(0, 360, n_total), rng.uniform(-80, 80, n_total)
+    flux, sky = rng.uniform(1e3, 1e5, n_total), rng.normal(1., 0.2, n_total)
+    rows = ['{},ibz{:05d}q,F160W,IR,{:.3f},{:.3f},{:.8f},{:.8f},{:.2f},{:.3f},0.05,100.0,'
+            '55000.00000,55000.00000,2009-06-18 00:00:00,0.5'.format(
+                i + 1, i // 500, x[i], y[i], ra[i], dec[i], flux[i], sky[i])
+            for i in range(n_total)]
+
+    with open(old_path, 'w') as f:
+        f.write('\n'.join(rows[:n_rows]) + '\n')
+    with open(new_path, 'w') as f:
+        f.write('\n'.join(rows[i] for i in rng.permutation(n_total)) + '\n')
+
+    return n_new
+
+
+def write_hst1pass_stub(path, n_stars):
+    """Write an executable standing in for hst1pass.e.
+
+    The stub takes the arguments of hst1pass and writes a stardb_xym
+    and a stardb_ras file with ``n_stars`` stars, named after its last
+    argument, in its working directory.  It only uses the standard
+    library, so that the launcher rather than the stub is measured.
+
+    Parameters
+    ----------
+    path : str
+        The path of the executable.
+    n_stars : int
+        The number of stars of each output.
+    """
+
+    with open(path, 'w') as f:
+        f.write(HST1PASS_STUB.format(python=sys.executable, n_stars=n_stars))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
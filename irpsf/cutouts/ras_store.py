@@ -0,0 +1,264 @@
+"""Compact binary storage of the hst1pass ``*.stardb_ras`` cutouts.
+
+hst1pass writes the 11x11 pixel cutout around every detected star as
+121 text lines in ``<rootname>_flt.stardb_ras``, with 9 columns:
+
+    1) i, pixel location for this pixel
+    2) j, pixel location
+    3) p, pixel value
+    4) xfit, the fitted x pixel location
+    5) yfit, the fitted y pixel location
+    6) zfit, the fitted flux for the star
+    7) sfit, the fitted sky value
+    8) fexp, the fraction of light expected to be in this pixel
+    9) N + star number
+
+This module converts a ras file into a single ``.npy`` file holding a
+structured array with one element per star: the star number, its fit
+parameters, the location of the cutout's first pixel and the (11, 11)
+float32 pixel and fexp cutouts, indexed as ``[j - j0, i - i0]``.  The
+stars are sorted by star number, which serves as the index.
+
+The files are kept in ``SETTINGS['cutout_dir']`` (by default a
+``cutouts`` directory next to ``SETTINGS['output_dir']``) as
+``<filter>/<rootname>_cutouts.npy``.  They are opened memory-mapped, so
+fetching a star's cutout reads only that star's bytes and returns a
+view rather than a copy.
+
+Use
+---
+    This module is intended to be imported as such:
+
+        from irpsf.cutouts.ras_store import convert_ras_file, get_cutout
+        convert_ras_file(ras_file_path, filt)
+        star = get_cutout('iabc01xyq', 12)
+        pixels = star['pixels']
+"""
+
+import glob
+import os
+import warnings
+
+import numpy as np
+
+from irpsf.settings.settings import SETTINGS
+
+
+CUTOUT_SIZE = 11
+PIXELS_PER_STAR = CUTOUT_SIZE * CUTOUT_SIZE
+
+RAS_DTYPE = np.dtype([('i', 'f8'), ('j', 'f8'), ('p', 'f8'), ('xfit', 'f8'),
+                      ('yfit', 'f8'), ('zfit', 'f8'), ('sfit', 'f8'),
+                      ('fexp', 'f8'), ('N', 'U16')])
+
+CUTOUT_DTYPE = np.dtype([('star', 'i4'), ('xfit', 'f8'), ('yfit', 'f8'),
+                         ('zfit', 'f8'), ('sfit', 'f8'), ('i0', 'i2'),
+                         ('j0', 'i2'),
+                         ('pixels', 'f4', (CUTOUT_SIZE, CUTOUT_SIZE)),
+                         ('fexp', 'f4', (CUTOUT_SIZE, CUTOUT_SIZE))])
+
+
+def get_cutout_dir():
+    """Return the root directory of the cutout store.
+
+    Returns
+    -------
+    cutout_dir : str
+        ``SETTINGS['cutout_dir']``, or a ``cutouts`` directory next to
+        ``SETTINGS['output_dir']`` by default.
+    """
+
+    default = os.path.join(os.path.dirname(SETTINGS['output_dir'].rstrip('/')), 'cutouts')
+    return SETTINGS.get('cutout_dir', default)
+
+
+def get_cutout_path(rootname, filt):
+    """Return the path of an exposure's cutout file.
+
+    Parameters
+    ----------
+    rootname : str
+        The 9-character rootname of the exposure.
+    filt : str
+        The filter of the exposure.
+
+    Returns
+    -------
+    path : str
+        The path of the ``.npy`` cutout file.
+    """
+
+    return os.path.join(get_cutout_dir(), filt, '{}_cutouts.npy'.format(rootname))
+
+
+def read_ras_file(ras_file_path):
+    """Read a stardb_ras file into a cutout array.
+
+    Parameters
+    ----------
+    ras_file_path : str
+        Path to the .stardb_ras file.
+
+    Returns
+    -------
+    cutouts : numpy.ndarray
+        A structured array of ``CUTOUT_DTYPE`` with one element per
+        star, sorted by star number.
+    """
+
+    with warnings.catch_warnings():
+        # np.loadtxt warns about empty files, which are expected
+        warnings.simplefilter('ignore', UserWarning)
+        lines = np.loadtxt(ras_file_path, dtype=RAS_DTYPE, ndmin=1)
+    if len(lines) % PIXELS_PER_STAR:
+        raise ValueError('{} has {} lines, not a multiple of {}'.format(
+            ras_file_path, len(lines), PIXELS_PER_STAR))
+
+    lines = lines.reshape(-1, PIXELS_PER_STAR)
+    stars = np.char.lstrip(lines['N'], 'N').astype(int)
+    if np.any(stars != stars[:, :1]):
+        raise ValueError('{} does not have {} consecutive lines per star'.format(
+            ras_file_path, PIXELS_PER_STAR))
+    columns = {name: lines[name] for name in RAS_DTYPE.names}
+
+    cutouts = np.zeros(len(stars), dtype=CUTOUT_DTYPE)
+    cutouts['star'] = stars[:, 0]
+    for name in ['xfit', 'yfit', 'zfit', 'sfit']:
+        cutouts[name] = columns[name][:, 0]
+    cutouts['i0'] = columns['i'].min(axis=1)
+    cutouts['j0'] = columns['j'].min(axis=1)
+
+    # Place each line at its (j, i) position within the star's cutout,
+    # which must cover every position of the 11x11 grid exactly once
+    rows = (columns['j'] - cutouts['j0'][:, None]).astype(int)
+    cols = (columns['i'] - cutouts['i0'][:, None]).astype(int)
+    positions = np.sort(rows * CUTOUT_SIZE + cols, axis=1)
+    if np.any(positions != np.arange(PIXELS_PER_STAR)):
+        raise ValueError('{} has cutouts that are not {}x{} pixel grids'.format(
+            ras_file_path, CUTOUT_SIZE, CUTOUT_SIZE))
+    star_index = np.repeat(np.arange(len(stars)), PIXELS_PER_STAR)
+    rows, cols = rows.ravel(), cols.ravel()
+    cutouts['pixels'][star_index, rows, cols] = columns['p'].ravel()
+    cutouts['fexp'][star_index, rows, cols] = columns['fexp'].ravel()
+
+    return np.sort(cutouts, order='star')
+
+
+def convert_ras_file(ras_file_path, filt):
+    """Convert a stardb_ras file into the cutout store.
+
+    Parameters
+    ----------
+    ras_file_path : str
+        Path to the .stardb_ras file.
+    filt : str
+        The filter of the exposure.
+
+    Returns
+    -------
+    cutout_path : str
+        The path of the written cutout file.
+    """
+
+    rootname = os.path.basename(ras_file_path)[0:9]
+    cutout_path = get_cutout_path(rootname, filt)
+    os.makedirs(os.path.dirname(cutout_path), exist_ok=True)
+
+    temp_path = cutout_path + '.tmp{}.npy'.format(os.getpid())
+    np.save(temp_path, read_ras_file(ras_file_path))
+    os.replace(temp_path, cutout_path)
+
+    return cutout_path
+
+
+def verify_cutout_file(ras_file_path, cutout_path):
+    """Check that a cutout file holds exactly the contents of a ras file.
+
+    Parameters
+    ----------
+    ras_file_path : str
+        Path to the .stardb_ras file.
+    cutout_path : str
+        Path to the cutout file converted from it.
+
+    Returns
+    -------
+    verified : bool
+        True if the cutout file matches the ras file.
+    """
+
+    expected, cutouts = read_ras_file(ras_file_path), open_cutouts(cutout_path)
+    if expected.dtype != cutouts.dtype or expected.shape != cutouts.shape:
+        return False
+    return all(np.array_equal(expected[name], cutouts[name], equal_nan=True)
+               for name in CUTOUT_DTYPE.names)
+
+
+def open_cutouts(cutout_path):
+    """Open a cutout file memory-mapped.
+
+    Parameters
+    ----------
+    cutout_path : str
+        Path to the cutout file.
+
+    Returns
+    -------
+    cutouts : numpy.memmap
+        The read-only, memory-mapped structured array of cutouts.
+    """
+
+    return np.load(cutout_path, mmap_mode='r')
+
+
+def find_cutout_path(rootname, filt=None):
+    """Return the path of an exposure's cutout file, searching all filters.
+
+    Parameters
+    ----------
+    rootname : str
+        The 9-character rootname of the exposure.
+    filt : str, optional
+        The filter of the exposure.  If not given, every filter
+        directory of the store is searched.
+
+    Returns
+    -------
+    path : str
+        The path of the ``.npy`` cutout file.
+    """
+
+    if filt is not None:
+        paths = [get_cutout_path(rootname, filt)]
+    else:
+        paths = glob.glob(get_cutout_path(rootname, '*'))
+    paths = [path for path in paths if os.path.exists(path)]
+    if not paths:
+        raise FileNotFoundError('No cutouts stored for {}'.format(rootname))
+    return paths[0]
+
+
+def get_cutout(rootname, star, filt=None):
+    """Return the cutout of a star without copying it.
+
+    Parameters
+    ----------
+    rootname : str
+        The 9-character rootname of the exposure.
+    star : int
+        The star number (the N column of the xym and ras files).
+    filt : str, optional
+        The filter of the exposure; speeds up the lookup.
+
+    Returns
+    -------
+    cutout : numpy.void
+        A view of the star's record: its number, fit parameters, cutout
+        origin and ``pixels`` and ``fexp`` cutouts.
+    """
+
+    cutouts = open_cutouts(find_cutout_path(rootname, filt))
+    index = np.searchsorted(cutouts['star'], star)
+    if index == len(cutouts) or cutouts['star'][index] != star:
+        raise KeyError('No star {} in {}'.format(star, rootname))
+    return cutouts[index]
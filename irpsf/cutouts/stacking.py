@@ -0,0 +1,362 @@
+"""Empirical PSF stacks from the cutouts of catalog stars.
+
+The stars are selected in the ir_psf_mast catalog (see
+irpsf.database.psf_query) and split into bins by filter, focus bin and
+detector region.  Each star is matched to its cutout in the cutout
+store (see irpsf.cutouts.ras_store) by its position, within
+MATCH_TOLERANCE pixels of the fitted xfit, yfit of the cutout.
+
+Every pixel of a cutout is sky-subtracted (sfit) and normalized by the
+flux of the star (zfit), then placed at its offset from the catalog
+position of the star on a grid ``oversample`` times finer than the
+detector pixels, out to HALF_WIDTH pixels from the center.  The stack
+of a bin is the mean of the values at each node of the grid, i.e. an
+empirical PSF in the sense of Anderson & King: the fraction of the
+flux of a star falling in a pixel centered at that offset.  With
+``clip_iterations``, values more than ``clip`` standard deviations
+from the mean of the previous iteration are rejected.
+
+Only counts, sums and sums of squares are accumulated, so the stars
+are processed one exposure at a time by a pool of processes, each
+cutout file being memory-mapped, and every iteration of the clipping
+is one more pass over the cutouts: besides the catalog positions of the
+stars, memory does not depend on the number of stars.
+
+Use
+---
+    This module is intended to be imported by the stacking script:
+
+        from irpsf.cutouts.stacking import make_psf_stacks
+        from irpsf.database.psf_query import make_selector
+        stacks = make_psf_stacks(make_selector(filters=['F160W'], qfit_max=0.05),
+                                 focus_bins=[-4, -2, 0, 2, 4], region_size=507)
+        stacks['stacks'][0]
+"""
+
+import logging
+from multiprocessing import Pool
+
+import numpy as np
+
+from irpsf.cutouts.ras_store import CUTOUT_SIZE, get_cutout_path, open_cutouts
+from irpsf.database.psf_query import select_psfs
+from irpsf.settings.settings import SETTINGS
+
+DETECTOR_SIZE = 1014
+
+HALF_WIDTH = CUTOUT_SIZE // 2
+
+MATCH_TOLERANCE = 0.01
+
+# The number of stars of the exposures handed to a worker at a time
+STARS_PER_TASK = 100000
+
+# The clipping limits of the current pass, set in each worker of the pool
+_CLIP_LIMITS = None
+
+
+def _set_clip_limits(clip_limits):
+    """Set the clipping limits of a worker, as the initializer of the pool."""
+
+    global _CLIP_LIMITS
+    _CLIP_LIMITS = clip_limits
+
+
+def match_stars(xfit, yfit, x, y, tolerance=MATCH_TOLERANCE):
+    """Return the cutouts of stars, matched by position.
+
+    Parameters
+    ----------
+    xfit, yfit : numpy.ndarray
+        The fitted positions of the cutouts of an exposure.
+    x, y : numpy.ndarray
+        The positions of the catalog stars of the exposure.
+    tolerance : float, default=MATCH_TOLERANCE
+        The largest difference of x and of y, in pixels.
+
+    Returns
+    -------
+    index : numpy.ndarray
+        The index of the cutout of each star, -1 if none matches.
+    """
+
+    order = np.argsort(xfit)
+    xfit_sorted = xfit[order]
+    first = np.searchsorted(xfit_sorted, x - tolerance, side='left')
+    last = np.searchsorted(xfit_sorted, x + tolerance, side='right')
+
+    index = np.full(len(x), -1, dtype=np.int64)
+    for offset in range(int((last - first).max(initial=0))):
+        candidate = np.minimum(first + offset, len(order) - 1)
+        match = (index < 0) & (first + offset < last) & \
+            (np.abs(yfit[order[candidate]] - y) <= tolerance)
+        index[match] = order[candidate[match]]
+
+    return index
+
+
+def get_samples(cutouts, x, y, oversample):
+    """Return the normalized, sky-subtracted pixels of cutouts and their grid nodes.
+
+    Parameters
+    ----------
+    cutouts : numpy.ndarray
+        Cutout records, see irpsf.cutouts.ras_store.CUTOUT_DTYPE.
+    x, y : numpy.ndarray
+        The positions of the stars the pixels are registered on: the
+        catalog positions, which hst1pass writes with 3 decimals
+        against 2 for the xfit, yfit of the cutouts.
+    oversample : int
+        The number of grid nodes per pixel.
+
+    Returns
+    -------
+    values : numpy.ndarray
+        The (n_stars, CUTOUT_SIZE, CUTOUT_SIZE) pixel values, minus
+        sfit and divided by zfit.
+    nodes : numpy.ndarray
+        The grid node of each pixel, -1 for pixels beyond the grid or
+        with an invalid value.
+    """
+
+    grid_size = 2 * HALF_WIDTH * oversample + 1
+    zfit = cutouts['zfit'][:, None, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = (cutouts['pixels'] - cutouts['sfit'][:, None, None]) / zfit
+
+    pixels = np.arange(CUTOUT_SIZE)
+    dx = pixels[None, None, :] + cutouts['i0'][:, None, None] - x[:, None, None]
+    dy = pixels[None, :, None] + cutouts['j0'][:, None, None] - y[:, None, None]
+    node_x = np.rint(dx * oversample).astype(np.int64) + HALF_WIDTH * oversample
+    node_y = np.rint(dy * oversample).astype(np.int64) + HALF_WIDTH * oversample
+
+    valid = (node_x >= 0) & (node_x < grid_size) & (node_y >= 0) & (node_y < grid_size) & \
+        np.isfinite(values) & (zfit > 0)
+    nodes = np.where(valid, node_y * grid_size + node_x, -1)
+
+    return values, nodes
+
+
+def stack_exposures(task):
+    """Accumulate the samples of the stars of some exposures.
+
+    This runs in the worker processes of the pool.
+
+    Parameters
+    ----------
+    task : dict
+        The ``oversample`` factor and the ``exposures``, a list of
+        (rootname, filter, x, y, bins) tuples, with the positions and
+        bins of the stars of each exposure.
+
+    Returns
+    -------
+    sums : dict
+        Maps bins to (count, sum, sum of squares) arrays of the grid
+        nodes.
+    n_stars : dict
+        Maps bins to their number of stacked stars.
+    n_missing : int
+        The number of stars without a cutout.
+    """
+
+    oversample = task['oversample']
+    n_nodes = (2 * HALF_WIDTH * oversample + 1)**2
+    sums, n_stars, n_missing = {}, {}, 0
+    for rootname, filt, x, y, bins in task['exposures']:
+        try:
+            cutouts = open_cutouts(get_cutout_path(rootname, filt))
+        except FileNotFoundError:
+            n_missing += len(x)
+            continue
+        index = match_stars(cutouts['xfit'], cutouts['yfit'], x, y)
+        matched = index >= 0
+        n_missing += int(np.sum(~matched))
+        bins = bins[matched]
+        values, nodes = get_samples(cutouts[index[matched]], x[matched], y[matched], oversample)
+
+        star_bins = np.broadcast_to(bins[:, None, None], nodes.shape)
+        keep = nodes >= 0
+        if _CLIP_LIMITS is not None:
+            lower, upper = _CLIP_LIMITS
+            limit_nodes = np.maximum(nodes, 0)
+            keep &= (values >= lower[star_bins, limit_nodes]) & (values <= upper[star_bins, limit_nodes])
+
+        exposure_bins, local_bins = np.unique(bins, return_inverse=True)
+        flat = (local_bins.ravel()[:, None, None] * n_nodes + nodes)[keep]
+        values = values[keep]
+        length = len(exposure_bins) * n_nodes
+        counts = np.bincount(flat, minlength=length).reshape(-1, n_nodes)
+        totals = np.bincount(flat, weights=values, minlength=length).reshape(-1, n_nodes)
+        squares = np.bincount(flat, weights=values**2, minlength=length).reshape(-1, n_nodes)
+        for local, stack_bin in enumerate(exposure_bins.tolist()):
+            if stack_bin in sums:
+                for accumulator, value in zip(sums[stack_bin], (counts, totals, squares)):
+                    accumulator += value[local]
+            else:
+                sums[stack_bin] = [counts[local], totals[local], squares[local]]
+            n_stars[stack_bin] = n_stars.get(stack_bin, 0) + int(np.sum(bins == stack_bin))
+
+    return sums, n_stars, n_missing
+
+
+def get_bins(psfs, focus_bins=None, region_size=None):
+    """Return the stack bins of stars.
+
+    Parameters
+    ----------
+    psfs : numpy.ndarray
+        The stars, with filter, focus, psf_x_center and psf_y_center
+        fields.
+    focus_bins : list, optional
+        The edges of the focus bins.  Stars outside them, or without a
+        focus, are not stacked.  One bin for any focus by default.
+    region_size : int, optional
+        The size of the square detector regions, in pixels.  One region
+        for the whole detector by default.
+
+    Returns
+    -------
+    bins : numpy.ndarray
+        The bin of each star, -1 if not stacked.
+    bin_table : dict
+        Maps filter, focus_min, focus_max, region_x and region_y to
+        arrays with one value per bin.
+    """
+
+    filters, filter_index = np.unique(psfs['filter'], return_inverse=True)
+    filter_index = filter_index.ravel()
+    if focus_bins is None:
+        focus_edges = np.array([-np.inf, np.inf])
+        focus_index = np.zeros(len(psfs), dtype=np.int64)
+    else:
+        focus_edges = np.asarray(focus_bins, dtype=float)
+        focus_index = np.searchsorted(focus_edges, psfs['focus'], side='right') - 1
+        focus_index[(psfs['focus'] == focus_edges[-1])] = len(focus_edges) - 2
+        focus_index[~np.isfinite(psfs['focus']) | (focus_index >= len(focus_edges) - 1)] = -1
+    region_size = region_size or DETECTOR_SIZE
+    n_regions = -(-DETECTOR_SIZE // region_size)
+    region_x = np.clip((psfs['psf_x_center'] // region_size).astype(np.int64), 0, n_regions - 1)
+    region_y = np.clip((psfs['psf_y_center'] // region_size).astype(np.int64), 0, n_regions - 1)
+
+    n_focus = len(focus_edges) - 1
+    bins = ((filter_index * n_focus + focus_index) * n_regions + region_y) * n_regions + region_x
+    bins[focus_index < 0] = -1
+
+    bin_filter, bin_focus, bin_y, bin_x = np.unravel_index(
+        np.arange(len(filters) * n_focus * n_regions**2), (len(filters), n_focus, n_regions, n_regions))
+    bin_table = {'filter': filters[bin_filter], 'focus_min': focus_edges[bin_focus],
+                 'focus_max': focus_edges[bin_focus + 1], 'region_x': bin_x * region_size,
+                 'region_y': bin_y * region_size}
+
+    return bins, bin_table
+
+
+def make_tasks(psfs, bins, oversample):
+    """Yield the tasks of the pool: the stars of whole exposures, up to STARS_PER_TASK.
+
+    Parameters
+    ----------
+    psfs : numpy.ndarray
+        The stars, sorted by rootname.
+    bins : numpy.ndarray
+        The bin of each star.
+    oversample : int
+        The number of grid nodes per pixel.
+
+    Yields
+    ------
+    task : dict
+        See stack_exposures.
+    """
+
+    rootnames, starts = np.unique(psfs['rootname'], return_index=True)
+    bounds = list(starts) + [len(psfs)]
+    exposures, n_stars = [], 0
+    for rootname, start, stop in zip(rootnames.tolist(), bounds[:-1], bounds[1:]):
+        stars = slice(start, stop)
+        exposures.append((rootname, str(psfs['filter'][start]), np.array(psfs['psf_x_center'][stars]),
+                          np.array(psfs['psf_y_center'][stars]), bins[stars]))
+        n_stars += stop - start
+        if n_stars >= STARS_PER_TASK:
+            yield {'oversample': oversample, 'exposures': exposures}
+            exposures, n_stars = [], 0
+    if exposures:
+        yield {'oversample': oversample, 'exposures': exposures}
+
+
+def make_psf_stacks(selector, focus_bins=None, region_size=None, oversample=4, clip=3.,
+                    clip_iterations=0, cores=None):
+    """Stack the cutouts of the selected stars, by filter, focus and detector region.
+
+    Parameters
+    ----------
+    selector : dict
+        The catalog selection of the stars, see
+        irpsf.database.psf_query.make_selector.
+    focus_bins : list, optional
+        The edges of the focus bins, in microns.  One bin for any focus
+        by default.
+    region_size : int, optional
+        The size of the square detector regions, in pixels.  One region
+        for the whole detector by default.
+    oversample : int, default=4
+        The number of grid nodes per pixel.
+    clip : float, default=3.
+        The clipping threshold, in standard deviations.
+    clip_iterations : int, default=0
+        The number of clipping iterations, 0 for a plain mean.
+    cores : int, optional
+        The number of processes, ``SETTINGS['cores']`` by default.
+
+    Returns
+    -------
+    stacks : dict
+        ``stacks``, the (n_bins, n, n) stacks, NaN at nodes without
+        values, with n = 2 * HALF_WIDTH * oversample + 1 and the center
+        of the star at [n // 2, n // 2]; ``counts``, the number of values
+        at each node; ``n_stars``, the number of stars of each bin; and
+        the filter, focus_min, focus_max, region_x and region_y of each
+        bin.
+    """
+
+    cores = cores or SETTINGS['cores']
+    psfs = select_psfs(selector, columns=['rootname', 'filter', 'psf_x_center', 'psf_y_center', 'focus'])
+    psfs = psfs[np.argsort(psfs['rootname'], kind='stable')]
+    bins, bin_table = get_bins(psfs, focus_bins, region_size)
+    psfs, bins = psfs[bins >= 0], bins[bins >= 0]
+    n_bins = len(bin_table['filter'])
+    grid_size = 2 * HALF_WIDTH * oversample + 1
+    logging.info('Stacking {} stars in {} bins'.format(len(psfs), n_bins))
+
+    clip_limits = None
+    for iteration in range(clip_iterations + 1):
+        counts = np.zeros((n_bins, grid_size**2), dtype=np.int64)
+        totals = np.zeros((n_bins, grid_size**2))
+        squares = np.zeros((n_bins, grid_size**2))
+        n_stars = np.zeros(n_bins, dtype=np.int64)
+        n_missing = 0
+        with Pool(cores, initializer=_set_clip_limits, initargs=(clip_limits,)) as pool:
+            for sums, task_stars, task_missing in pool.imap_unordered(stack_exposures,
+                                                                      make_tasks(psfs, bins, oversample)):
+                for stack_bin, (count, total, square) in sums.items():
+                    counts[stack_bin] += count
+                    totals[stack_bin] += total
+                    squares[stack_bin] += square
+                for stack_bin, n in task_stars.items():
+                    n_stars[stack_bin] += n
+                n_missing += task_missing
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = totals / counts
+            deviations = np.sqrt(np.maximum(squares / counts - means**2, 0))
+        logging.info('Pass {}: {} values stacked, {} stars without cutouts'.format(
+            iteration + 1, counts.sum(), n_missing))
+        clip_limits = (means - clip * deviations, means + clip * deviations)
+
+    stacks = dict(bin_table)
+    stacks['stacks'] = means.reshape(n_bins, grid_size, grid_size)
+    stacks['counts'] = counts.reshape(n_bins, grid_size, grid_size)
+    stacks['n_stars'] = n_stars
+
+    return stacks
@@ -0,0 +1,223 @@
+"""Bulk, transactional insertion of PSF records into the ir_psf_mast table.
+
+Records are handed to this module as column batches, one per exposure:
+a dictionary mapping ``ir_psf_mast`` column names to either a sequence
+(one value per PSF) or a scalar (shared by every PSF in the exposure,
+e.g. ``rootname`` or ``midexp``).  Any number of exposure batches are
+converted to typed Python values and written with a single executemany
+call, which the MySQL driver turns into multi-row ``INSERT`` statements.
+
+Duplicate rows (as defined by ``psf_mast_uniqueness_constraint``) are
+skipped with the dialect-appropriate statement (``INSERT IGNORE`` for
+MySQL, ``INSERT OR IGNORE`` for SQLite and ``ON CONFLICT DO NOTHING``
+for PostgreSQL) rather than aborting the transaction.  The number of
+inserted and skipped rows per exposure is determined by counting the
+exposure's rows before and after the insert within the same
+transaction, so the counts are exact regardless of what the driver
+reports as the ``rowcount`` of an executemany.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.database.bulk_ingest import write_psf_batches
+        counts = write_psf_batches(engine, exposure_batches)
+"""
+
+import logging
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy import select
+
+from irpsf.database.ir_psf_database_interface import PSFTableMAST
+
+
+PSF_MAST_COLUMNS = [column.name for column in PSFTableMAST.__table__.columns
+                    if column.name != 'id']
+
+
+def get_insert_ignore_statement(table, dialect_name):
+    """Return an insert statement for ``table`` that skips duplicates.
+
+    Parameters
+    ----------
+    table : sqlalchemy.Table
+        The table to insert into.
+    dialect_name : str
+        The name of the database dialect, e.g. ``engine.dialect.name``.
+
+    Returns
+    -------
+    statement : sqlalchemy.sql.dml.Insert
+        An insert statement that silently skips rows violating a
+        unique constraint.
+    """
+
+    if dialect_name == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    elif dialect_name == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    else:
+        raise ValueError('Duplicate-skipping inserts are not supported for '
+                         'the {} dialect'.format(dialect_name))
+
+
+def _to_python_list(values, nrows):
+    """Convert a column (or a scalar) to a list of native Python values.
+
+    NaN floats are converted to ``None`` so they are stored as NULL.
+
+    Parameters
+    ----------
+    values : scalar or array_like
+        The column values.  Scalars are repeated ``nrows`` times.
+    nrows : int
+        The number of rows in the exposure batch.
+
+    Returns
+    -------
+    column : list
+        The column as a list of Python ints, floats, strings, datetimes
+        or ``None``.
+    """
+
+    if values is None or np.ndim(values) == 0:
+        if isinstance(values, np.generic):
+            values = values.item()
+        if isinstance(values, float) and np.isnan(values):
+            values = None
+        return [values] * nrows
+
+    array = np.asarray(values)
+    if len(array) != nrows:
+        raise ValueError('Column has {} values, expected {}'.format(
+            len(array), nrows))
+    column = array.tolist()
+    if array.dtype.kind == 'f':
+        for index in np.flatnonzero(np.isnan(array)):
+            column[index] = None
+    return column
+
+
+def exposure_batch_to_records(exposure_batch):
+    """Convert a column batch for one exposure to a list of row dicts.
+
+    Parameters
+    ----------
+    exposure_batch : dict
+        Maps ``ir_psf_mast`` column names to arrays or scalars.  Must
+        contain ``rootname`` and ``psf_x_center``; nullable columns
+        that are absent are stored as NULL.  Keys that are not columns
+        of ``ir_psf_mast`` are ignored.
+
+    Returns
+    -------
+    records : list
+        A list of dictionaries, one per PSF, ready for executemany.
+    """
+
+    nrows = len(exposure_batch['psf_x_center'])
+    columns = {name: _to_python_list(exposure_batch.get(name), nrows)
+               for name in PSF_MAST_COLUMNS}
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def count_rows_by_rootname(connection, rootnames):
+    """Return the number of ir_psf_mast rows for each of ``rootnames``.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        An open connection to the ir_psf database.
+    rootnames : list
+        The rootnames to count.
+
+    Returns
+    -------
+    counts : dict
+        Maps rootname to its number of rows.  Rootnames with no rows
+        are mapped to 0.
+    """
+
+    table = PSFTableMAST.__table__
+    query = select([table.c.rootname, func.count()])\
+        .where(table.c.rootname.in_(rootnames))\
+        .group_by(table.c.rootname)
+    counts = {rootname: 0 for rootname in rootnames}
+    counts.update(dict(connection.execute(query).fetchall()))
+    return counts
+
+
+def insert_psf_batches(connection, exposure_batches):
+    """Insert one or more exposure batches with a single executemany.
+
+    This does not manage the transaction; use ``write_psf_batches``
+    or call this inside ``engine.begin()``.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        An open connection to the ir_psf database, within a transaction.
+    exposure_batches : list
+        A list of column batches (see ``exposure_batch_to_records``).
+
+    Returns
+    -------
+    counts : dict
+        Maps each rootname to a ``(inserted, skipped)`` tuple.
+    """
+
+    submitted, records = {}, []
+    for exposure_batch in exposure_batches:
+        rootname = exposure_batch['rootname']
+        exposure_records = exposure_batch_to_records(exposure_batch)
+        submitted[rootname] = submitted.get(rootname, 0) + len(exposure_records)
+        records.extend(exposure_records)
+
+    if not records:
+        return {rootname: (0, 0) for rootname in submitted}
+
+    rootnames = list(submitted)
+    before = count_rows_by_rootname(connection, rootnames)
+    statement = get_insert_ignore_statement(PSFTableMAST.__table__,
+                                            connection.dialect.name)
+    connection.execute(statement, records)
+    after = count_rows_by_rootname(connection, rootnames)
+
+    counts = {}
+    for rootname in rootnames:
+        inserted = after[rootname] - before[rootname]
+        counts[rootname] = (inserted, submitted[rootname] - inserted)
+    return counts
+
+
+def write_psf_batches(engine, exposure_batches):
+    """Insert exposure batches in one transaction and log the results.
+
+    Either every exposure in ``exposure_batches`` is committed or, if
+    an error occurs, none of them are and the error is raised.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The ir_psf database engine.
+    exposure_batches : list
+        A list of column batches (see ``exposure_batch_to_records``).
+
+    Returns
+    -------
+    counts : dict
+        Maps each rootname to a ``(inserted, skipped)`` tuple.
+    """
+
+    with engine.begin() as connection:
+        counts = insert_psf_batches(connection, exposure_batches)
+
+    for rootname, (inserted, skipped) in counts.items():
+        logging.info('Inserted {} psf records for {} into database ({} '
+                     'duplicates skipped)'.format(inserted, rootname, skipped))
+    return counts
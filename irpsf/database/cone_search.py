@@ -0,0 +1,120 @@
+"""Cone searches of the ir_psf_mast table.
+
+A cone is covered by a few ranges of the ``healpix`` column (see
+irpsf.database.healpix), which the index of the column turns into range
+scans, together with the optional filter and focus cuts.  The candidate
+PSFs are then cut exactly on their angular distance to the center of
+the cone, with NumPy.  PSFs whose healpix is still NULL (ingested before
+the column was added, see backfill_healpix.py) are not found.
+
+The results are returned as a columnar structure: a dictionary of NumPy
+arrays sorted by distance, holding a ``distance`` column in arcseconds
+besides the selected columns of the table.
+
+Use
+---
+    This module is intended to be imported by analysis code:
+
+        from irpsf.database.cone_search import cone_search
+        psfs = cone_search(150.1, 2.2, 30., filters=['F160W'], focus_range=(-1, 1))
+        psfs['psf_flux'][psfs['distance'] < 10]
+"""
+
+import numpy as np
+from sqlalchemy import and_
+from sqlalchemy import Numeric
+from sqlalchemy import or_
+from sqlalchemy import select
+
+from irpsf.database.healpix import get_angular_distance, get_disc_ranges, get_healpix_order
+from irpsf.database.ir_psf_database_interface import get_engine, retry_on_disconnect
+from irpsf.database.ir_psf_database_interface import PSFTableMAST
+
+
+def get_cone_query(ra, dec, radius, filters=None, focus_range=None, columns=None):
+    """Return the query of the candidate PSFs of a cone.
+
+    Parameters
+    ----------
+    ra : float
+        The right ascension of the center of the cone, in degrees.
+    dec : float
+        The declination of the center of the cone, in degrees.
+    radius : float
+        The radius of the cone, in arcseconds.
+    filters : list, optional
+        The filters to keep, all by default.
+    focus_range : tuple, optional
+        The (minimum, maximum) focus to keep, both included.  PSFs
+        without a focus are not kept.  All PSFs by default.
+    columns : list, optional
+        The columns to select, besides psf_ra and psf_dec.  All of
+        them by default.
+
+    Returns
+    -------
+    query : sqlalchemy.sql.Select
+        The query of the PSFs in the HEALPix ranges covering the cone.
+    """
+
+    table = PSFTableMAST.__table__
+    columns = [column.name for column in table.columns] if columns is None else list(columns)
+    columns += [column for column in ('psf_ra', 'psf_dec') if column not in columns]
+
+    ranges = get_disc_ranges(ra, dec, radius / 3600., get_healpix_order())
+    query = select([table.c[column] for column in columns]).where(
+        or_(*[table.c.healpix.between(first, last) for first, last in ranges]))
+    if filters is not None:
+        query = query.where(table.c.filter.in_(filters))
+    if focus_range is not None:
+        query = query.where(and_(table.c.focus >= focus_range[0], table.c.focus <= focus_range[1]))
+
+    return query
+
+
+def cone_search(ra, dec, radius, filters=None, focus_range=None, columns=None):
+    """Return the PSFs within a cone.
+
+    Parameters
+    ----------
+    ra : float
+        The right ascension of the center of the cone, in degrees.
+    dec : float
+        The declination of the center of the cone, in degrees.
+    radius : float
+        The radius of the cone, in arcseconds.
+    filters : list, optional
+        The filters to keep, all by default.
+    focus_range : tuple, optional
+        The (minimum, maximum) focus to keep, both included.  PSFs
+        without a focus are not kept.  All PSFs by default.
+    columns : list, optional
+        The columns to return, besides psf_ra, psf_dec and distance.
+        All of them by default.
+
+    Returns
+    -------
+    psfs : dict
+        Maps the column names and ``distance``, the distance to the
+        center of the cone in arcseconds, to NumPy arrays sorted by
+        distance.  Numeric columns are float arrays, with NULL as NaN.
+    """
+
+    query = get_cone_query(ra, dec, radius, filters, focus_range, columns)
+    rows = retry_on_disconnect(lambda: get_engine().execute(query).fetchall())
+
+    psfs = {}
+    for index, column in enumerate(query.inner_columns):
+        values = [row[index] for row in rows]
+        if isinstance(column.type, Numeric):
+            psfs[column.name] = np.array(values, dtype=float)
+        else:
+            psfs[column.name] = np.array(values)
+
+    distance = get_angular_distance(ra, dec, psfs['psf_ra'], psfs['psf_dec']) * 3600.
+    within = np.flatnonzero(distance <= radius)
+    order = within[np.argsort(distance[within], kind='stable')]
+    psfs = {column: values[order] for column, values in psfs.items()}
+    psfs['distance'] = distance[order]
+
+    return psfs
@@ -0,0 +1,237 @@
+"""HEALPix indexing of sky positions, in the NESTED scheme.
+
+The ``healpix`` column of the ir_psf_mast table holds the NESTED
+HEALPix pixel of each PSF at order ``SETTINGS['healpix_order']``
+(default 20, i.e. pixels of about 0.2 arcsec), so that PSFs close on
+the sky have close ids.  A pixel ``p`` at a coarser order ``k`` holds
+the pixels ``p << 2 * (order - k)`` to ``((p + 1) << 2 * (order - k)) - 1``,
+so a cone is covered by a few id ranges (see get_disc_ranges).
+
+The pixel ids are those of healpy/astropy-healpix (``nest=True``); only
+the functions needed here are implemented, with NumPy, after the
+reference implementation (healpix_base).
+
+Use
+---
+    This module is intended to be imported by the ingestion and query
+    modules:
+
+        from irpsf.database.healpix import ang2pix
+        healpix = ang2pix(ra, dec, get_healpix_order())
+"""
+
+import numpy as np
+
+from irpsf.settings.settings import SETTINGS
+
+# The row and column offsets of the 12 base pixels
+JRLL = np.array([2, 2, 2, 2, 3, 3, 3, 3, 4, 4, 4, 4])
+JPLL = np.array([1, 3, 5, 7, 0, 2, 4, 6, 1, 3, 5, 7])
+
+# An upper bound of the angular distance between the center of a pixel
+# and any of its points, in units of the mean pixel size sqrt(pi / 3) / nside
+MAX_PIXRAD_FACTOR = 1.5
+
+MAX_ORDER = 29
+
+
+def get_healpix_order():
+    """Return the order of the healpix column.
+
+    Returns
+    -------
+    order : int
+        ``SETTINGS['healpix_order']``, 20 by default.  The backfill
+        script must be run with -all after changing it.
+    """
+
+    return SETTINGS.get('healpix_order', 20)
+
+
+def _spread_bits(values):
+    """Interleave the bits of integers with zeros: 0b111 -> 0b10101."""
+
+    values = values.astype(np.int64)
+    result = np.zeros_like(values)
+    for bit in range(MAX_ORDER + 1):
+        result |= ((values >> bit) & 1) << (2 * bit)
+    return result
+
+
+def _compress_bits(values):
+    """Take every other bit of integers: 0b10101 -> 0b111."""
+
+    result = np.zeros_like(values)
+    for bit in range(MAX_ORDER + 1):
+        result |= ((values >> (2 * bit)) & 1) << bit
+    return result
+
+
+def ang2pix(ra, dec, order):
+    """Return the NESTED HEALPix pixels of sky positions.
+
+    Parameters
+    ----------
+    ra : array_like
+        The right ascensions, in degrees.
+    dec : array_like
+        The declinations, in degrees.
+    order : int
+        The HEALPix order, nside = 2**order.
+
+    Returns
+    -------
+    pixels : numpy.ndarray
+        The pixel ids, as int64.
+    """
+
+    nside = 1 << order
+    ra, dec = np.broadcast_arrays(np.asarray(ra, dtype=float), np.asarray(dec, dtype=float))
+    z = np.sin(np.radians(dec))
+    za = np.abs(z)
+    tt = np.mod(np.radians(ra), 2 * np.pi) / (np.pi / 2)
+    tt = np.where(tt >= 4, 0., tt)
+
+    # Equatorial region
+    temp1 = nside * (0.5 + tt)
+    temp2 = nside * z * 0.75
+    jp = (temp1 - temp2).astype(np.int64)
+    jm = (temp1 + temp2).astype(np.int64)
+    ifp, ifm = jp // nside, jm // nside
+    face = np.where(ifp == ifm, ifp | 4, np.where(ifp < ifm, ifp, ifm + 8))
+    ix = jm & (nside - 1)
+    iy = nside - (jp & (nside - 1)) - 1
+
+    # Polar caps, using cos(dec) rather than 1 - |z| close to the poles
+    polar = za > 2. / 3
+    ntt = np.minimum(tt.astype(np.int64), 3)
+    tp = tt - ntt
+    tmp = np.where(za < 0.99, nside * np.sqrt(3 * (1 - za)),
+                   nside * np.cos(np.radians(dec)) / np.sqrt((1 + za) / 3))
+    jp_polar = np.minimum((tp * tmp).astype(np.int64), nside - 1)
+    jm_polar = np.minimum(((1 - tp) * tmp).astype(np.int64), nside - 1)
+    north = z >= 0
+    face = np.where(polar, np.where(north, ntt, ntt + 8), face)
+    ix = np.where(polar, np.where(north, nside - jm_polar - 1, jp_polar), ix)
+    iy = np.where(polar, np.where(north, nside - jp_polar - 1, jm_polar), iy)
+
+    return face.astype(np.int64) * nside * nside + _spread_bits(ix) + (_spread_bits(iy) << 1)
+
+
+def pix2ang(pixels, order):
+    """Return the centers of NESTED HEALPix pixels.
+
+    Parameters
+    ----------
+    pixels : array_like
+        The pixel ids.
+    order : int
+        The HEALPix order, nside = 2**order.
+
+    Returns
+    -------
+    ra : numpy.ndarray
+        The right ascensions of the centers, in degrees.
+    dec : numpy.ndarray
+        The declinations of the centers, in degrees.
+    """
+
+    nside = 1 << order
+    pixels = np.asarray(pixels, dtype=np.int64)
+    face = pixels >> (2 * order)
+    local = pixels & (nside * nside - 1)
+    ix, iy = _compress_bits(local), _compress_bits(local >> 1)
+
+    jr = JRLL[face] * nside - ix - iy - 1
+    nr = np.where(jr < nside, jr, np.where(jr > 3 * nside, 4 * nside - jr, nside))
+    tmp = nr.astype(float)**2 * 4. / (12. * nside * nside)
+    z = np.where(jr < nside, 1 - tmp,
+                 np.where(jr > 3 * nside, tmp - 1, (2 * nside - jr) * 2. / (3 * nside)))
+
+    phi_index = JPLL[face] * nr + ix - iy
+    phi_index = np.where(phi_index < 0, phi_index + 8 * nr, phi_index)
+    ra = np.degrees(np.pi / 4 * phi_index / nr)
+    dec = np.degrees(np.arcsin(np.clip(z, -1, 1)))
+
+    return ra, dec
+
+
+def get_angular_distance(ra1, dec1, ra2, dec2):
+    """Return the angular distances between sky positions.
+
+    Parameters
+    ----------
+    ra1, dec1 : array_like
+        The first positions, in degrees.
+    ra2, dec2 : array_like
+        The second positions, in degrees.
+
+    Returns
+    -------
+    distance : numpy.ndarray
+        The distances, in degrees, from the haversine formula.
+    """
+
+    ra1, dec1, ra2, dec2 = (np.radians(value) for value in (ra1, dec1, ra2, dec2))
+    a = np.sin((dec2 - dec1) / 2)**2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2)**2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+
+def get_max_pixrad(order):
+    """Return an upper bound of the radius of the pixels of an order, in degrees."""
+
+    return MAX_PIXRAD_FACTOR * np.degrees(np.sqrt(np.pi / 3) / (1 << order))
+
+
+def get_disc_ranges(ra, dec, radius, order):
+    """Return pixel id ranges covering a cone.
+
+    The pixels are refined from order 0 down to the order whose pixels
+    are about the size of the cone, or ``order`` if coarser; pixels
+    entirely within the cone are kept whole and pixels that cannot
+    intersect it are dropped.  The ranges may cover some pixels outside
+    the cone, but never miss one inside it.
+
+    Parameters
+    ----------
+    ra : float
+        The right ascension of the center of the cone, in degrees.
+    dec : float
+        The declination of the center of the cone, in degrees.
+    radius : float
+        The radius of the cone, in degrees.
+    order : int
+        The order of the returned pixel ids.
+
+    Returns
+    -------
+    ranges : list
+        Sorted, non-overlapping (first, last) pixel id ranges at
+        ``order``, both ends included.
+    """
+
+    pixel_size = np.degrees(np.sqrt(np.pi / 3))
+    last_order = int(np.clip(np.ceil(np.log2(pixel_size / max(radius, 1e-12))), 0, order))
+
+    ranges = []
+    pixels = np.arange(12, dtype=np.int64)
+    for level in range(last_order + 1):
+        distance = get_angular_distance(ra, dec, *pix2ang(pixels, level))
+        max_pixrad = get_max_pixrad(level)
+        inside = distance + max_pixrad <= radius
+        partial = (distance <= radius + max_pixrad) & ~inside
+        keep = inside | partial if level == last_order else inside
+
+        shift = 2 * (order - level)
+        ranges.extend(zip((pixels[keep] << shift).tolist(),
+                          (((pixels[keep] + 1) << shift) - 1).tolist()))
+        pixels = ((pixels[partial] << 2)[:, None] + np.arange(4)).ravel()
+
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+
+    return merged
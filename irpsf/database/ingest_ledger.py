@@ -0,0 +1,195 @@
+"""Track which stardb_xym files have been ingested into ir_psf_mast.
+
+Every ingested ``*.stardb_xym`` file is recorded in the
+``ir_psf_ingest_ledger`` table along with its size and modification
+time at ingest and the number of PSFs that were parsed, inserted and
+skipped.  Comparing the filesystem against the ledger in a single pass
+then yields the files that are new or have changed since they were
+ingested, so that unchanged exposures are never re-read.
+
+Ledger records are written in the same transaction as the exposure's
+PSF records (see ``write_ingested_exposures``), so an interrupted run
+can simply be restarted: exposures committed before the interruption
+are in the ledger and are skipped, and nothing else was written.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.database.ingest_ledger import get_changed_xym_files
+        new_files, changed = get_changed_xym_files(session, filt, directory)
+"""
+
+import datetime
+import logging
+import os
+
+from irpsf.database.bulk_ingest import insert_psf_batches
+from irpsf.database.ir_psf_database_interface import IngestLedger
+from irpsf.database.ir_psf_database_interface import PSFTableMAST
+from irpsf.database.psf_rollups import add_exposures, get_last_id, remove_exposures
+
+
+def scan_xym_files(directory):
+    """Return the size and modification time of every xym file.
+
+    Parameters
+    ----------
+    directory : str
+        The directory holding the ``*.stardb_xym`` files of a filter.
+
+    Returns
+    -------
+    xym_files : dict
+        Maps each rootname (the first nine characters of the file name)
+        to a ``(path, size, mtime_ns)`` tuple.
+    """
+
+    xym_files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith('.stardb_xym'):
+                stat = entry.stat()
+                xym_files[entry.name[0:9]] = (entry.path, stat.st_size,
+                                              stat.st_mtime_ns)
+    return xym_files
+
+
+def get_ledger(session, filt):
+    """Return the ledger entries for a filter.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        A session connected to the ir_psf database.
+    filt : str
+        The filter being processed.
+
+    Returns
+    -------
+    ledger : dict
+        Maps each ingested rootname to its ``(size, mtime_ns)`` at ingest.
+    """
+
+    results = session.query(IngestLedger.rootname, IngestLedger.file_size,
+                            IngestLedger.file_mtime_ns)\
+        .filter(IngestLedger.filter == filt).all()
+    return {rootname: (size, mtime_ns) for rootname, size, mtime_ns in results}
+
+
+def get_changed_xym_files(session, filt, directory):
+    """Diff the xym files on disk against the ledger.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        A session connected to the ir_psf database.
+    filt : str
+        The filter being processed.
+    directory : str
+        The directory holding the ``*.stardb_xym`` files of ``filt``.
+
+    Returns
+    -------
+    new_files : dict
+        Maps the rootname of each new or changed file to its
+        ``(path, size, mtime_ns)``.
+    changed : set
+        The rootnames in ``new_files`` that were ingested before and
+        have since changed on disk.
+    """
+
+    xym_files = scan_xym_files(directory)
+    ledger = get_ledger(session, filt)
+
+    new_files = {rootname: xym_file for rootname, xym_file in xym_files.items()
+                 if ledger.get(rootname) != xym_file[1:]}
+    changed = set(rootname for rootname in new_files if rootname in ledger)
+
+    return new_files, changed
+
+
+def make_ledger_record(filt, rootname, xym_file, n_stars):
+    """Return a ledger record for an exposure about to be ingested.
+
+    Parameters
+    ----------
+    filt : str
+        The filter being processed.
+    rootname : str
+        The rootname of the exposure.
+    xym_file : tuple
+        The ``(path, size, mtime_ns)`` of the exposure's xym file.
+    n_stars : int
+        The number of PSFs parsed from the file.
+
+    Returns
+    -------
+    ledger_record : dict
+        The record; its insert counts are filled in by
+        ``write_ingested_exposures``.
+    """
+
+    path, size, mtime_ns = xym_file
+    return {'rootname': rootname, 'filter': filt, 'xym_path': path,
+            'file_size': size, 'file_mtime_ns': mtime_ns, 'n_stars': n_stars,
+            'n_inserted': 0, 'n_skipped': 0}
+
+
+def write_ingested_exposures(engine, exposure_batches, ledger_records,
+                             replace_rootnames=()):
+    """Insert exposure batches and their ledger records in one transaction.
+
+    The PSF rollups are updated in the same transaction (see
+    irpsf.database.psf_rollups).
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The ir_psf database engine.
+    exposure_batches : list
+        Column batches, as accepted by
+        ``irpsf.database.bulk_ingest.insert_psf_batches``.
+    ledger_records : list
+        One record per ingested exposure (see ``make_ledger_record``),
+        including exposures without any PSFs.
+    replace_rootnames : iterable, optional
+        Rootnames whose existing ir_psf_mast rows are deleted before the
+        insert, e.g. because their xym file changed.
+
+    Returns
+    -------
+    counts : dict
+        Maps each rootname in ``exposure_batches`` to an
+        ``(inserted, skipped)`` tuple.
+    """
+
+    psf_table = PSFTableMAST.__table__
+    ledger_table = IngestLedger.__table__
+    replace_rootnames = list(replace_rootnames)
+    rootnames = [record['rootname'] for record in ledger_records]
+
+    with engine.begin() as connection:
+        if replace_rootnames:
+            remove_exposures(connection, replace_rootnames)
+            connection.execute(psf_table.delete()
+                               .where(psf_table.c.rootname.in_(replace_rootnames)))
+        last_id = get_last_id(connection)
+        counts = insert_psf_batches(connection, exposure_batches)
+        add_exposures(connection, exposure_batches, counts, last_id)
+
+        ingested_at = datetime.datetime.now()
+        for record in ledger_records:
+            record['n_inserted'], record['n_skipped'] = counts.get(record['rootname'], (0, 0))
+            record['ingested_at'] = ingested_at
+        if rootnames:
+            connection.execute(ledger_table.delete()
+                               .where(ledger_table.c.rootname.in_(rootnames)))
+            connection.execute(ledger_table.insert(), ledger_records)
+
+    for record in ledger_records:
+        logging.info('Inserted {} psf records for {} into database ({} '
+                     'duplicates skipped)'.format(record['n_inserted'],
+                                                  record['rootname'],
+                                                  record['n_skipped']))
+    return counts
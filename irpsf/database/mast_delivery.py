@@ -0,0 +1,310 @@
+"""Incremental export of the ir_psf_mast table for delivery to MAST.
+
+Every export is recorded in the ``ir_psf_mast_delivery`` table with the
+range of ``ir_psf_mast`` ids it holds.  The largest recorded id is the
+high-watermark: the next export holds the rows with a larger id, up to
+the largest id when it starts, so rows added while it runs are left
+for the next one.  The rows are read in id order through a server-side
+cursor and written straight to the deliverable CSV, so an export takes
+constant memory and time proportional to the number of new rows.
+
+The whole table can also be exported, without recording a delivery,
+and the rows can be written as a Parquet dataset instead of a CSV file
+(see irpsf.database.parquet_export).
+
+Rows of an exposure re-ingested after its xym file changed get new ids,
+so they are delivered again.  Concurrent ingests may commit their rows
+out of id order, and rows committed after an export with a smaller id
+than its watermark would never be exported, so the largest id of an
+export is read once the transactions writing to ir_psf_mast have
+ended (see get_committed_last_id).
+
+Use
+---
+    This module is intended to be imported by the export script:
+
+        from irpsf.database.mast_delivery import export_new_rows
+        n_rows = export_new_rows(engine, 'ir_psf_mast_2021_06_01_deliver.csv')
+"""
+
+import datetime
+import logging
+import os
+import shutil
+
+from sqlalchemy import func
+from sqlalchemy import select
+
+from irpsf.database.ir_psf_database_interface import MASTDelivery, PSFTableMAST
+
+# The healpix column indexes the table for cone searches and is not delivered
+MAST_COLUMNS = [column.name for column in PSFTableMAST.__table__.columns
+                if column.name != 'healpix']
+
+
+def format_value(value):
+    """Format a value as in a ``mysqldump --tab`` file.
+
+    Parameters
+    ----------
+    value : object
+        The value of a column.
+
+    Returns
+    -------
+    text : str
+        The value as text, ``\\N`` for NULL.
+    """
+
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+def get_watermark(connection):
+    """Return the largest ir_psf_mast id delivered so far.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database.
+
+    Returns
+    -------
+    last_id : int
+        The high-watermark, 0 if nothing was exported yet.
+    """
+
+    table = MASTDelivery.__table__
+    return connection.execute(select([func.max(table.c.last_id)])).scalar() or 0
+
+
+def get_committed_last_id(connection):
+    """Return the largest ir_psf_mast id, once no smaller id can be committed.
+
+    With MySQL and PostgreSQL, the table is locked for reading, which
+    waits for the transactions writing to it to end, while the id is
+    read.  Later transactions get larger ids.  SQLite runs one write
+    transaction at a time, so its rows are committed in id order.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database, outside of a transaction.
+
+    Returns
+    -------
+    last_id : int
+        The largest id, 0 if the table is empty.
+    """
+
+    table = PSFTableMAST.__table__
+    query = select([func.max(table.c.id)])
+    dialect_name = connection.dialect.name
+    if dialect_name == 'mysql':
+        connection.execute('LOCK TABLES {} READ'.format(table.name))
+        try:
+            return connection.execute(query).scalar() or 0
+        finally:
+            connection.execute('UNLOCK TABLES')
+    elif dialect_name == 'postgresql':
+        with connection.begin():
+            connection.execute('LOCK TABLE {} IN SHARE MODE'.format(table.name))
+            return connection.execute(query).scalar() or 0
+    elif dialect_name == 'sqlite':
+        return connection.execute(query).scalar() or 0
+    else:
+        raise ValueError('Incremental exports are not supported for the {} '
+                         'dialect'.format(dialect_name))
+
+
+def stream_rows(connection, first_id, last_id, chunk_size=10000):
+    """Yield the ir_psf_mast rows within an id range, in chunks.
+
+    The rows are read in id order through a server-side cursor.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database.
+    first_id : int
+        The first id to read.
+    last_id : int
+        The last id to read.
+    chunk_size : int, default=10000
+        The number of rows fetched from the cursor at a time.
+
+    Yields
+    ------
+    rows : list
+        Up to ``chunk_size`` rows, with the MAST_COLUMNS.
+    """
+
+    table = PSFTableMAST.__table__
+    result = connection.execution_options(stream_results=True).execute(
+        select([table.c[column] for column in MAST_COLUMNS])
+        .where(table.c.id >= first_id)
+        .where(table.c.id <= last_id)
+        .order_by(table.c.id))
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        result.close()
+
+
+def write_rows(connection, path, first_id, last_id, chunk_size=10000):
+    """Stream the ir_psf_mast rows within an id range to a CSV file.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database.
+    path : str
+        The path of the CSV file, written with a header line.
+    first_id : int
+        The first id to write.
+    last_id : int
+        The last id to write.
+    chunk_size : int, default=10000
+        The number of rows fetched from the cursor at a time.
+
+    Returns
+    -------
+    n_rows : int
+        The number of rows written.
+    """
+
+    n_rows = 0
+    with open(path, 'w') as f:
+        f.write(','.join(MAST_COLUMNS) + '\n')
+        for rows in stream_rows(connection, first_id, last_id, chunk_size):
+            f.writelines(','.join(map(format_value, row)) + '\n' for row in rows)
+            n_rows += len(rows)
+            if n_rows % (100 * chunk_size) < len(rows):
+                logging.info('{} rows written to {}'.format(n_rows, path))
+
+    return n_rows
+
+
+def export_rows(connection, path, first_id, last_id, writer=write_rows, chunk_size=10000):
+    """Export the ir_psf_mast rows within an id range.
+
+    The rows are written to a temporary file, or directory, which is
+    moved into place once complete.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database.
+    path : str
+        The path of the export, which must not exist.
+    first_id : int
+        The first id to export.
+    last_id : int
+        The last id to export.
+    writer : callable, default=write_rows
+        The function writing the rows, with the signature of write_rows,
+        e.g. irpsf.database.parquet_export.write_parquet_dataset.
+    chunk_size : int, default=10000
+        The number of rows fetched from the cursor at a time.
+
+    Returns
+    -------
+    n_rows : int
+        The number of rows exported.
+    """
+
+    if os.path.exists(path):
+        raise FileExistsError('{} already exists; move it before exporting'.format(path))
+
+    logging.info('Exporting ir_psf_mast ids {} to {} to {}'.format(first_id, last_id, path))
+    temp_path = '{}.tmp{}'.format(path, os.getpid())
+    try:
+        n_rows = writer(connection, temp_path, first_id, last_id, chunk_size)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.isdir(temp_path):
+            shutil.rmtree(temp_path)
+        elif os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return n_rows
+
+
+def export_new_rows(engine, path, after_id=None, chunk_size=10000, writer=write_rows):
+    """Export the rows not delivered yet and record the delivery.
+
+    The export waits for the ingests in progress to commit (see
+    get_committed_last_id).  The delivery is recorded once the export
+    is in place.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The ir_psf database engine.
+    path : str
+        The path of the deliverable CSV file (or of the export written
+        by ``writer``).
+    after_id : int, optional
+        Export the rows after this id rather than after the recorded
+        high-watermark, e.g. for the first export after deliveries made
+        from full dumps.
+    chunk_size : int, default=10000
+        The number of rows fetched from the cursor at a time.
+    writer : callable, default=write_rows
+        The function writing the rows, see export_rows.
+
+    Returns
+    -------
+    n_rows : int
+        The number of rows exported.  Nothing is written or recorded if
+        there are no new rows.
+    """
+
+    with engine.connect() as connection:
+        first_id = (get_watermark(connection) if after_id is None else after_id) + 1
+        last_id = get_committed_last_id(connection)
+        if last_id < first_id:
+            logging.info('No rows after id {} to export'.format(first_id - 1))
+            return 0
+
+        n_rows = export_rows(connection, path, first_id, last_id, writer, chunk_size)
+
+        with connection.begin():
+            connection.execute(MASTDelivery.__table__.insert(), {
+                'first_id': first_id, 'last_id': last_id, 'n_rows': n_rows,
+                'path': os.path.abspath(path), 'exported_at': datetime.datetime.now()})
+
+    return n_rows
+
+
+def export_all_rows(engine, path, chunk_size=10000, writer=write_rows):
+    """Export the whole ir_psf_mast table, without recording a delivery.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The ir_psf database engine.
+    path : str
+        The path of the export.
+    chunk_size : int, default=10000
+        The number of rows fetched from the cursor at a time.
+    writer : callable, default=write_rows
+        The function writing the rows, see export_rows.
+
+    Returns
+    -------
+    n_rows : int
+        The number of rows exported.
+    """
+
+    table = PSFTableMAST.__table__
+    with engine.connect() as connection:
+        last_id = connection.execute(select([func.max(table.c.id)])).scalar() or 0
+        return export_rows(connection, path, 1, last_id, writer, chunk_size)
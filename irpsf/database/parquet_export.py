@@ -0,0 +1,178 @@
+"""Export of the ir_psf_mast table as a partitioned Parquet dataset.
+
+The rows are written under ``filter=<filter>/year=<year>/`` directories
+(Hive partitioning), by filter and year of observation (of midexp), so
+readers can skip the partitions and columns they do not need, e.g.:
+
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    table = dataset.to_table(columns=['psf_ra', 'psf_dec'],
+                             filter=(ds.field('filter') == 'F160W') & (ds.field('year') >= 2020))
+
+The coordinates, fluxes and focus are float64, midexp and mjd keep the
+DECIMAL(12, 5) of the table, and date is a timestamp.  The rows are
+read from a server-side cursor (see irpsf.database.mast_delivery) and
+buffered per partition, each buffer being written as a row group of
+``row_group_size`` rows when full, or when ``max_buffered_rows`` rows
+are buffered over all partitions.
+
+This module needs pyarrow, which is imported on first use.
+
+Use
+---
+    This module is intended to be used as a writer of the export
+    functions of irpsf.database.mast_delivery:
+
+        from irpsf.database.mast_delivery import export_all_rows
+        from irpsf.database.parquet_export import write_parquet_dataset
+        n_rows = export_all_rows(engine, 'ir_psf_mast', writer=write_parquet_dataset)
+"""
+
+import datetime
+import logging
+import os
+
+from irpsf.database.mast_delivery import MAST_COLUMNS, stream_rows
+from irpsf.settings.settings import SETTINGS
+
+PARTITION_COLUMNS = ('filter', 'year')
+
+MJD_EPOCH = datetime.datetime(1858, 11, 17)
+
+
+def get_schema():
+    """Return the Arrow schema of the files of the dataset.
+
+    Returns
+    -------
+    schema : pyarrow.Schema
+        The MAST_COLUMNS but the filter, which is a partition column.
+    """
+
+    import pyarrow as pa
+
+    types = {'id': pa.int64(), 'rootname': pa.string(), 'aperture': pa.string(),
+             'midexp': pa.decimal128(12, 5), 'mjd': pa.decimal128(12, 5),
+             'date': pa.timestamp('s')}
+    return pa.schema([(column, types.get(column, pa.float64()))
+                      for column in MAST_COLUMNS if column not in PARTITION_COLUMNS])
+
+
+def get_partition(row):
+    """Return the partition of a row.
+
+    Parameters
+    ----------
+    row : sqlalchemy.engine.RowProxy
+        A row of the ir_psf_mast table.
+
+    Returns
+    -------
+    partition : tuple
+        The filter and the year of midexp.
+    """
+
+    return row['filter'], (MJD_EPOCH + datetime.timedelta(days=float(row['midexp']))).year
+
+
+class PartitionedWriter(object):
+    """Writes rows to a Parquet dataset, one file per partition."""
+
+    def __init__(self, path, row_group_size=100000, max_buffered_rows=1000000):
+        """Create the dataset directory.
+
+        Parameters
+        ----------
+        path : str
+            The directory of the dataset.
+        row_group_size : int, default=100000
+            The number of rows of the row groups.
+        max_buffered_rows : int, default=1000000
+            The number of rows buffered over all partitions above which
+            the largest buffer is written.
+        """
+
+        self.path = path
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.schema = get_schema()
+        self.buffers = {}
+        self.writers = {}
+        self.n_buffered = 0
+        os.makedirs(path)
+
+    def write(self, rows):
+        """Buffer rows, writing the row groups that are full."""
+
+        for row in rows:
+            partition = get_partition(row)
+            buffer = self.buffers.setdefault(partition, [])
+            buffer.append(row)
+            if len(buffer) >= self.row_group_size:
+                self.flush(partition)
+        self.n_buffered += len(rows)
+        while self.n_buffered > self.max_buffered_rows:
+            self.flush(max(self.buffers, key=lambda partition: len(self.buffers[partition])))
+
+    def flush(self, partition):
+        """Write the buffer of a partition as a row group."""
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = self.buffers.pop(partition)
+        self.n_buffered -= len(rows)
+        if partition not in self.writers:
+            directory = os.path.join(self.path, *['{}={}'.format(column, value) for column, value
+                                                  in zip(PARTITION_COLUMNS, partition)])
+            os.makedirs(directory)
+            self.writers[partition] = pq.ParquetWriter(os.path.join(directory, 'part-0.parquet'),
+                                                       self.schema)
+        columns = [pa.array([row[field.name] for row in rows], type=field.type)
+                   for field in self.schema]
+        self.writers[partition].write_table(pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        """Write the remaining buffers and close the files."""
+
+        for partition in list(self.buffers):
+            self.flush(partition)
+        for writer in self.writers.values():
+            writer.close()
+
+
+def write_parquet_dataset(connection, path, first_id, last_id, chunk_size=10000):
+    """Stream the ir_psf_mast rows within an id range to a Parquet dataset.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database.
+    path : str
+        The directory of the dataset.
+    first_id : int
+        The first id to write.
+    last_id : int
+        The last id to write.
+    chunk_size : int, default=10000
+        The number of rows fetched from the cursor at a time.
+
+    Returns
+    -------
+    n_rows : int
+        The number of rows written.
+    """
+
+    writer = PartitionedWriter(path, SETTINGS.get('parquet_row_group_size', 100000),
+                               SETTINGS.get('parquet_max_buffered_rows', 1000000))
+    n_rows = 0
+    try:
+        for rows in stream_rows(connection, first_id, last_id, chunk_size):
+            writer.write(rows)
+            n_rows += len(rows)
+            if n_rows % (100 * chunk_size) < len(rows):
+                logging.info('{} rows written to {}'.format(n_rows, path))
+    finally:
+        writer.close()
+
+    return n_rows
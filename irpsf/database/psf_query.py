@@ -0,0 +1,416 @@
+"""Selection of ir_psf_mast records as NumPy structured arrays.
+
+A selection is described by a selector, a dictionary of cuts built by
+make_selector:
+
+    filters, apertures       the values to keep
+    focus_range, flux_range  (minimum, maximum) of the focus and psf_flux
+    x_range, y_range         (minimum, maximum) of psf_x_center and psf_y_center
+    date_range               (first, last) datetimes of the date column
+    qfit_max                 the maximum qfit
+
+Ranges include their ends, and either end may be None.  Records whose
+cut column is NULL are not selected by a cut on that column.
+
+The rows are read through a server-side cursor and converted chunk by
+chunk to structured arrays (or Arrow record batches), so the rows of
+the database driver are never all held in memory.  Strings are unicode
+fields, dates datetime64[s] (NaT for NULL), id and healpix int64 (-1 for
+a NULL healpix) and the other columns float64 (NaN for NULL).
+
+select_psfs memoizes each selection in the ``psf_query`` cache
+directory (see irpsf.settings.settings.get_cache_dir) as a .npy file
+keyed by the selector, the columns and the watermark of the table: its
+largest id and the time of the last ingest, which change whenever rows
+are added, replaced or deleted by make_ir_psf_table.py.  Cached
+selections are returned memory-mapped.  Columns updated in place, such
+as healpix by backfill_healpix.py, do not change the watermark; use
+cache=False for these.
+
+Use
+---
+    This module is intended to be imported by analysis code:
+
+        from irpsf.database.psf_query import make_selector, select_psfs
+        selector = make_selector(filters=['F160W'], focus_range=(-1, 1), qfit_max=0.05)
+        psfs = select_psfs(selector, columns=['rootname', 'psf_x_center', 'psf_y_center', 'focus'])
+
+        from irpsf.database.psf_query import stream_psfs
+        for batch in stream_psfs(selector, arrow=True):
+            ...
+"""
+
+import datetime
+import decimal
+import glob
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+from sqlalchemy import DateTime
+from sqlalchemy import func
+from sqlalchemy import Integer
+from sqlalchemy import select
+from sqlalchemy import String
+
+from irpsf.database.ir_psf_database_interface import get_engine, retry_on_disconnect
+from irpsf.database.ir_psf_database_interface import IngestLedger, PSFTableMAST
+from irpsf.settings.settings import get_cache_dir, SETTINGS
+
+# The selector keys, with the column they cut on and the kind of cut
+SELECTOR_CUTS = {
+    'filters': ('filter', 'in'),
+    'apertures': ('aperture', 'in'),
+    'focus_range': ('focus', 'range'),
+    'flux_range': ('psf_flux', 'range'),
+    'x_range': ('psf_x_center', 'range'),
+    'y_range': ('psf_y_center', 'range'),
+    'date_range': ('date', 'range'),
+    'qfit_max': ('qfit', 'max')}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+NAT = np.iinfo(np.int64).min
+
+
+def make_selector(**cuts):
+    """Return a selector of ir_psf_mast records.
+
+    Parameters
+    ----------
+    **cuts
+        Any of the SELECTOR_CUTS keys: lists of values for filters and
+        apertures, (minimum, maximum) tuples for the ranges, either of
+        which may be None, and a number for qfit_max.
+
+    Returns
+    -------
+    selector : dict
+        The cuts that are not None, with sorted values and ranges as
+        lists.
+    """
+
+    unknown = set(cuts) - set(SELECTOR_CUTS)
+    if unknown:
+        raise ValueError('Unknown selector keys: {}'.format(', '.join(sorted(unknown))))
+
+    selector = {}
+    for key, value in cuts.items():
+        if value is None:
+            continue
+        kind = SELECTOR_CUTS[key][1]
+        if kind == 'in':
+            selector[key] = sorted([value] if isinstance(value, str) else value)
+        elif kind == 'range':
+            if len(value) != 2:
+                raise ValueError('{} should be a (minimum, maximum) pair'.format(key))
+            selector[key] = list(value)
+        else:
+            selector[key] = value
+
+    return selector
+
+
+def get_dtype(columns):
+    """Return the structured dtype of ir_psf_mast columns.
+
+    Parameters
+    ----------
+    columns : list
+        The column names.
+
+    Returns
+    -------
+    dtype : numpy.dtype
+        Unicode fields for the strings, datetime64[s] for the dates,
+        int64 for the integers and float64 otherwise.
+    """
+
+    table = PSFTableMAST.__table__
+    fields = []
+    for column in columns:
+        column_type = table.c[column].type
+        if isinstance(column_type, String):
+            fields.append((column, 'U{}'.format(column_type.length)))
+        elif isinstance(column_type, DateTime):
+            fields.append((column, 'datetime64[s]'))
+        elif isinstance(column_type, Integer):
+            fields.append((column, 'i8'))
+        else:
+            fields.append((column, 'f8'))
+
+    return np.dtype(fields)
+
+
+def get_selection_query(selector, columns, last_id=None):
+    """Return the query of a selection, in id order.
+
+    Parameters
+    ----------
+    selector : dict
+        The selector, see make_selector.
+    columns : list
+        The columns to select.
+    last_id : int, optional
+        The largest id to select.
+
+    Returns
+    -------
+    query : sqlalchemy.sql.Select
+        The query.
+    """
+
+    table = PSFTableMAST.__table__
+    query = select([table.c[column] for column in columns]).order_by(table.c.id)
+    for key, value in selector.items():
+        column, kind = SELECTOR_CUTS[key]
+        if kind == 'in':
+            query = query.where(table.c[column].in_(value))
+        elif kind == 'range':
+            if value[0] is not None:
+                query = query.where(table.c[column] >= value[0])
+            if value[1] is not None:
+                query = query.where(table.c[column] <= value[1])
+        else:
+            query = query.where(table.c[column] <= value)
+    if last_id is not None:
+        query = query.where(table.c.id <= last_id)
+
+    return query
+
+
+def get_watermark():
+    """Return the watermark of the ir_psf_mast table.
+
+    Returns
+    -------
+    last_id : int
+        The largest id of the table, 0 if empty.
+    last_ingest : str
+        The time of the last ingest recorded in the ledger, '' if none.
+    """
+
+    with get_engine().connect() as connection:
+        last_id = connection.execute(select([func.max(PSFTableMAST.__table__.c.id)])).scalar()
+        last_ingest = connection.execute(select([func.max(IngestLedger.__table__.c.ingested_at)])).scalar()
+
+    return last_id or 0, str(last_ingest or '')
+
+
+def column_to_array(values, dtype):
+    """Convert the values of a column, as returned by the database driver.
+
+    Decimals and datetimes are converted in Python, which is several
+    times faster than letting NumPy convert each object.
+
+    Parameters
+    ----------
+    values : tuple
+        The values, None for NULL.
+    dtype : numpy.dtype
+        The dtype of the column, see get_dtype.
+
+    Returns
+    -------
+    array : numpy.ndarray
+        The values, with NULL as NaN, NaT or -1.
+    """
+
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, decimal.Decimal):
+        values = [None if value is None else float(value) for value in values]
+    elif isinstance(sample, datetime.datetime):
+        seconds = [NAT if value is None else int((value - EPOCH).total_seconds()) for value in values]
+        return np.array(seconds, dtype=np.int64).view(dtype)
+    elif dtype.kind == 'i' and None in values:
+        values = [-1 if value is None else value for value in values]
+
+    return np.array(values, dtype=dtype)
+
+
+def rows_to_array(rows, dtype):
+    """Convert rows to a structured array.
+
+    Parameters
+    ----------
+    rows : list
+        The rows, as returned by the database driver, with the fields
+        of ``dtype``.
+    dtype : numpy.dtype
+        The structured dtype, see get_dtype.
+
+    Returns
+    -------
+    array : numpy.ndarray
+        The rows, with NULL as NaN, NaT or -1.
+    """
+
+    array = np.empty(len(rows), dtype=dtype)
+    for name, values in zip(dtype.names, zip(*rows)):
+        array[name] = column_to_array(values, dtype[name])
+
+    return array
+
+
+def array_to_batch(array):
+    """Convert a structured array to an Arrow record batch.
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        A structured array, see rows_to_array.
+
+    Returns
+    -------
+    batch : pyarrow.RecordBatch
+        The columns of the array, with NaN and NaT as null.
+    """
+
+    import pyarrow as pa
+
+    return pa.RecordBatch.from_arrays([pa.array(array[name], from_pandas=True) for name in array.dtype.names],
+                                      names=list(array.dtype.names))
+
+
+def stream_rows(connection, selector, columns, last_id=None, chunk_size=100000):
+    """Yield the rows of a selection as structured arrays.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database.
+    selector : dict
+        The selector, see make_selector.
+    columns : list
+        The columns to select.
+    last_id : int, optional
+        The largest id to select.
+    chunk_size : int, default=100000
+        The number of rows fetched from the cursor at a time.
+
+    Yields
+    ------
+    chunk : numpy.ndarray
+        Up to ``chunk_size`` rows, in id order.
+    """
+
+    dtype = get_dtype(columns)
+    result = connection.execution_options(stream_results=True).execute(
+        get_selection_query(selector, columns, last_id))
+    try:
+        while True:
+            # The rows of the driver's cursor skip SQLAlchemy's conversion of each value
+            rows = result.cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows_to_array(rows, dtype)
+    finally:
+        result.close()
+
+
+def stream_psfs(selector, columns=None, arrow=False):
+    """Yield the records of a selection in chunks, without caching them.
+
+    Parameters
+    ----------
+    selector : dict
+        The selector, see make_selector.
+    columns : list, optional
+        The columns to select, all of them by default.
+    arrow : bool, default=False
+        Yield pyarrow record batches rather than structured arrays.
+
+    Yields
+    ------
+    chunk : numpy.ndarray or pyarrow.RecordBatch
+        Up to ``SETTINGS['query_chunk_size']`` (default 100000)
+        records, in id order.
+    """
+
+    columns = columns or [column.name for column in PSFTableMAST.__table__.columns]
+    with get_engine().connect() as connection:
+        for chunk in stream_rows(connection, selector, columns,
+                                 chunk_size=SETTINGS.get('query_chunk_size', 100000)):
+            yield array_to_batch(chunk) if arrow else chunk
+
+
+def write_selection(path, selector, columns, last_id):
+    """Write a selection to a .npy file, one chunk at a time.
+
+    The chunks are written to a temporary file, then copied after the
+    header once the number of records is known.
+
+    Parameters
+    ----------
+    path : str
+        The path of the .npy file.
+    selector : dict
+        The selector, see make_selector.
+    columns : list
+        The columns to select.
+    last_id : int
+        The largest id to select.
+    """
+
+    dtype = get_dtype(columns)
+    raw_path = path + '.{}.raw.tmp'.format(os.getpid())
+    temp_path = path + '.{}.tmp'.format(os.getpid())
+    try:
+        n_rows = 0
+        with get_engine().connect() as connection, open(raw_path, 'wb') as raw:
+            for chunk in stream_rows(connection, selector, columns, last_id,
+                                     SETTINGS.get('query_chunk_size', 100000)):
+                raw.write(chunk.tobytes())
+                n_rows += len(chunk)
+
+        with open(temp_path, 'wb') as f, open(raw_path, 'rb') as raw:
+            np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                     'fortran_order': False, 'shape': (n_rows,)})
+            shutil.copyfileobj(raw, f, 2**20)
+        os.replace(temp_path, path)
+    finally:
+        for temp in (raw_path, temp_path):
+            if os.path.exists(temp):
+                os.remove(temp)
+
+
+def select_psfs(selector, columns=None, cache=True):
+    """Return the records of a selection, memoized on disk.
+
+    Parameters
+    ----------
+    selector : dict
+        The selector, see make_selector.
+    columns : list, optional
+        The columns to select, all of them by default.
+    cache : bool, default=True
+        Read and write the selection in the psf_query cache.  Without
+        it, the selection is built in memory.
+
+    Returns
+    -------
+    psfs : numpy.ndarray
+        The records, in id order, as a structured array, memory-mapped
+        from the cache file if ``cache``.
+    """
+
+    columns = list(columns or [column.name for column in PSFTableMAST.__table__.columns])
+    if not cache:
+        chunks = list(stream_psfs(selector, columns))
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=get_dtype(columns))
+
+    watermark = retry_on_disconnect(get_watermark)
+    key = json.dumps([selector, columns], sort_keys=True, default=str)
+    selection = hashlib.sha1(key.encode()).hexdigest()[:16]
+    version = hashlib.sha1(json.dumps(watermark).encode()).hexdigest()[:8]
+    path = os.path.join(get_cache_dir('psf_query'), '{}_{}.npy'.format(selection, version))
+
+    if not os.path.exists(path):
+        retry_on_disconnect(write_selection, path, selector, columns, watermark[0])
+        # Selections made at older watermarks are stale
+        for stale_path in glob.glob(os.path.join(os.path.dirname(path), selection + '_*.npy')):
+            if stale_path != path:
+                os.remove(stale_path)
+
+    return np.load(path, mmap_mode='r')
@@ -0,0 +1,408 @@
+"""Rollups of the PSF statistics by filter, day and detector cell.
+
+The ir_psf_rollup table holds, for each filter, day of observation (of
+midexp) and cell of a grid of ``SETTINGS['rollup_cell_size']`` pixels
+(default 128, i.e. 8 x 8 cells) over the detector, the number of PSFs
+and the count, sum and quantile sketch (see
+irpsf.database.quantile_sketch) of their qfit, sky and focus.  These
+aggregates are mergeable, so the statistics of any group of cells,
+days or filters are computed from its rollups alone, without reading
+ir_psf_mast (see summarize_rollups), and they are updated as PSFs are
+added and removed.
+
+The rollups are updated in the transaction of each ingest batch (see
+irpsf.database.ingest_ledger.write_ingested_exposures): the PSFs of
+replaced exposures are subtracted before they are deleted, and the
+inserted PSFs are added.  rebuild_psf_rollups.py computes them again
+from ir_psf_mast, e.g. after changing rollup_cell_size.
+
+Use
+---
+    This module is intended to be imported by the ingestion code and
+    by analysis code:
+
+        from irpsf.database.psf_rollups import summarize_rollups
+        trends = summarize_rollups(group_by=('filter', 'day'), filters=['F160W'])
+        trends['day'], trends['median_qfit']
+"""
+
+import datetime
+
+import numpy as np
+from sqlalchemy import and_
+from sqlalchemy import bindparam
+from sqlalchemy import func
+from sqlalchemy import select
+
+from irpsf.database.ir_psf_database_interface import get_engine, PSFRollup, PSFTableMAST
+from irpsf.database.psf_query import get_dtype, rows_to_array
+from irpsf.database.quantile_sketch import decode_sketch, encode_sketch, get_quantile
+from irpsf.database.quantile_sketch import make_sketches, merge_sketches
+from irpsf.settings.settings import SETTINGS
+
+# The ir_psf_mast columns the rollups are computed from
+SOURCE_COLUMNS = ['filter', 'midexp', 'psf_x_center', 'psf_y_center', 'qfit', 'sky', 'focus']
+
+# The statistics with a count, a sum and a sketch in the rollups
+STATISTICS = ['qfit', 'sky', 'focus']
+
+KEY_COLUMNS = ['filter', 'day', 'cell_x', 'cell_y']
+
+AGGREGATE_COLUMNS = ['n_psfs'] + ['{}_{}'.format(prefix, statistic) for statistic in STATISTICS
+                                  for prefix in ('n', 'sum')]
+
+MJD_EPOCH = datetime.date(1858, 11, 17)
+
+
+def get_cell_size():
+    """Return the size of the detector cells of the rollups, in pixels."""
+
+    return SETTINGS.get('rollup_cell_size', 128)
+
+
+def batches_to_columns(exposure_batches):
+    """Return the SOURCE_COLUMNS of exposure batches as arrays.
+
+    Parameters
+    ----------
+    exposure_batches : list
+        Column batches, as built by make_ir_psf_table.py.
+
+    Returns
+    -------
+    columns : dict
+        Maps the SOURCE_COLUMNS to arrays of all the PSFs of the
+        batches, with NULL as NaN.
+    """
+
+    dtype = get_dtype(SOURCE_COLUMNS)
+    columns = {name: [] for name in SOURCE_COLUMNS}
+    for exposure_batch in exposure_batches:
+        n_psfs = len(exposure_batch['psf_x_center'])
+        for name in SOURCE_COLUMNS:
+            value = exposure_batch.get(name)
+            if np.ndim(value) == 0:
+                columns[name].append(np.full(n_psfs, np.nan if value is None else value, dtype=dtype[name]))
+            else:
+                columns[name].append(np.asarray(value, dtype=dtype[name]))
+
+    return {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype[name])
+            for name, arrays in columns.items()}
+
+
+def read_columns(connection, where):
+    """Return the SOURCE_COLUMNS of ir_psf_mast rows as arrays.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database.
+    where : sqlalchemy.sql.ClauseElement
+        The condition on the rows.
+
+    Returns
+    -------
+    columns : dict
+        Maps the SOURCE_COLUMNS to arrays, with NULL as NaN.
+    """
+
+    table = PSFTableMAST.__table__
+    rows = connection.execute(select([table.c[name] for name in SOURCE_COLUMNS]).where(where)).fetchall()
+    array = rows_to_array(rows, get_dtype(SOURCE_COLUMNS))
+
+    return {name: array[name] for name in SOURCE_COLUMNS}
+
+
+def get_rollup_deltas(columns, sign=1):
+    """Return the rollups of PSFs, to add to or subtract from the table.
+
+    Parameters
+    ----------
+    columns : dict
+        Maps the SOURCE_COLUMNS to arrays, see batches_to_columns.
+    sign : int, default=1
+        -1 for the rollups of PSFs to remove.
+
+    Returns
+    -------
+    deltas : dict
+        Maps (filter, day, cell_x, cell_y) keys to dictionaries of the
+        AGGREGATE_COLUMNS and the (buckets, counts) sketch of each of
+        the STATISTICS, multiplied by ``sign``.
+    """
+
+    if len(columns['psf_x_center']) == 0:
+        return {}
+
+    cell_size = get_cell_size()
+    filters, filter_index = np.unique(columns['filter'], return_inverse=True)
+    keys = np.stack([filter_index.ravel(),
+                     np.floor(columns['midexp']).astype(np.int64),
+                     (columns['psf_x_center'] // cell_size).astype(np.int64),
+                     (columns['psf_y_center'] // cell_size).astype(np.int64)], axis=1)
+    keys, groups = np.unique(keys, axis=0, return_inverse=True)
+    groups = groups.ravel()
+    n_groups = len(keys)
+
+    aggregates = {'n_psfs': np.bincount(groups, minlength=n_groups)}
+    sketches = {}
+    for statistic in STATISTICS:
+        values = columns[statistic]
+        valid = np.isfinite(values)
+        aggregates['n_' + statistic] = np.bincount(groups[valid], minlength=n_groups)
+        aggregates['sum_' + statistic] = np.bincount(groups[valid], weights=values[valid], minlength=n_groups)
+        sketches[statistic] = make_sketches(values[valid], groups[valid], n_groups)
+
+    deltas = {}
+    for group, (filter_number, day, cell_x, cell_y) in enumerate(keys.tolist()):
+        delta = {column: sign * aggregates[column][group].item() for column in AGGREGATE_COLUMNS}
+        for statistic in STATISTICS:
+            buckets, counts = sketches[statistic][group]
+            delta[statistic] = (buckets, sign * counts)
+        deltas[(str(filters[filter_number]), MJD_EPOCH + datetime.timedelta(days=day), cell_x, cell_y)] = delta
+
+    return deltas
+
+
+def merge_aggregates(first, second):
+    """Return the sum of two rollups, as returned by get_rollup_deltas."""
+
+    merged = {column: first[column] + second[column] for column in AGGREGATE_COLUMNS}
+    for statistic in STATISTICS:
+        merged[statistic] = merge_sketches(first[statistic], second[statistic])
+
+    return merged
+
+
+def merge_deltas(first, second):
+    """Return the sum of two dictionaries of rollups."""
+
+    merged = dict(first)
+    for key, delta in second.items():
+        merged[key] = merge_aggregates(merged[key], delta) if key in merged else delta
+
+    return merged
+
+
+def row_to_aggregates(row):
+    """Return the rollup of a row of the ir_psf_rollup table."""
+
+    aggregates = {column: row[column] for column in AGGREGATE_COLUMNS}
+    for statistic in STATISTICS:
+        aggregates[statistic] = decode_sketch(row[statistic + '_sketch'])
+
+    return aggregates
+
+
+def apply_rollup_deltas(connection, deltas):
+    """Add rollups to the ir_psf_rollup table.
+
+    Rollups whose number of PSFs drops to 0 are deleted.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database, within a transaction.
+    deltas : dict
+        The rollups, see get_rollup_deltas.
+    """
+
+    if not deltas:
+        return
+
+    table = PSFRollup.__table__
+    query = select([table])\
+        .where(table.c.filter.in_(set(key[0] for key in deltas)))\
+        .where(table.c.day.in_(set(key[1] for key in deltas)))
+    existing = {}
+    for row in connection.execute(query).fetchall():
+        key = tuple(row[column] for column in KEY_COLUMNS)
+        if key in deltas:
+            existing[key] = row
+
+    inserts, updates, deletes = [], [], []
+    for key, delta in deltas.items():
+        row = existing.get(key)
+        aggregates = delta if row is None else merge_aggregates(row_to_aggregates(row), delta)
+        if aggregates['n_psfs'] <= 0:
+            if row is not None:
+                deletes.append(row['id'])
+            continue
+
+        record = {'b_' + column: aggregates[column] for column in AGGREGATE_COLUMNS}
+        for statistic in STATISTICS:
+            record['b_{}_sketch'.format(statistic)] = encode_sketch(aggregates[statistic])
+        if row is None:
+            record.update(('b_' + column, value) for column, value in zip(KEY_COLUMNS, key))
+            inserts.append(record)
+        else:
+            record['b_id'] = row['id']
+            updates.append(record)
+
+    columns = AGGREGATE_COLUMNS + [statistic + '_sketch' for statistic in STATISTICS]
+    if deletes:
+        connection.execute(table.delete().where(table.c.id.in_(deletes)))
+    if updates:
+        connection.execute(table.update().where(table.c.id == bindparam('b_id'))
+                           .values({column: bindparam('b_' + column) for column in columns}), updates)
+    if inserts:
+        connection.execute(table.insert().values({column: bindparam('b_' + column)
+                                                  for column in KEY_COLUMNS + columns}), inserts)
+
+
+def get_last_id(connection):
+    """Return the largest id of the ir_psf_mast table, 0 if empty."""
+
+    return connection.execute(select([func.max(PSFTableMAST.__table__.c.id)])).scalar() or 0
+
+
+def remove_exposures(connection, rootnames):
+    """Subtract the PSFs of exposures about to be deleted from the rollups.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database, within the transaction
+        deleting the exposures.
+    rootnames : list
+        The rootnames of the exposures.
+    """
+
+    columns = read_columns(connection, PSFTableMAST.__table__.c.rootname.in_(rootnames))
+    apply_rollup_deltas(connection, get_rollup_deltas(columns, sign=-1))
+
+
+def add_exposures(connection, exposure_batches, counts, last_id):
+    """Add the PSFs of just inserted exposures to the rollups.
+
+    The PSFs of exposures inserted without skipped duplicates are taken
+    from their batches.  Those of the other exposures are read back from
+    the table, as the rows with an id larger than ``last_id``.
+
+    Parameters
+    ----------
+    connection : sqlalchemy.engine.Connection
+        A connection to the ir_psf database, within the transaction
+        inserting the exposures.
+    exposure_batches : list
+        The inserted column batches.
+    counts : dict
+        Maps each rootname to an ``(inserted, skipped)`` tuple, as
+        returned by irpsf.database.bulk_ingest.insert_psf_batches.
+    last_id : int
+        The largest id of ir_psf_mast before the insert.
+    """
+
+    complete = [batch for batch in exposure_batches if counts.get(batch['rootname'], (0, 0))[1] == 0]
+    partial = sorted(set(batch['rootname'] for batch in exposure_batches) -
+                     set(batch['rootname'] for batch in complete))
+
+    deltas = get_rollup_deltas(batches_to_columns(complete))
+    if partial:
+        table = PSFTableMAST.__table__
+        columns = read_columns(connection, and_(table.c.rootname.in_(partial), table.c.id > last_id))
+        deltas = merge_deltas(deltas, get_rollup_deltas(columns))
+    apply_rollup_deltas(connection, deltas)
+
+
+def rebuild_rollups(engine, chunk_size=100000):
+    """Compute the rollups again from the ir_psf_mast table.
+
+    The rollups are replaced in one transaction, while the PSFs are
+    read through a server-side cursor on another connection.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The engine of the ir_psf database.
+    chunk_size : int, default=100000
+        The number of PSFs read and added at a time.
+
+    Returns
+    -------
+    n_psfs : int
+        The number of PSFs in the rollups.
+    """
+
+    table = PSFTableMAST.__table__
+    dtype = get_dtype(SOURCE_COLUMNS)
+    n_psfs = 0
+    with engine.begin() as writer:
+        writer.execute(PSFRollup.__table__.delete())
+        with engine.connect() as reader:
+            result = reader.execution_options(stream_results=True).execute(
+                select([table.c[name] for name in SOURCE_COLUMNS]).order_by(table.c.id))
+            try:
+                while True:
+                    rows = result.cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    array = rows_to_array(rows, dtype)
+                    apply_rollup_deltas(writer, get_rollup_deltas({name: array[name] for name in SOURCE_COLUMNS}))
+                    n_psfs += len(rows)
+            finally:
+                result.close()
+
+    return n_psfs
+
+
+def summarize_rollups(group_by=('filter', 'day'), filters=None, first_day=None, last_day=None,
+                      quantiles=(0.5,)):
+    """Return PSF statistics by group of rollups.
+
+    Parameters
+    ----------
+    group_by : tuple, default=('filter', 'day')
+        The key columns to group by, any of filter, day, cell_x and
+        cell_y.  An empty tuple gives the overall statistics.
+    filters : list, optional
+        The filters to include, all by default.
+    first_day, last_day : datetime.date, optional
+        The first and last days to include, both included.
+    quantiles : tuple, default=(0.5,)
+        The quantiles of the statistics to return.
+
+    Returns
+    -------
+    summary : dict
+        Maps the group_by columns, n_psfs, and mean_<statistic> and
+        q<percent>_<statistic> (median_<statistic> for 0.5) for the
+        qfit, sky and focus, to arrays with one value per group, sorted
+        by group.
+    """
+
+    unknown = set(group_by) - set(KEY_COLUMNS)
+    if unknown:
+        raise ValueError('Cannot group by {}'.format(', '.join(sorted(unknown))))
+
+    table = PSFRollup.__table__
+    query = select([table])
+    if filters is not None:
+        query = query.where(table.c.filter.in_(filters))
+    if first_day is not None:
+        query = query.where(table.c.day >= first_day)
+    if last_day is not None:
+        query = query.where(table.c.day <= last_day)
+
+    groups = {}
+    with get_engine().connect() as connection:
+        for row in connection.execute(query):
+            key = tuple(row[column] for column in group_by)
+            aggregates = row_to_aggregates(row)
+            groups[key] = merge_aggregates(groups[key], aggregates) if key in groups else aggregates
+
+    keys = sorted(groups)
+    summary = {column: np.array([key[index] for key in keys], dtype='datetime64[D]' if column == 'day' else None)
+               for index, column in enumerate(group_by)}
+    summary['n_psfs'] = np.array([groups[key]['n_psfs'] for key in keys], dtype=np.int64)
+    for statistic in STATISTICS:
+        n_values = np.array([groups[key]['n_' + statistic] for key in keys], dtype=float)
+        sums = np.array([groups[key]['sum_' + statistic] for key in keys], dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            summary['mean_' + statistic] = np.where(n_values > 0, sums / n_values, np.nan)
+        for quantile in quantiles:
+            name = 'median' if quantile == 0.5 else 'q{:g}'.format(100 * quantile)
+            summary['{}_{}'.format(name, statistic)] = np.array(
+                [get_quantile(groups[key][statistic], quantile) for key in keys], dtype=float)
+
+    return summary
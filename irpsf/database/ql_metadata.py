@@ -0,0 +1,184 @@
+"""Batched retrieval of exposure metadata from the QL database.
+
+Rather than issuing one query per exposure, the rootnames are resolved
+with a handful of chunked ``ql_root IN (...)`` queries against the
+``IR_flt_0`` and ``Master`` tables.  The results are returned as a
+columnar structure: a dictionary of NumPy arrays that all share the
+order of its ``rootname`` column.  Rootnames that QL does not know
+about are reported separately instead of raising an error.
+
+``get_public_rootnames`` similarly splits candidate rootnames into
+those out of their proprietary period and those still in it, with the
+cutoff date pushed into the chunked queries.
+
+Rootnames may be given either as 8-character QL rootnames or as the
+9-character rootnames used in the psf filesystem (e.g. ``iabc01xyq``);
+the returned ``rootname`` column holds them exactly as given.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.database.ql_metadata import get_ql_metadata
+        from irpsf.database.ql_metadata import get_public_rootnames
+        metadata, missing = get_ql_metadata(ql_session, rootnames)
+        public, proprietary, missing = get_public_rootnames(
+            ql_session, rootnames, cutoff)
+"""
+
+import numpy as np
+
+from irpsf.database.ir_psf_database_interface import retry_on_disconnect
+
+
+QL_METADATA_COLUMNS = ['ql_dir', 'midexp', 'filter', 'aperture', 'exptime',
+                       'sun_angle', 'fgs_lock']
+
+
+def chunks(items, chunk_size):
+    """Yield successive ``chunk_size``-long slices of ``items``.
+
+    Parameters
+    ----------
+    items : list
+        The items to split.
+    chunk_size : int
+        The maximum number of items per chunk.
+
+    Yields
+    ------
+    chunk : list
+        A slice of ``items``.
+    """
+
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def get_ql_metadata(ql_session, rootnames, chunk_size=1000):
+    """Retrieve the metadata of many exposures from QL.
+
+    Parameters
+    ----------
+    ql_session : sqlalchemy.orm.Session
+        A session connected to the QL database.
+    rootnames : list
+        The rootnames of the exposures.
+    chunk_size : int, default=1000
+        The maximum number of rootnames per ``IN (...)`` query.
+
+    Returns
+    -------
+    metadata : dict
+        Maps ``rootname`` and each of ``QL_METADATA_COLUMNS`` - the QL
+        directory, mid exposure time, filter, aperture, exposure time,
+        sun angle and FGS lock - to an array with one element per
+        rootname found in QL, in the order they were given.
+    missing : list
+        The rootnames that were not found in QL.
+    """
+
+    # Imported here so that importing this module does not load pyql
+    from pyql.database.ql_database_interface import IR_flt_0, Master
+
+    given_rootnames = {}
+    for rootname in rootnames:
+        given_rootnames.setdefault(rootname[:8], rootname)
+
+    rows = {}
+    for chunk in chunks(list(given_rootnames), chunk_size):
+        results = ql_session.query(IR_flt_0.ql_root, IR_flt_0.expstart,
+                                   IR_flt_0.expend, IR_flt_0.filter,
+                                   IR_flt_0.aperture, Master.dir,
+                                   IR_flt_0.sunangle, IR_flt_0.exptime,
+                                   IR_flt_0.fgslock)\
+            .join(Master).filter(IR_flt_0.ql_root.in_(chunk))
+        results = retry_on_disconnect(results.all)
+        for result in results:
+            rows.setdefault(result[0], result[1:])
+
+    found = [ql_root for ql_root in given_rootnames if ql_root in rows]
+    missing = [given_rootnames[ql_root] for ql_root in given_rootnames
+               if ql_root not in rows]
+
+    columns = list(zip(*[rows[ql_root] for ql_root in found])) or [()] * 8
+    expstart, expend, filters, apertures, ql_dirs, sun_angles, exptimes, \
+        fgs_locks = columns
+
+    metadata = {
+        'rootname': np.array([given_rootnames[ql_root] for ql_root in found],
+                             dtype=object),
+        'ql_dir': np.array(ql_dirs, dtype=object),
+        'midexp': (np.array(expstart, dtype=float)
+                   + np.array(expend, dtype=float)) / 2.,
+        'filter': np.array(filters, dtype=object),
+        'aperture': np.array(apertures, dtype=object),
+        'exptime': np.array(exptimes, dtype=float),
+        'sun_angle': np.array(sun_angles, dtype=float),
+        'fgs_lock': np.array(fgs_locks, dtype=object)}
+
+    return metadata, missing
+
+
+def get_public_rootnames(ql_session, rootnames, cutoff, chunk_size=1000):
+    """Split rootnames into public and proprietary exposures.
+
+    An exposure is public if it was observed before ``cutoff``.  The
+    public rootnames are found with chunked queries that apply the
+    cutoff in the database; the observation dates of the remaining
+    rootnames are then fetched, also in chunks, so callers can record
+    when they become public.
+
+    Parameters
+    ----------
+    ql_session : sqlalchemy.orm.Session
+        A session connected to the QL database.
+    rootnames : list
+        The candidate rootnames.
+    cutoff : datetime.date
+        Exposures observed before this date are public.
+    chunk_size : int, default=1000
+        The maximum number of rootnames per ``IN (...)`` query.
+
+    Returns
+    -------
+    public : list
+        The public rootnames, as given.
+    proprietary : dict
+        Maps each proprietary rootname, as given, to its observation
+        date.
+    missing : list
+        The rootnames that were not found in QL.
+    """
+
+    from pyql.database.ql_database_interface import IR_flt_0
+
+    given_rootnames = {}
+    for rootname in rootnames:
+        given_rootnames.setdefault(rootname[:8], rootname)
+
+    public_ql_roots = set()
+    for chunk in chunks(list(given_rootnames), chunk_size):
+        results = ql_session.query(IR_flt_0.ql_root)\
+            .filter(IR_flt_0.ql_root.in_(chunk))\
+            .filter(IR_flt_0.date_obs < cutoff)
+        results = retry_on_disconnect(results.all)
+        public_ql_roots.update(result[0] for result in results)
+
+    remaining = [ql_root for ql_root in given_rootnames
+                 if ql_root not in public_ql_roots]
+    dates_obs = {}
+    for chunk in chunks(remaining, chunk_size):
+        results = ql_session.query(IR_flt_0.ql_root, IR_flt_0.date_obs)\
+            .filter(IR_flt_0.ql_root.in_(chunk))
+        results = retry_on_disconnect(results.all)
+        dates_obs.update(results)
+
+    public = [given_rootnames[ql_root] for ql_root in given_rootnames
+              if ql_root in public_ql_roots]
+    proprietary = {given_rootnames[ql_root]: dates_obs[ql_root]
+                   for ql_root in remaining if ql_root in dates_obs}
+    missing = [given_rootnames[ql_root] for ql_root in remaining
+               if ql_root not in dates_obs]
+
+    return public, proprietary, missing
@@ -0,0 +1,148 @@
+"""Mergeable quantile sketches with a bounded relative error.
+
+A sketch counts values in logarithmically spaced buckets, as in
+DDSketch: the bucket ``k > 0`` holds the magnitudes between
+``MIN_VALUE * GAMMA**(k - 1)`` and ``MIN_VALUE * GAMMA**k``, negative
+values have negative buckets, and magnitudes below MIN_VALUE share the
+bucket 0.  Any quantile is then estimated within RELATIVE_ACCURACY of
+a value of the sketched data, whatever its range.
+
+Sketches are (buckets, counts) pairs of sorted arrays of the non-empty
+buckets.  Two sketches are merged by adding their counts, and counts
+can be subtracted as well, so the sketch of a set of values can be
+maintained as values are added and removed.
+
+Use
+---
+    This module is intended to be imported by the rollup module:
+
+        from irpsf.database.quantile_sketch import get_quantile, make_sketches, merge_sketches
+        sketches = make_sketches(values, groups, n_groups)
+        median = get_quantile(merge_sketches(sketches[0], sketches[1]), 0.5)
+"""
+
+import numpy as np
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 1e-6
+
+# Bucket numbers stay well within +/- BUCKET_OFFSET for any float
+BUCKET_OFFSET = 2**19
+
+
+def get_buckets(values):
+    """Return the buckets of values.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values, all finite.
+
+    Returns
+    -------
+    buckets : numpy.ndarray
+        The bucket of each value, as int64.
+    """
+
+    magnitude = np.maximum(np.abs(values), MIN_VALUE)
+    buckets = np.ceil(np.log(magnitude / MIN_VALUE) / np.log(GAMMA)).astype(np.int64)
+    return np.sign(values).astype(np.int64) * buckets
+
+
+def get_bucket_values(buckets):
+    """Return the values representing buckets, within RELATIVE_ACCURACY of their values."""
+
+    return np.sign(buckets) * MIN_VALUE * 2 * GAMMA**np.abs(buckets) / (GAMMA + 1)
+
+
+def make_sketches(values, groups, n_groups):
+    """Return the sketches of groups of values.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values, all finite.
+    groups : numpy.ndarray
+        The group of each value, from 0 to ``n_groups - 1``.
+    n_groups : int
+        The number of groups.
+
+    Returns
+    -------
+    sketches : list
+        The (buckets, counts) sketch of each group.
+    """
+
+    keys = groups.astype(np.int64) * 2 * BUCKET_OFFSET + get_buckets(values) + BUCKET_OFFSET
+    keys, counts = np.unique(keys, return_counts=True)
+    key_groups = keys // (2 * BUCKET_OFFSET)
+    buckets = keys % (2 * BUCKET_OFFSET) - BUCKET_OFFSET
+    bounds = np.searchsorted(key_groups, np.arange(n_groups + 1))
+
+    return [(buckets[start:stop], counts[start:stop].astype(np.int64))
+            for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def merge_sketches(first, second, sign=1):
+    """Return the sum, or the difference, of two sketches.
+
+    Parameters
+    ----------
+    first, second : tuple
+        The (buckets, counts) sketches.
+    sign : int, default=1
+        -1 to subtract ``second`` from ``first``.
+
+    Returns
+    -------
+    sketch : tuple
+        The (buckets, counts) sketch, without empty buckets.
+    """
+
+    buckets, index = np.unique(np.concatenate([first[0], second[0]]), return_inverse=True)
+    counts = np.zeros(len(buckets), dtype=np.int64)
+    np.add.at(counts, index, np.concatenate([first[1], sign * second[1]]))
+    nonzero = counts != 0
+
+    return buckets[nonzero], counts[nonzero]
+
+
+def get_quantile(sketch, quantile):
+    """Return a quantile of the values of a sketch.
+
+    Parameters
+    ----------
+    sketch : tuple
+        The (buckets, counts) sketch.
+    quantile : float
+        The quantile, between 0 and 1.
+
+    Returns
+    -------
+    value : float
+        The quantile, within RELATIVE_ACCURACY of the value of that
+        rank, or NaN if the sketch is empty.
+    """
+
+    buckets, counts = sketch
+    if counts.sum() <= 0:
+        return np.nan
+    cumulative = np.cumsum(counts)
+    rank = quantile * (cumulative[-1] - 1)
+
+    return float(get_bucket_values(buckets[np.searchsorted(cumulative, rank, side='right')]))
+
+
+def encode_sketch(sketch):
+    """Return a sketch as bytes: its buckets as int32, then its counts as int64."""
+
+    return sketch[0].astype('<i4').tobytes() + sketch[1].astype('<i8').tobytes()
+
+
+def decode_sketch(data):
+    """Return a sketch encoded by encode_sketch."""
+
+    n_buckets = len(data) // 12
+    return (np.frombuffer(data, dtype='<i4', count=n_buckets).astype(np.int64),
+            np.frombuffer(data, dtype='<i8', offset=4 * n_buckets).astype(np.int64))
@@ -0,0 +1,342 @@
+"""A persistent index of the exposures processed by hst1pass.
+
+``run_hst1pass_IR.py`` records the outcome of every hst1pass job in a
+local SQLite file, one row per exposure (keyed by the 8-character QL
+rootname), with:
+
+    1) filter
+    2) status, one of ``SUCCEEDED``, ``ZERO_STARS``, ``FAILED`` or
+       ``TIMED_OUT``
+    3) xym_path and ras_path, the output files of hst1pass
+    4) started_at and finished_at, as unix times, and wall_time
+    5) return_code of hst1pass and the number of attempts
+
+Finding the new work is then a set difference between the QL rootnames
+and the indexed rootnames rather than a glob of every filter directory,
+and exposures that failed or produced no stars are no longer mistaken
+for ones that were never attempted.
+
+The index lives in ``SETTINGS['exposure_index']``, by default
+``hst1pass_index.sqlite`` next to ``SETTINGS['output_dir']``.  It is
+written by the single run of ``run_hst1pass_IR.py`` over all filters,
+and uses SQLite's write-ahead log so that readers such as
+``hst1pass_report.py`` can query it while a run is updating it.  An
+empty index is seeded from the files already in the psf filesystem.
+
+Use
+---
+    This module is intended to be imported by the hst1pass scripts:
+
+        from irpsf.hst1pass.exposure_index import connect_index, get_new_records
+        connection = connect_index()
+        new_records = get_new_records(connection, ql_records)
+"""
+
+import glob
+import logging
+import os
+import sqlite3
+import time
+
+from irpsf.settings.settings import SETTINGS
+
+
+SUCCEEDED = 'succeeded'
+ZERO_STARS = 'zero_stars'
+FAILED = 'failed'
+TIMED_OUT = 'timed_out'
+STATUSES = (SUCCEEDED, ZERO_STARS, FAILED, TIMED_OUT)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exposures (
+    ql_root TEXT PRIMARY KEY,
+    filter TEXT NOT NULL,
+    status TEXT NOT NULL,
+    xym_path TEXT,
+    ras_path TEXT,
+    started_at REAL,
+    finished_at REAL,
+    wall_time REAL,
+    return_code INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS exposures_filter_status ON exposures (filter, status);
+"""
+
+
+def get_index_path():
+    """Return the path of the exposure index.
+
+    Returns
+    -------
+    index_path : str
+        ``SETTINGS['exposure_index']``, or ``hst1pass_index.sqlite``
+        next to ``SETTINGS['output_dir']`` by default.
+    """
+
+    default = os.path.join(os.path.dirname(SETTINGS['output_dir'].rstrip('/')), 'hst1pass_index.sqlite')
+    return SETTINGS.get('exposure_index', default)
+
+
+def get_output_paths(ql_root, filt):
+    """Return the paths hst1pass writes for an exposure.
+
+    Parameters
+    ----------
+    ql_root : str
+        The 8-character rootname of the exposure.
+    filt : str
+        The filter of the exposure.
+
+    Returns
+    -------
+    xym_path : str
+        The path of the .stardb_xym file.
+    ras_path : str
+        The path of the .stardb_ras file.
+    """
+
+    output_loc = os.path.join(SETTINGS['output_dir'], filt)
+    xym_path = os.path.join(output_loc, '{}q_flt.stardb_xym'.format(ql_root))
+    ras_path = os.path.join(output_loc, '{}q_flt.stardb_ras'.format(ql_root))
+    return xym_path, ras_path
+
+
+def connect_index(index_path=None):
+    """Open the exposure index, creating and seeding it if necessary.
+
+    Parameters
+    ----------
+    index_path : str, optional
+        The path of the SQLite file.  Defaults to ``get_index_path()``.
+
+    Returns
+    -------
+    connection : sqlite3.Connection
+        The connection to the index.
+    """
+
+    index_path = index_path or get_index_path()
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    connection = sqlite3.connect(index_path, timeout=60)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+
+    if connection.execute('SELECT COUNT(*) FROM exposures').fetchone()[0] == 0:
+        seed_index(connection)
+
+    return connection
+
+
+def classify_result(return_code, xym_path, timed_out=False):
+    """Return the status of a finished hst1pass job.
+
+    Parameters
+    ----------
+    return_code : int or None
+        The exit status of hst1pass.
+    xym_path : str
+        The path of the .stardb_xym file it should have written.
+    timed_out : bool, default=False
+        Whether the job was killed for running too long.
+
+    Returns
+    -------
+    status : str
+        One of ``STATUSES``.
+    """
+
+    if timed_out:
+        return TIMED_OUT
+    if return_code != 0 or not os.path.exists(xym_path):
+        return FAILED
+    if os.path.getsize(xym_path) == 0:
+        return ZERO_STARS
+    return SUCCEEDED
+
+
+def record_result(connection, ql_root, filt, status, xym_path=None, ras_path=None,
+                  started_at=None, finished_at=None, return_code=None, attempts=1):
+    """Record the outcome of an hst1pass job, replacing any earlier one.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the index.
+    ql_root : str
+        The 8-character rootname of the exposure.
+    filt : str
+        The filter of the exposure.
+    status : str
+        One of ``STATUSES``.
+    xym_path, ras_path : str, optional
+        The output files of hst1pass.
+    started_at, finished_at : float, optional
+        The start and end of the job, as unix times.
+    return_code : int, optional
+        The exit status of hst1pass.
+    attempts : int, default=1
+        The number of times the job was run, added to the count of
+        earlier attempts.
+    """
+
+    if status not in STATUSES:
+        raise ValueError('Unknown status {}'.format(status))
+    wall_time = None
+    if started_at is not None and finished_at is not None:
+        wall_time = finished_at - started_at
+
+    with connection:
+        connection.execute(
+            'INSERT INTO exposures (ql_root, filter, status, xym_path, ras_path, '
+            'started_at, finished_at, wall_time, return_code, attempts) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (ql_root) DO UPDATE SET filter = excluded.filter, '
+            'status = excluded.status, xym_path = excluded.xym_path, '
+            'ras_path = excluded.ras_path, started_at = excluded.started_at, '
+            'finished_at = excluded.finished_at, wall_time = excluded.wall_time, '
+            'return_code = excluded.return_code, '
+            'attempts = attempts + excluded.attempts',
+            (ql_root, filt, status, xym_path, ras_path, started_at, finished_at,
+             wall_time, return_code, attempts))
+
+
+def update_ras_path(connection, ql_root, ras_path):
+    """Point an exposure's ras_path to a new location, e.g. its cutout file.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the index.
+    ql_root : str
+        The 8-character rootname of the exposure.
+    ras_path : str
+        The new path of the cutouts.
+    """
+
+    with connection:
+        connection.execute('UPDATE exposures SET ras_path = ? WHERE ql_root = ?',
+                           (ras_path, ql_root))
+
+
+def get_indexed_rootnames(connection, statuses=None):
+    """Return the rootnames of the indexed exposures.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the index.
+    statuses : list, optional
+        Only return exposures with one of these statuses.
+
+    Returns
+    -------
+    rootnames : set
+        The 8-character rootnames.
+    """
+
+    query = 'SELECT ql_root FROM exposures'
+    params = ()
+    if statuses is not None:
+        statuses = list(statuses)
+        query += ' WHERE status IN ({})'.format(', '.join('?' * len(statuses)))
+        params = statuses
+    return {row[0] for row in connection.execute(query, params)}
+
+
+def get_filter_wall_times(connection):
+    """Return the mean wall time of the completed jobs of each filter.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the index.
+
+    Returns
+    -------
+    wall_times : dict
+        The mean wall time in seconds of the succeeded and zero star
+        jobs, keyed by filter.  Filters without timed jobs are omitted.
+    """
+
+    rows = connection.execute(
+        'SELECT filter, AVG(wall_time) FROM exposures '
+        'WHERE wall_time IS NOT NULL AND status IN (?, ?) GROUP BY filter',
+        (SUCCEEDED, ZERO_STARS))
+    return dict(rows.fetchall())
+
+
+def get_new_records(connection, ql_records, retry_statuses=()):
+    """Return the QL records of the exposures hst1pass still has to process.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the index.
+    ql_records : list
+        (filter, rootname, path) records from the QL database.
+    retry_statuses : list, optional
+        Statuses whose exposures are processed again, e.g.
+        ``[FAILED, TIMED_OUT]``.
+
+    Returns
+    -------
+    new_records : list
+        The records whose rootname is not in the index, or whose status
+        is one of ``retry_statuses``.
+    """
+
+    done = get_indexed_rootnames(connection, set(STATUSES) - set(retry_statuses))
+    return [record for record in ql_records if record[1] not in done]
+
+
+def seed_index(connection):
+    """Index the exposures already processed in the psf filesystem.
+
+    Every exposure with a stardb_ras file (or a compacted cutout file)
+    is recorded as ``SUCCEEDED``, or as ``ZERO_STARS`` if its
+    stardb_xym file is empty, or ``FAILED`` if it has none.  Their
+    timings are unknown.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the index.
+
+    Returns
+    -------
+    n_seeded : int
+        The number of exposures indexed.
+    """
+
+    # Imported here so that the cutout store does not become a
+    # dependency of every user of the index
+    from irpsf.cutouts.ras_store import get_cutout_path
+
+    start = time.time()
+    ras_paths = {}
+    for path in glob.glob(os.path.join(SETTINGS['output_dir'], '*/*ras')):
+        ras_paths[os.path.basename(path)[0:8]] = path
+    for path in glob.glob(get_cutout_path('*', '*')):
+        ras_paths.setdefault(os.path.basename(path)[0:8], path)
+
+    rows = []
+    for ql_root, ras_path in ras_paths.items():
+        filt = os.path.basename(os.path.dirname(ras_path))
+        xym_path = get_output_paths(ql_root, filt)[0]
+        if not os.path.exists(xym_path):
+            status = FAILED
+        elif os.path.getsize(xym_path) == 0:
+            status = ZERO_STARS
+        else:
+            status = SUCCEEDED
+        rows.append((ql_root, filt, status, xym_path, ras_path))
+
+    with connection:
+        connection.executemany(
+            'INSERT OR IGNORE INTO exposures (ql_root, filter, status, xym_path, ras_path) '
+            'VALUES (?, ?, ?, ?, ?)', rows)
+    logging.info('Seeded the exposure index with {} exposures in {:.1f} s'.format(
+        len(rows), time.time() - start))
+
+    return len(rows)
@@ -0,0 +1,180 @@
+"""Resource accounting of the hst1pass jobs.
+
+Every hst1pass job run by ``run_hst1pass_IR.py`` adds a row to the
+``job_metrics`` table of the exposure index (see
+``irpsf.hst1pass.exposure_index``) with:
+
+    1) ql_root, filter, status, return_code and attempts
+    2) started_at, as a unix time, and wall_time in seconds
+    3) cpu_time, the user + system CPU seconds of hst1pass
+    4) peak_rss_mb, the peak resident memory of hst1pass
+    5) n_stars, the number of stars in its stardb_xym file
+    6) output_bytes, the size of its stardb_xym and stardb_ras files
+
+The resource usage is that of the hst1pass process alone, as reported
+by the kernel when it is reaped (see ``irpsf.hst1pass.launcher``).
+Unlike the exposure index, which keeps the last outcome of each
+exposure, the table keeps every run, so it can be queried with any
+SQLite client, and is summarized by ``hst1pass_report.py``.
+
+Use
+---
+    This module is intended to be imported by the hst1pass scripts:
+
+        from irpsf.hst1pass.job_metrics import record_metrics
+        record_metrics(index, result)
+"""
+
+import os
+
+
+METRICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS job_metrics (
+    id INTEGER PRIMARY KEY,
+    ql_root TEXT NOT NULL,
+    filter TEXT NOT NULL,
+    status TEXT NOT NULL,
+    return_code INTEGER,
+    attempts INTEGER,
+    started_at REAL,
+    wall_time REAL,
+    cpu_time REAL,
+    peak_rss_mb REAL,
+    n_stars INTEGER,
+    output_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS job_metrics_filter ON job_metrics (filter);
+CREATE INDEX IF NOT EXISTS job_metrics_wall_time ON job_metrics (wall_time);
+"""
+
+METRIC_COLUMNS = ('cpu_time', 'peak_rss_mb', 'n_stars', 'output_bytes')
+
+
+def create_metrics_table(connection):
+    """Create the job_metrics table if it does not exist yet.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the exposure index.
+    """
+
+    connection.executescript(METRICS_SCHEMA)
+
+
+def get_rusage_metrics(rusage):
+    """Return the CPU time and peak memory of a reaped process.
+
+    Parameters
+    ----------
+    rusage : resource.struct_rusage
+        The resource usage returned by ``os.wait4``.
+
+    Returns
+    -------
+    metrics : dict
+        The cpu_time, in seconds, and peak_rss_mb of the process.
+    """
+
+    # ru_maxrss is in kilobytes on Linux
+    return {'cpu_time': rusage.ru_utime + rusage.ru_stime,
+            'peak_rss_mb': rusage.ru_maxrss / 1024.}
+
+
+def get_output_metrics(xym_path, ras_path):
+    """Return the number of stars and size of the outputs of hst1pass.
+
+    Parameters
+    ----------
+    xym_path : str
+        The path of the .stardb_xym file.
+    ras_path : str
+        The path of the .stardb_ras file.
+
+    Returns
+    -------
+    metrics : dict
+        The n_stars, one per line of the xym file, and the
+        output_bytes of both files.  Missing files count as empty.
+    """
+
+    n_stars, output_bytes = 0, 0
+    if os.path.exists(xym_path):
+        with open(xym_path, 'rb') as f:
+            n_stars = sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+        output_bytes += os.path.getsize(xym_path)
+    if os.path.exists(ras_path):
+        output_bytes += os.path.getsize(ras_path)
+
+    return {'n_stars': n_stars, 'output_bytes': output_bytes}
+
+
+def record_metrics(connection, result):
+    """Add the metrics of a finished hst1pass job to the job_metrics table.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the exposure index.
+    result : dict
+        The result of the job, as returned by the launcher.  Missing
+        metrics are recorded as NULL.
+    """
+
+    create_metrics_table(connection)
+    with connection:
+        connection.execute(
+            'INSERT INTO job_metrics (ql_root, filter, status, return_code, attempts, '
+            'started_at, wall_time, cpu_time, peak_rss_mb, n_stars, output_bytes) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (result['rootname'], result['filter'], result['status'],
+             result['return_code'], result['attempts'], result['started_at'],
+             result['finished_at'] - result['started_at'])
+            + tuple(result.get(column) for column in METRIC_COLUMNS))
+
+
+def get_filter_throughput(connection):
+    """Summarize the jobs of each filter.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the exposure index.
+
+    Returns
+    -------
+    rows : list
+        One (filter, n_jobs, n_failed, total wall_time, mean wall_time,
+        mean cpu_time, max peak_rss_mb, total n_stars, total
+        output_bytes) tuple per filter, sorted by total wall time.
+    """
+
+    create_metrics_table(connection)
+    return connection.execute(
+        "SELECT filter, COUNT(*), SUM(status IN ('failed', 'timed_out')), "
+        'SUM(wall_time), AVG(wall_time), AVG(cpu_time), MAX(peak_rss_mb), '
+        'SUM(n_stars), SUM(output_bytes) FROM job_metrics '
+        'GROUP BY filter ORDER BY SUM(wall_time) DESC').fetchall()
+
+
+def get_slowest_jobs(connection, n_jobs=20):
+    """Return the slowest hst1pass jobs.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the exposure index.
+    n_jobs : int, default=20
+        The number of jobs.
+
+    Returns
+    -------
+    rows : list
+        (ql_root, filter, status, wall_time, cpu_time, peak_rss_mb,
+        n_stars) tuples, slowest first.
+    """
+
+    create_metrics_table(connection)
+    return connection.execute(
+        'SELECT ql_root, filter, status, wall_time, cpu_time, peak_rss_mb, n_stars '
+        'FROM job_metrics ORDER BY wall_time DESC LIMIT ?', (n_jobs,)).fetchall()
@@ -0,0 +1,274 @@
+"""Run hst1pass jobs as asyncio subprocesses.
+
+Each job is an hst1pass command line, run without a shell and at most
+``n_concurrent`` at a time.  Each process is reaped with ``os.wait4`` in
+a thread, which gives its own CPU time and peak memory.  A job runs in its own temporary directory
+under ``<output_dir>/<filter>/.hst1pass_tmp``, so a job that is killed
+or fails never leaves partial files in the psf filesystem: only once
+hst1pass exits successfully are its ``.stardb_ras`` and then its
+``.stardb_xym`` file renamed into ``<output_dir>/<filter>``.  Since the
+rename stays within a filesystem, it is atomic.
+
+A job that runs longer than ``timeout`` seconds is killed.  Failed and
+timed out jobs are retried up to ``retries`` times.  Each result is
+passed to a callback as soon as its job completes, and progress is
+logged as jobs complete.
+
+Use
+---
+    This module is intended to be imported by the hst1pass scripts:
+
+        from irpsf.hst1pass.launcher import run_jobs
+        run_jobs(jobs, SETTINGS['cores'], on_result=record)
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from irpsf.hst1pass.exposure_index import FAILED, SUCCEEDED, TIMED_OUT, ZERO_STARS
+from irpsf.hst1pass.exposure_index import classify_result, get_output_paths
+from irpsf.hst1pass.job_metrics import get_output_metrics, get_rusage_metrics
+from irpsf.settings.settings import SETTINGS
+
+
+TEMP_DIR_NAME = '.hst1pass_tmp'
+
+
+def remove_stale_temp_dirs(filters):
+    """Remove the temporary directories left behind by killed runs.
+
+    Parameters
+    ----------
+    filters : list
+        The filters whose output directories are cleaned.
+    """
+
+    for filt in filters:
+        for temp_dir in glob.glob(os.path.join(SETTINGS['output_dir'], filt, TEMP_DIR_NAME, '*')):
+            logging.info('Removing stale {}'.format(temp_dir))
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def get_log_tail(log_path, n_lines=5):
+    """Return the last lines of an hst1pass log, for error messages.
+
+    Parameters
+    ----------
+    log_path : str
+        The path of the log.
+    n_lines : int, default=5
+        The number of lines.
+
+    Returns
+    -------
+    tail : str
+        The last lines, joined by ' | '.
+    """
+
+    try:
+        with open(log_path, 'r', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return ''
+    return ' | '.join(line.strip() for line in lines[-n_lines:])
+
+
+def get_return_code(wait_status):
+    """Convert a wait status into a return code, as subprocess does.
+
+    Parameters
+    ----------
+    wait_status : int
+        The status returned by ``os.wait4``.
+
+    Returns
+    -------
+    return_code : int
+        The exit status, or minus the signal that killed the process.
+    """
+
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+async def run_attempt(job, timeout, executor):
+    """Run one attempt of an hst1pass job in a temporary directory.
+
+    hst1pass is reaped with ``os.wait4`` in a thread of ``executor``,
+    which gives the resource usage of that process alone.
+
+    Parameters
+    ----------
+    job : tuple
+        The (filter, rootname, args) of the job, where args is the
+        hst1pass command line as a list.
+    timeout : float or None
+        The number of seconds after which hst1pass is killed.
+    executor : concurrent.futures.ThreadPoolExecutor
+        The threads waiting for the hst1pass processes.
+
+    Returns
+    -------
+    result : dict
+        The return_code, status, started_at and finished_at of the
+        attempt, and its metrics (see
+        ``irpsf.hst1pass.job_metrics``).
+    """
+
+    filt, rootname, args = job
+    xym_path, ras_path = get_output_paths(rootname, filt)
+    temp_root = os.path.join(os.path.dirname(xym_path), TEMP_DIR_NAME)
+    os.makedirs(temp_root, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix='{}_'.format(rootname), dir=temp_root)
+    log_path = os.path.join(temp_dir, 'hst1pass.log')
+
+    try:
+        started_at = time.time()
+        with open(log_path, 'w') as log:
+            process = subprocess.Popen(args, cwd=temp_dir, stdout=log,
+                                       stderr=subprocess.STDOUT)
+        waiter = asyncio.get_running_loop().run_in_executor(
+            executor, os.wait4, process.pid, 0)
+        try:
+            _, wait_status, rusage = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            timed_out = False
+        except asyncio.TimeoutError:
+            process.kill()
+            _, wait_status, rusage = await waiter
+            timed_out = True
+        except BaseException:
+            # Cancelled, e.g. on Ctrl-C: do not leave hst1pass running in a deleted directory
+            process.kill()
+            await waiter
+            raise
+        finished_at = time.time()
+        # Already reaped: keep subprocess from waiting for it again
+        process.returncode = return_code = get_return_code(wait_status)
+
+        temp_xym_path = os.path.join(temp_dir, os.path.basename(xym_path))
+        temp_ras_path = os.path.join(temp_dir, os.path.basename(ras_path))
+        status = classify_result(return_code, temp_xym_path, timed_out)
+        metrics = get_rusage_metrics(rusage)
+        metrics.update(get_output_metrics(temp_xym_path, temp_ras_path))
+        if status in (SUCCEEDED, ZERO_STARS):
+            # The xym file is moved last: its presence marks a complete exposure
+            if os.path.exists(temp_ras_path):
+                os.replace(temp_ras_path, ras_path)
+            os.replace(temp_xym_path, xym_path)
+        else:
+            logging.warning('{} {} (return code {}): {}'.format(
+                rootname, status, return_code, get_log_tail(log_path)))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    metrics.update({'return_code': return_code, 'status': status,
+                    'started_at': started_at, 'finished_at': finished_at})
+    return metrics
+
+
+async def run_job(job, semaphore, executor, timeout, retries):
+    """Run an hst1pass job, retrying it if it fails or times out.
+
+    Parameters
+    ----------
+    job : tuple
+        The (filter, rootname, args) of the job.
+    semaphore : asyncio.Semaphore
+        Limits the number of concurrent hst1pass processes.
+    executor : concurrent.futures.ThreadPoolExecutor
+        The threads waiting for the hst1pass processes.
+    timeout : float or None
+        The number of seconds after which an attempt is killed.
+    retries : int
+        The number of times a failed or timed out job is retried.
+
+    Returns
+    -------
+    result : dict
+        The filter, rootname, status, return_code, started_at,
+        finished_at and number of attempts of the job, and the metrics
+        of its last attempt.
+    """
+
+    filt, rootname, args = job
+    for attempt in range(1, retries + 2):
+        async with semaphore:
+            try:
+                result = await run_attempt(job, timeout, executor)
+            except OSError as error:
+                logging.error('Could not run hst1pass on {}: {}'.format(rootname, error))
+                now = time.time()
+                result = {'return_code': None, 'status': FAILED,
+                          'started_at': now, 'finished_at': now}
+        if result['status'] not in (FAILED, TIMED_OUT):
+            break
+
+    result.update({'filter': filt, 'rootname': rootname, 'attempts': attempt})
+    return result
+
+
+async def _run_jobs(jobs, n_concurrent, timeout, retries, on_result):
+    """Run the jobs and pass each result to ``on_result`` as it completes.
+
+    See ``run_jobs`` for the parameters.
+    """
+
+    n_concurrent = max(int(n_concurrent), 1)
+    semaphore = asyncio.Semaphore(n_concurrent)
+    executor = ThreadPoolExecutor(n_concurrent)
+    tasks = [asyncio.ensure_future(run_job(job, semaphore, executor, timeout, retries))
+             for job in jobs]
+
+    counts, start = {}, time.time()
+    for n_done, task in enumerate(asyncio.as_completed(tasks), 1):
+        result = await task
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if on_result is not None:
+            on_result(result)
+
+        elapsed = time.time() - start
+        remaining = elapsed / n_done * (len(tasks) - n_done)
+        logging.info('{}/{} done, {} {} in {:.1f} s; {:.0f} s remaining'.format(
+            n_done, len(tasks), result['rootname'], result['status'],
+            result['finished_at'] - result['started_at'], remaining))
+
+    executor.shutdown()
+    return counts
+
+
+def run_jobs(jobs, n_concurrent, timeout=None, retries=1, on_result=None):
+    """Run hst1pass jobs concurrently.
+
+    Parameters
+    ----------
+    jobs : list
+        (filter, rootname, args) tuples, where args is the hst1pass
+        command line as a list.
+    n_concurrent : int
+        The maximum number of hst1pass processes running at once.
+    timeout : float, optional
+        The number of seconds after which a job is killed.  No limit
+        by default.
+    retries : int, default=1
+        The number of times a failed or timed out job is retried.
+    on_result : callable, optional
+        Called in the calling process with the result dict of each job
+        (see ``run_job``) as soon as it completes.
+
+    Returns
+    -------
+    counts : dict
+        The number of jobs with each status.
+    """
+
+    jobs = list(jobs)
+    remove_stale_temp_dirs({job[0] for job in jobs})
+    return asyncio.run(_run_jobs(jobs, n_concurrent, timeout, retries, on_result))
@@ -0,0 +1,79 @@
+"""Order hst1pass jobs of several filters by their estimated cost.
+
+All filters are processed from one job queue under one concurrency
+limit (see ``irpsf.hst1pass.launcher``).  To keep the tail of a run
+short, the most expensive jobs are started first, so the last jobs to
+finish are short ones and the machine stays evenly loaded.
+
+The cost of a job is estimated from the exposure index: the mean wall
+time of the previous hst1pass jobs of its filter, scaled by the
+exposure time of the exposure relative to the mean exposure time of the
+new exposures of that filter.  Filters without any history use the
+mean wall time of all filters, or 1 second for an empty index.
+
+Use
+---
+    This module is intended to be imported by the hst1pass scripts:
+
+        from irpsf.hst1pass.exposure_index import get_filter_wall_times
+        from irpsf.hst1pass.scheduler import order_by_cost
+        new_records = order_by_cost(new_records, get_filter_wall_times(index))
+"""
+
+from collections import defaultdict
+
+
+def estimate_costs(records, filter_wall_times):
+    """Estimate the wall time of hst1pass on exposures.
+
+    Parameters
+    ----------
+    records : list
+        (filter, rootname, path, exptime) records.
+    filter_wall_times : dict
+        The mean wall time of past jobs, in seconds, keyed by filter.
+
+    Returns
+    -------
+    costs : list
+        The estimated wall time of each record, in seconds.
+    """
+
+    default = 1.
+    if filter_wall_times:
+        default = sum(filter_wall_times.values()) / len(filter_wall_times)
+
+    exptimes = defaultdict(list)
+    for filt, _, _, exptime in records:
+        exptimes[filt].append(exptime or 0.)
+    mean_exptimes = {filt: sum(values) / len(values) for filt, values in exptimes.items()}
+
+    costs = []
+    for filt, _, _, exptime in records:
+        scale = 1.
+        if mean_exptimes[filt] > 0:
+            scale = (exptime or 0.) / mean_exptimes[filt]
+        costs.append(filter_wall_times.get(filt, default) * scale)
+
+    return costs
+
+
+def order_by_cost(records, filter_wall_times):
+    """Sort exposures from the most to the least expensive to process.
+
+    Parameters
+    ----------
+    records : list
+        (filter, rootname, path, exptime) records.
+    filter_wall_times : dict
+        The mean wall time of past jobs, in seconds, keyed by filter.
+
+    Returns
+    -------
+    records : list
+        The records, most expensive first.
+    """
+
+    costs = estimate_costs(records, filter_wall_times)
+    order = sorted(range(len(records)), key=lambda i: costs[i], reverse=True)
+    return [records[i] for i in order]
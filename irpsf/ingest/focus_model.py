@@ -0,0 +1,202 @@
+"""In-memory, vectorized interpolation of the HST focus model.
+
+The ``focus_model`` table holds a breathing-model focus value every five
+minutes since 2009.  Rather than querying the table once per exposure,
+this module loads the time series once into sorted NumPy arrays and
+interpolates the focus for any number of mid-exposure times in a single
+vectorized call.
+
+The interpolation follows the rules used to build the ir_psf_mast
+table.  Only focus samples within six minutes of an exposure's midexp
+are considered:
+
+    - no samples: the focus, mjd and date are NULL.
+    - one sample: the focus is that sample's value.
+    - two or more: the focus is linearly interpolated in time between
+      the samples, and is clamped to the first or last sample when the
+      midexp falls outside of them.
+
+The loaded model is cached in an ``.npz`` file (by default in the
+``focus_model`` cache directory, see
+``irpsf.settings.settings.get_cache_dir``) together with a signature of
+the table (its row count, maximum id and maximum MJD).  The cache is
+reused as long as the signature of the table is unchanged, so repeated
+runs only cost one aggregate query.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.ingest.focus_model import interpolate_focus
+        from irpsf.ingest.focus_model import load_focus_model
+        model_mjds, model_focus = load_focus_model(session)
+        mjds, dates, focus = interpolate_focus(model_mjds, model_focus, midexps)
+"""
+
+import logging
+import os
+
+import numpy as np
+from sqlalchemy import func
+
+from irpsf.database.ir_psf_database_interface import FocusModel
+from irpsf.settings.settings import get_cache_dir
+
+
+SIX_MINUTES = 0.00416667  # six minutes in units of days
+
+
+def get_focus_model_signature(session):
+    """Return a signature that changes whenever the focus_model table does.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        A session connected to the ir_psf database.
+
+    Returns
+    -------
+    signature : numpy.ndarray
+        The row count, maximum id and maximum MJD of the table.
+    """
+
+    count, max_id, max_mjd = session.query(func.count(FocusModel.id),
+                                           func.max(FocusModel.id),
+                                           func.max(FocusModel.mjd)).one()
+    return np.array([count, max_id or 0, float(max_mjd or 0)], dtype=float)
+
+
+def query_focus_model(session, mjd_range=None):
+    """Query the focus model time series from the database.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        A session connected to the ir_psf database.
+    mjd_range : tuple, optional
+        The ``(min, max)`` MJD to load.  By default the whole table is
+        loaded.
+
+    Returns
+    -------
+    mjds : numpy.ndarray
+        The sorted MJDs of the focus samples.
+    focus : numpy.ndarray
+        The focus values, in microns.
+    """
+
+    query = session.query(FocusModel.mjd, FocusModel.focus)
+    if mjd_range is not None:
+        query = query.filter(FocusModel.mjd >= mjd_range[0])\
+            .filter(FocusModel.mjd <= mjd_range[1])
+    results = query.order_by(FocusModel.mjd).all()
+
+    mjds = np.array([result[0] for result in results], dtype=float)
+    focus = np.array([result[1] for result in results], dtype=float)
+    return mjds, focus
+
+
+def load_focus_model(session, mjd_range=None, cache_file=None):
+    """Load the focus model, from the cache if it is up to date.
+
+    Parameters
+    ----------
+    session : sqlalchemy.orm.Session
+        A session connected to the ir_psf database.
+    mjd_range : tuple, optional
+        The ``(min, max)`` MJD to return.  When the cache is stale, only
+        this slice is queried and the cache is left untouched.
+    cache_file : str, optional
+        The path to the cache file.  Defaults to ``focus_model.npz`` in
+        the ``focus_model`` cache directory.
+
+    Returns
+    -------
+    mjds : numpy.ndarray
+        The sorted MJDs of the focus samples.
+    focus : numpy.ndarray
+        The focus values, in microns.
+    """
+
+    if cache_file is None:
+        cache_file = os.path.join(get_cache_dir('focus_model'), 'focus_model.npz')
+    signature = get_focus_model_signature(session)
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cache:
+            if np.array_equal(cache['signature'], signature):
+                mjds, focus = cache['mjds'], cache['focus']
+                if mjd_range is not None:
+                    start, end = np.searchsorted(mjds, mjd_range[0], 'left'), \
+                        np.searchsorted(mjds, mjd_range[1], 'right')
+                    mjds, focus = mjds[start:end], focus[start:end]
+                logging.info('Loaded {} focus model samples from {}'.format(
+                    len(mjds), cache_file))
+                return mjds, focus
+
+    mjds, focus = query_focus_model(session, mjd_range)
+    logging.info('Loaded {} focus model samples from the database'.format(len(mjds)))
+    if mjd_range is None:
+        # Per process, so that concurrent ingests do not write the same file
+        temp_file = cache_file + '.{}.tmp.npz'.format(os.getpid())
+        np.savez(temp_file, signature=signature, mjds=mjds, focus=focus)
+        os.replace(temp_file, cache_file)
+
+    return mjds, focus
+
+
+def interpolate_focus(model_mjds, model_focus, midexps, window=SIX_MINUTES):
+    """Interpolate the focus model at many mid-exposure times at once.
+
+    See the module docstring for the interpolation rules.
+
+    Parameters
+    ----------
+    model_mjds : numpy.ndarray
+        The sorted MJDs of the focus samples.
+    model_focus : numpy.ndarray
+        The focus values of the samples.
+    midexps : array_like
+        The mid-exposure times, in MJD.
+    window : float, default=SIX_MINUTES
+        Only samples within this many days of a midexp are used.
+
+    Returns
+    -------
+    mjds : numpy.ndarray
+        The midexps as floats, NaN where there is no focus value.
+    dates : numpy.ndarray
+        The midexps as datetimes, None where there is no focus value.
+    focus : numpy.ndarray
+        The estimated focus in microns, NaN where no estimate can be
+        made.
+    """
+
+    midexps = np.atleast_1d(np.asarray(midexps, dtype=float))
+    mjds = np.full(midexps.shape, np.nan)
+    dates = np.full(midexps.shape, None, dtype=object)
+    focus = np.full(midexps.shape, np.nan)
+
+    lo = np.searchsorted(model_mjds, midexps - window, 'left')
+    hi = np.searchsorted(model_mjds, midexps + window, 'right')
+    has_focus = hi > lo
+    if not has_focus.any():
+        return mjds, dates, focus
+
+    # The samples bracketing each midexp, clamped to its window
+    right = np.searchsorted(model_mjds, midexps, 'left')
+    left = np.clip(right - 1, lo, hi - 1)[has_focus]
+    right = np.clip(right, lo, hi - 1)[has_focus]
+
+    x0, x1 = model_mjds[left], model_mjds[right]
+    y0, y1 = model_focus[left], model_focus[right]
+    span = np.where(right > left, x1 - x0, 1.)
+    weight = np.where(right > left, (midexps[has_focus] - x0) / span, 0.)
+
+    focus[has_focus] = y0 + weight * (y1 - y0)
+    mjds[has_focus] = midexps[has_focus]
+    # astropy is imported on first use, to keep the scripts' startup fast
+    from astropy.time import Time
+    dates[has_focus] = Time(midexps[has_focus], format='mjd').datetime
+
+    return mjds, dates, focus
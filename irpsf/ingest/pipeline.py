@@ -0,0 +1,189 @@
+"""A staged, multi-process pipeline with a single writer.
+
+Tasks are fed by the calling process into a bounded task queue and
+consumed by a pool of worker processes, which turn each task into a
+result.  The results go through a second bounded queue to a single
+writer process, which hands them to a write function in batches.  The
+writer is the only process that needs a database connection.
+
+Because both queues are bounded, a slow writer makes the workers block,
+which in turn makes the feeder block: the pipeline never holds more
+than a few batches in memory, no matter how many tasks there are.
+
+If the writer or a worker dies, the other processes are terminated and
+a ``RuntimeError`` is raised in the calling process rather than
+deadlocking on a full queue.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.ingest.pipeline import run_pipeline
+        totals = run_pipeline(tasks, process_task, write_results,
+                              n_workers=SETTINGS['cores'])
+"""
+
+from collections import Counter
+import logging
+import multiprocessing
+import queue
+
+
+def _put(target_queue, item, processes):
+    """Put an item on a queue, giving up if a process has died.
+
+    Parameters
+    ----------
+    target_queue : multiprocessing.Queue
+        The queue to put the item on.
+    item : object
+        The item.
+    processes : list
+        Processes that must stay alive for the queue to drain.
+    """
+
+    while True:
+        try:
+            target_queue.put(item, timeout=1)
+            return
+        except queue.Full:
+            for process in processes:
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError('Pipeline process {} exited with code {}'
+                                       .format(process.name, process.exitcode))
+
+
+def _worker(process_task, task_queue, result_queue):
+    """Process tasks until a ``None`` sentinel is received.
+
+    Tasks that raise an exception are logged and dropped.
+
+    Parameters
+    ----------
+    process_task : callable
+        Turns a task into a result, or ``None`` to drop the task.
+    task_queue : multiprocessing.Queue
+        The queue of tasks.
+    result_queue : multiprocessing.Queue
+        The queue of results.
+    """
+
+    for task in iter(task_queue.get, None):
+        try:
+            result = process_task(task)
+        except Exception:
+            logging.exception('Failed to process {}'.format(task))
+            continue
+        if result is not None:
+            result_queue.put(result)
+    result_queue.put(None)
+
+
+def _writer(write_results, result_queue, totals_queue, n_workers, batch_size,
+            initializer):
+    """Write results in batches until every worker has finished.
+
+    Parameters
+    ----------
+    write_results : callable
+        Writes a list of results and returns a dict of counts.
+    result_queue : multiprocessing.Queue
+        The queue of results.
+    totals_queue : multiprocessing.Queue
+        The queue the summed counts are put on when done.
+    n_workers : int
+        The number of workers, i.e. of sentinels to wait for.
+    batch_size : int
+        The number of results per call to ``write_results``.
+    initializer : callable or None
+        Called once when the writer starts, e.g. to reset connections
+        inherited from the parent process.
+    """
+
+    if initializer is not None:
+        initializer()
+
+    totals, batch, finished = Counter(), [], 0
+    while finished < n_workers:
+        result = result_queue.get()
+        if result is None:
+            finished += 1
+        else:
+            batch.append(result)
+        if batch and (len(batch) >= batch_size or finished == n_workers):
+            totals.update(write_results(batch))
+            batch = []
+    totals_queue.put(dict(totals))
+
+
+def run_pipeline(tasks, process_task, write_results, n_workers, batch_size=10,
+                 queue_size=None, writer_initializer=None):
+    """Run tasks through a pool of workers and a single writer.
+
+    Parameters
+    ----------
+    tasks : iterable
+        The tasks to process.  Must be picklable.
+    process_task : callable
+        Run in the worker processes; turns a task into a picklable
+        result, or ``None`` if there is nothing to write.
+    write_results : callable
+        Run in the writer process; writes a list of up to ``batch_size``
+        results and returns a dict of counts, which are summed.
+    n_workers : int
+        The number of worker processes.
+    batch_size : int, default=10
+        The number of results written per call to ``write_results``.
+    queue_size : int, optional
+        The capacity of each queue.  Defaults to twice the number of
+        workers for the task queue and twice ``batch_size`` for the
+        result queue.
+    writer_initializer : callable, optional
+        Called once in the writer process before writing.
+
+    Returns
+    -------
+    totals : dict
+        The summed counts returned by ``write_results``.
+    """
+
+    n_workers = max(int(n_workers), 1)
+    task_queue = multiprocessing.Queue(queue_size or 2 * n_workers)
+    result_queue = multiprocessing.Queue(queue_size or 2 * batch_size)
+    totals_queue = multiprocessing.Queue()
+
+    writer = multiprocessing.Process(
+        target=_writer, name='writer',
+        args=(write_results, result_queue, totals_queue, n_workers, batch_size,
+              writer_initializer))
+    workers = [multiprocessing.Process(target=_worker, name='worker-{}'.format(i),
+                                       args=(process_task, task_queue, result_queue))
+               for i in range(n_workers)]
+    processes = [writer] + workers
+    for process in processes:
+        process.start()
+
+    try:
+        for task in tasks:
+            _put(task_queue, task, processes)
+        for worker in workers:
+            _put(task_queue, None, processes)
+
+        while True:
+            try:
+                totals = totals_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                for process in processes:
+                    if process.exitcode not in (None, 0):
+                        raise RuntimeError('Pipeline process {} exited with code {}'
+                                           .format(process.name, process.exitcode))
+    except BaseException:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+
+    return totals
@@ -0,0 +1,170 @@
+"""Header-only, cached WCS evaluation for WFC3/IR exposures.
+
+Converting PSF positions to RA/Dec only needs the WCS of the SCI
+extension of an exposure's FLT file.  This module reads just that
+header (never the pixel data), builds the ``astropy.wcs.WCS`` object
+and keeps it in an in-memory LRU cache keyed by rootname.  The header
+itself is also written to an on-disk cache (the ``wcs_headers`` cache
+directory, see ``irpsf.settings.settings.get_cache_dir``), so that
+re-ingesting an exposure, or re-deriving its coordinates, never needs
+to touch the FLT file on central storage again.
+
+Headers that refer to distortion lookup-table extensions (``D2IMEXT``
+or ``NPOLEXT``) cannot be rebuilt from the header alone; for those the
+WCS is built from the open FLT file and only cached in memory.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.ingest.wcs_service import get_ra_dec
+        ra, dec = get_ra_dec(rootname, ql_dir, x, y)
+"""
+
+import functools
+import glob
+import logging
+import os
+
+from irpsf.settings.settings import get_cache_dir
+
+
+LOOKUP_TABLE_KEYWORDS = ('D2IMEXT', 'NPOLEXT')
+
+
+def get_header_cache_path(rootname):
+    """Return the path of the cached SCI header of an exposure.
+
+    Parameters
+    ----------
+    rootname : str
+        The rootname of the exposure.
+
+    Returns
+    -------
+    path : str
+        The path to the cached header.
+    """
+
+    return os.path.join(get_cache_dir('wcs_headers'), '{}_sci.hdr'.format(rootname))
+
+
+def find_flt_file(rootname, ql_dir):
+    """Return the path of an exposure's FLT file in its QL directory.
+
+    Parameters
+    ----------
+    rootname : str
+        The rootname of the exposure.
+    ql_dir : str
+        The QL directory of the exposure.
+
+    Returns
+    -------
+    flt_path : str
+        The path to the FLT file.
+    """
+
+    flt_paths = glob.glob(os.path.join(ql_dir, '{}*flt.fits'.format(rootname)))
+    if not flt_paths:
+        raise FileNotFoundError('No FLT file for {} in {}'.format(rootname, ql_dir))
+    return flt_paths[0]
+
+
+def read_sci_header(rootname, ql_dir=None):
+    """Return the SCI header of an exposure, from the cache if possible.
+
+    Parameters
+    ----------
+    rootname : str
+        The rootname of the exposure.
+    ql_dir : str, optional
+        The QL directory of the exposure.  Only needed when the header
+        is not cached yet.
+
+    Returns
+    -------
+    header : astropy.io.fits.Header
+        The header of the first (SCI) extension.
+    flt_path : str or None
+        The path of the FLT file the header was read from, or None if
+        it came from the cache.
+    """
+
+    # astropy is imported on first use, to keep the scripts' startup fast
+    from astropy.io import fits
+
+    cache_path = get_header_cache_path(rootname)
+    if os.path.exists(cache_path):
+        return fits.Header.fromfile(cache_path, sep='\n', endcard=False, padding=False), None
+
+    if ql_dir is None:
+        raise FileNotFoundError('The header of {} is not cached and no QL '
+                                'directory was given'.format(rootname))
+    flt_path = find_flt_file(rootname, ql_dir)
+    header = fits.getheader(flt_path, ext=1)
+
+    if not any(keyword in header for keyword in LOOKUP_TABLE_KEYWORDS):
+        temp_path = cache_path + '.tmp{}'.format(os.getpid())
+        header.totextfile(temp_path, endcard=False, overwrite=True)
+        os.replace(temp_path, cache_path)
+
+    return header, flt_path
+
+
+@functools.lru_cache(maxsize=256)
+def get_wcs(rootname, ql_dir=None):
+    """Return the WCS of an exposure's SCI extension.
+
+    Parameters
+    ----------
+    rootname : str
+        The rootname of the exposure.
+    ql_dir : str, optional
+        The QL directory of the exposure.  Only needed when the header
+        is not cached yet.
+
+    Returns
+    -------
+    wcs : astropy.wcs.WCS
+        The WCS of the exposure.
+    """
+
+    from astropy.io import fits
+    from astropy.wcs import WCS
+
+    header, flt_path = read_sci_header(rootname, ql_dir)
+
+    if any(keyword in header for keyword in LOOKUP_TABLE_KEYWORDS):
+        logging.info('Building the WCS of {} from {} for its distortion '
+                     'lookup tables'.format(rootname, flt_path))
+        with fits.open(flt_path) as hdu:
+            return WCS(hdu[1].header, hdu)
+
+    return WCS(header)
+
+
+def get_ra_dec(rootname, ql_dir, x, y):
+    """Calculate the right ascension and declination of many PSFs at once.
+
+    Parameters
+    ----------
+    rootname : str
+        The rootname of the exposure.
+    ql_dir : str
+        The QL directory of the exposure.  Only needed when the header
+        is not cached yet.
+    x : array_like
+        The x coordinates of the PSFs (1-indexed).
+    y : array_like
+        The y coordinates of the PSFs (1-indexed).
+
+    Returns
+    -------
+    ra : numpy.ndarray
+        Right ascension.
+    dec : numpy.ndarray
+        Declination.
+    """
+
+    return get_wcs(rootname, ql_dir).all_pix2world(x, y, 1)
@@ -0,0 +1,137 @@
+"""Binary sidecar cache of parsed stardb_xym catalogs.
+
+hst1pass never rewrites a ``*.stardb_xym`` file once written, so parsing
+the text again on every run is wasted work.  The first time a file is
+parsed, its stars are written as a ``.npy`` structured array (see
+``irpsf.ingest.xym_parser.XYM_DTYPE``) to the ``xym`` cache directory
+(see ``irpsf.settings.settings.get_cache_dir``); later loads read that
+file instead.
+
+Cache entries are keyed by the source path, size and modification time,
+so a changed xym file is simply parsed again.  Every star is cached,
+including saturated stars and those failing the qfit/g1/g2 cuts, so
+changing the quality cuts never requires re-parsing the text.
+
+Loading an entry updates its modification time, and
+``evict_xym_cache`` removes the least recently used entries until the
+cache fits within a size budget.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.ingest.xym_cache import evict_xym_cache, load_xym_file
+        stars = load_xym_file(xym_file_path)
+        evict_xym_cache(max_bytes)
+"""
+
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from irpsf.ingest.xym_parser import XYM_DTYPE
+from irpsf.ingest.xym_parser import read_xym_file
+from irpsf.settings.settings import get_cache_dir
+
+
+def get_xym_cache_path(xym_file_path, size, mtime_ns):
+    """Return the cache path for a version of an xym file.
+
+    Parameters
+    ----------
+    xym_file_path : str
+        Path to the .stardb_xym file.
+    size : int
+        The size of the file, in bytes.
+    mtime_ns : int
+        The modification time of the file, in nanoseconds.
+
+    Returns
+    -------
+    cache_path : str
+        The path of the cached ``.npy`` file.
+    """
+
+    key = '{}:{}:{}'.format(os.path.abspath(xym_file_path), size, mtime_ns)
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    rootname = os.path.basename(xym_file_path)[0:9]
+    return os.path.join(get_cache_dir('xym'), '{}_{}.npy'.format(rootname, digest))
+
+
+def load_xym_file(xym_file_path, size=None, mtime_ns=None):
+    """Return every star of an xym file, from the cache if possible.
+
+    Parameters
+    ----------
+    xym_file_path : str
+        Path to the .stardb_xym file.
+    size : int, optional
+        The size of the file, if already known.
+    mtime_ns : int, optional
+        The modification time of the file in nanoseconds, if already
+        known.  The file is only stat'ed if ``size`` or ``mtime_ns`` is
+        not given.
+
+    Returns
+    -------
+    stars : numpy.ndarray
+        The stars of the file, as returned by
+        ``irpsf.ingest.xym_parser.read_xym_file``.
+    """
+
+    if size is None or mtime_ns is None:
+        stat = os.stat(xym_file_path)
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+    cache_path = get_xym_cache_path(xym_file_path, size, mtime_ns)
+
+    try:
+        stars = np.load(cache_path)
+        if stars.dtype == XYM_DTYPE:
+            os.utime(cache_path)
+            return stars
+    except (OSError, ValueError):
+        pass
+
+    stars = read_xym_file(xym_file_path)
+    temp_path = cache_path + '.tmp{}.npy'.format(os.getpid())
+    np.save(temp_path, stars)
+    os.replace(temp_path, cache_path)
+
+    return stars
+
+
+def evict_xym_cache(max_bytes):
+    """Delete the least recently used cache entries beyond a size budget.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The maximum total size of the cache, in bytes.
+
+    Returns
+    -------
+    n_evicted : int
+        The number of entries deleted.
+    """
+
+    with os.scandir(get_cache_dir('xym')) as entries:
+        cache_files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                       for entry in entries if entry.name.endswith('.npy')]
+
+    total_bytes = sum(size for _, size, _ in cache_files)
+    n_evicted = 0
+    for _, size, path in sorted(cache_files):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        n_evicted += 1
+
+    logging.info('Evicted {} xym cache entries; {:.1f} MB remain'.format(
+        n_evicted, total_bytes / 1e6))
+    return n_evicted
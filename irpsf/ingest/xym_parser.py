@@ -0,0 +1,107 @@
+"""Fast reading of hst1pass ``*.stardb_xym`` star catalogs.
+
+hst1pass writes one line per detected star, with 12 whitespace
+separated columns:
+
+    1) xfit (x position) aka psf_x_center
+    2) yfit (y position) aka psf_y_center
+    3) mfit (instrumental magnitude)
+    4) qfit (quality of fit, the absolute fractional residual, 0 = perfect fit)
+    5) zfit  --- the fitted flux; 10**(-mfit/2.5) aka psf_flux
+    6) sfit (the fitted sky) aka sky
+    7) cobs (the central pixel value) aka pixc
+    8) cexp (the fraction of light expected in the central pixel)
+    9) N + star number
+    10) sat (saturation)
+    11) g1
+    12) g2
+
+``read_xym_file`` reads a file straight into a NumPy structured array
+with NumPy's C parser, and ``apply_quality_cuts`` selects the stars
+passing the qfit, g1, g2 and saturation cuts with a single combined
+mask.  Files without any stars give an empty array.
+
+Use
+---
+    This module is intended to be imported by the ingestion scripts:
+
+        from irpsf.ingest.xym_parser import apply_quality_cuts, read_xym_file
+        stars = apply_quality_cuts(read_xym_file(xym_file_path))
+"""
+
+import warnings
+
+import numpy as np
+
+
+XYM_DTYPE = np.dtype([('psf_x_center', 'f8'), ('psf_y_center', 'f8'),
+                      ('mfit', 'f8'), ('qfit', 'f8'), ('psf_flux', 'f8'),
+                      ('sky', 'f8'), ('pixc', 'f8'), ('cexp', 'f8'),
+                      ('N', 'U12'), ('sat', 'i2'), ('g1', 'f8'), ('g2', 'f8')])
+
+
+def read_xym_file(xym_file_path):
+    """Read every star of a stardb_xym file.
+
+    Parameters
+    ----------
+    xym_file_path : str
+        Path to the .stardb_xym file.
+
+    Returns
+    -------
+    stars : numpy.ndarray
+        A structured array with one element per star and the fields of
+        ``XYM_DTYPE``.  Empty if the file has no stars.
+    """
+
+    with warnings.catch_warnings():
+        # np.loadtxt warns about empty files, which are expected
+        warnings.simplefilter('ignore', UserWarning)
+        return np.loadtxt(xym_file_path, dtype=XYM_DTYPE, ndmin=1)
+
+
+def get_quality_mask(stars, qfit_max=0.15, g1_max=0.15, g2_max=0.15,
+                     include_saturated_stars=False):
+    """Return the mask of the stars passing the quality cuts.
+
+    Parameters
+    ----------
+    stars : numpy.ndarray
+        Stars as returned by ``read_xym_file``.
+    qfit_max : float, default=0.15
+        The maximum qfit.
+    g1_max : float, default=0.15
+        The maximum g1.
+    g2_max : float, default=0.15
+        The maximum g2.
+    include_saturated_stars : bool, default=False
+        Keep saturated stars or not.
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        True for the stars passing all of the cuts.
+    """
+
+    mask = (stars['qfit'] <= qfit_max) & (stars['g1'] <= g1_max) & \
+        (stars['g2'] <= g2_max)
+    if not include_saturated_stars:
+        mask &= stars['sat'] == 0
+    return mask
+
+
+def apply_quality_cuts(stars, qfit_max=0.15, g1_max=0.15, g2_max=0.15,
+                       include_saturated_stars=False):
+    """Return the stars passing the quality cuts.
+
+    See ``get_quality_mask`` for the parameters.
+
+    Returns
+    -------
+    stars : numpy.ndarray
+        The stars passing all of the cuts.
+    """
+
+    return stars[get_quality_mask(stars, qfit_max, g1_max, g2_max,
+                                  include_saturated_stars)]
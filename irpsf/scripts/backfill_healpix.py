@@ -0,0 +1,241 @@
+#! /usr/bin/env python
+
+"""Fill the healpix column of existing ir_psf_mast records.
+
+make_ir_psf_table.py stores the HEALPix pixel of each PSF it ingests in
+the healpix column, which cone searches use (see
+irpsf.database.cone_search).  This script adds the column and its index
+to a table created before it existed, then computes the pixels of the
+records where it is NULL, in batches of -batch_size records in id
+order, each batch being updated in its own transaction.  It can be
+stopped and run again at any time: it carries on where it stopped.
+
+After changing the healpix_order setting, run it with -all to compute
+the pixels of every record again.  As every record is then updated,
+the last id of each committed batch of a -all run is kept in a state
+file of the ``healpix_backfill`` cache directory (see
+irpsf.settings.settings.get_cache_dir), and an interrupted -all run
+carries on from it when run again at the same order.  The file is
+removed when the run completes; -start_id overrides it, e.g. -start_id
+0 to start over.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python backfill_healpix.py
+        >>> python backfill_healpix.py -batch_size 50000
+        >>> python backfill_healpix.py -all
+        >>> python backfill_healpix.py -all -start_id 0
+"""
+
+import argparse
+import json
+import logging
+import os
+
+import numpy as np
+from sqlalchemy import bindparam
+from sqlalchemy import inspect
+from sqlalchemy import select
+
+from irpsf.database.healpix import ang2pix, get_healpix_order
+from irpsf.database.ir_psf_database_interface import get_engine, retry_on_disconnect
+from irpsf.database.ir_psf_database_interface import PSFTableMAST
+from irpsf.psf_logging.psf_logging import setup_logging
+from irpsf.settings.settings import *
+
+
+def add_healpix_column(engine):
+    """Add the healpix column and its index to the ir_psf_mast table if missing.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The engine of the ir_psf database.
+
+    Returns
+    -------
+    added : bool
+        Whether the column was added.
+    """
+
+    if 'healpix' in [column['name'] for column in inspect(engine).get_columns('ir_psf_mast')]:
+        return False
+
+    with engine.begin() as connection:
+        connection.execute('ALTER TABLE ir_psf_mast ADD COLUMN healpix BIGINT')
+    for index in PSFTableMAST.__table__.indexes:
+        if [column.name for column in index.columns] == ['healpix']:
+            index.create(engine)
+
+    return True
+
+
+def backfill_batch(engine, after_id, batch_size, order, recompute=False):
+    """Compute the healpix of a batch of records.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.engine.Engine
+        The engine of the ir_psf database.
+    after_id : int
+        The records after this id are updated.
+    batch_size : int
+        The number of records to update.
+    order : int
+        The HEALPix order.
+    recompute : bool, default=False
+        Update records whose healpix is not NULL as well.
+
+    Returns
+    -------
+    last_id : int or None
+        The last updated id, None if there was no record to update.
+    n_rows : int
+        The number of updated records.
+    """
+
+    table = PSFTableMAST.__table__
+    query = select([table.c.id, table.c.psf_ra, table.c.psf_dec])\
+        .where(table.c.id > after_id).order_by(table.c.id).limit(batch_size)
+    if not recompute:
+        query = query.where(table.c.healpix.is_(None))
+
+    with engine.begin() as connection:
+        rows = connection.execute(query).fetchall()
+        if not rows:
+            return None, 0
+        ids = [row['id'] for row in rows]
+        pixels = ang2pix(np.array([row['psf_ra'] for row in rows]),
+                         np.array([row['psf_dec'] for row in rows]), order)
+        connection.execute(
+            table.update().where(table.c.id == bindparam('b_id')).values(healpix=bindparam('b_healpix')),
+            [{'b_id': id_, 'b_healpix': pixel} for id_, pixel in zip(ids, pixels.tolist())])
+
+    return ids[-1], len(rows)
+
+
+def get_state_path():
+    """Return the path of the state file of -all runs."""
+
+    return os.path.join(get_cache_dir('healpix_backfill'), 'recompute_state.json')
+
+
+def read_state(order):
+    """Return the last id committed by an interrupted -all run.
+
+    Parameters
+    ----------
+    order : int
+        The HEALPix order of the current run.
+
+    Returns
+    -------
+    last_id : int or None
+        The last id of the last committed batch, None if there is no
+        interrupted run at this order.
+    """
+
+    if not os.path.exists(get_state_path()):
+        return None
+    with open(get_state_path()) as f:
+        state = json.load(f)
+
+    return state['last_id'] if state['order'] == order else None
+
+
+def write_state(order, last_id):
+    """Store the last id committed by a -all run.
+
+    Parameters
+    ----------
+    order : int
+        The HEALPix order of the run.
+    last_id : int
+        The last id of the last committed batch.
+    """
+
+    temp_path = get_state_path() + '.tmp{}'.format(os.getpid())
+    with open(temp_path, 'w') as f:
+        json.dump({'order': order, 'last_id': last_id}, f)
+    os.replace(temp_path, get_state_path())
+
+
+def main_backfill_healpix(batch_size=10000, recompute=False, start_id=None):
+    """The main controller for the backfill_healpix module.
+
+    Parameters
+    ----------
+    batch_size : int, default=10000
+        The number of records updated per transaction.
+    recompute : bool, default=False
+        Compute the healpix of every record, not only the NULL ones.
+    start_id : int, optional
+        Only update the records after this id.  By default, from the
+        start, or for -all from where an interrupted run stopped.
+    """
+
+    engine = get_engine()
+    if add_healpix_column(engine):
+        logging.info('Added the healpix column to ir_psf_mast')
+
+    order = get_healpix_order()
+    if start_id is None and recompute:
+        start_id = read_state(order)
+        if start_id is not None:
+            logging.info('Resuming the interrupted run after id {}'.format(start_id))
+    last_id, n_total = start_id or 0, 0
+    while True:
+        last_id, n_rows = retry_on_disconnect(backfill_batch, engine, last_id, batch_size, order, recompute)
+        if last_id is None:
+            break
+        if recompute:
+            write_state(order, last_id)
+        n_total += n_rows
+        if n_total % (100 * batch_size) < n_rows:
+            logging.info('{} records updated, up to id {}'.format(n_total, last_id))
+
+    if recompute and os.path.exists(get_state_path()):
+        os.remove(get_state_path())
+    logging.info('Updated the healpix of {} records at order {}'.format(n_total, order))
+    print('Updated the healpix of {} records at order {}'.format(n_total, order))
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Fill the healpix column of existing ir_psf_mast records.')
+    parser.add_argument(
+        '-batch_size',
+        type=int,
+        default=10000,
+        help='The number of records updated per transaction.')
+    parser.add_argument(
+        '-all',
+        action='store_true',
+        help='Compute the healpix of every record, e.g. after changing healpix_order.')
+    parser.add_argument(
+        '-start_id',
+        type=int,
+        default=None,
+        help='Only update the records after this id; with -all, from where an interrupted run stopped by default.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    module = os.path.basename(__file__).strip('.py')
+    setup_logging(module)
+
+    main_backfill_healpix(args.batch_size, args.all, args.start_id)
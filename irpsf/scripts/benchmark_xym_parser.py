@@ -0,0 +1,170 @@
+#! /usr/bin/env python
+
+"""Compare the speed of the stardb_xym parsers.
+
+This script times the original ``astropy.io.ascii`` based parsing of
+``*.stardb_xym`` files against ``irpsf.ingest.xym_parser`` on the same
+files, checks that both select the same stars, and prints the time per
+file and the number of stars parsed per second for each.
+
+If no files are given, synthetic files are written to a temporary
+directory.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python benchmark_xym_parser.py
+        >>> python benchmark_xym_parser.py -n_files 50 -n_stars 5000
+        >>> python benchmark_xym_parser.py /path/to/*.stardb_xym
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from astropy.io import ascii
+import numpy as np
+
+from irpsf.benchmarks.synthetic import write_xym_file
+from irpsf.ingest.xym_parser import apply_quality_cuts, read_xym_file
+
+
+def parse_with_astropy(xym_file_path):
+    """Parse a stardb_xym file the way make_ir_psf_table originally did.
+
+    Parameters
+    ----------
+    xym_file_path : str
+        Path to the .stardb_xym file.
+
+    Returns
+    -------
+    n_stars : int
+        The number of stars passing the quality cuts.
+    """
+
+    colnames = ['psf_x_center', 'psf_y_center', 'mfit', 'qfit', 'psf_flux', 'sky', 'pixc', 'cexp', 'N', 'sat', 'g1', 'g2']
+    try:
+        xym_tab = ascii.read(xym_file_path, names=colnames, guess=False, data_start=0,
+                             header_start=None, format='no_header')
+    except ValueError:
+        return 0
+    xym_tab['rootname'] = [os.path.basename(xym_file_path)[0:9]] * len(xym_tab)
+    xym_tab = xym_tab[xym_tab['qfit'] <= 0.15]
+    xym_tab = xym_tab[xym_tab['g1'] <= 0.15]
+    xym_tab = xym_tab[xym_tab['g2'] <= 0.15]
+    xym_tab = xym_tab[xym_tab['sat'] == 0]
+    xym_tab.remove_columns(['mfit', 'cexp', 'N', 'g1', 'g2'])
+
+    return len(xym_tab)
+
+
+def parse_with_xym_parser(xym_file_path):
+    """Parse a stardb_xym file with irpsf.ingest.xym_parser.
+
+    Parameters
+    ----------
+    xym_file_path : str
+        Path to the .stardb_xym file.
+
+    Returns
+    -------
+    n_stars : int
+        The number of stars passing the quality cuts.
+    """
+
+    return len(apply_quality_cuts(read_xym_file(xym_file_path)))
+
+
+def time_parser(parser, xym_file_paths):
+    """Time a parser over files.
+
+    Parameters
+    ----------
+    parser : callable
+        Parses a file and returns the number of selected stars.
+    xym_file_paths : list
+        The files to parse.
+
+    Returns
+    -------
+    elapsed : float
+        The total time, in seconds.
+    n_selected : list
+        The number of selected stars in each file.
+    """
+
+    start = time.perf_counter()
+    n_selected = [parser(xym_file_path) for xym_file_path in xym_file_paths]
+
+    return time.perf_counter() - start, n_selected
+
+
+def benchmark_xym_parser(xym_file_paths):
+    """Time both parsers over files and print the results.
+
+    Parameters
+    ----------
+    xym_file_paths : list
+        The files to parse.
+    """
+
+    n_stars = sum(len(read_xym_file(xym_file_path)) for xym_file_path in xym_file_paths)
+    print('{} files, {} stars'.format(len(xym_file_paths), n_stars))
+
+    results = {}
+    for name, parser in [('astropy', parse_with_astropy), ('xym_parser', parse_with_xym_parser)]:
+        elapsed, n_selected = time_parser(parser, xym_file_paths)
+        results[name] = elapsed, n_selected
+        print('{:>10}: {:8.4f} s/file, {:12.0f} stars/s, {} stars selected'.format(
+            name, elapsed / len(xym_file_paths), n_stars / elapsed, sum(n_selected)))
+
+    if results['astropy'][1] != results['xym_parser'][1]:
+        raise RuntimeError('The parsers selected different stars')
+    print('Speedup: {:.1f}x'.format(results['astropy'][0] / results['xym_parser'][0]))
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Compare the speed of the stardb_xym parsers.')
+    parser.add_argument(
+        'xym_files',
+        nargs='*',
+        help='The stardb_xym files to parse. If none, synthetic files are used.')
+    parser.add_argument(
+        '-n_files',
+        type=int,
+        default=20,
+        help='The number of synthetic files.')
+    parser.add_argument(
+        '-n_stars',
+        type=int,
+        default=2000,
+        help='The number of stars per synthetic file.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    if args.xym_files:
+        benchmark_xym_parser(args.xym_files)
+    else:
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            xym_file_paths = []
+            for i in range(args.n_files):
+                xym_file_paths.append(os.path.join(temp_dir, 'iabc{:04d}q_flt.stardb_xym'.format(i)))
+                write_xym_file(xym_file_paths[-1], args.n_stars, rng)
+            benchmark_xym_parser(xym_file_paths)
@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+
+"""Convert the stardb_ras text files into the binary cutout store.
+
+Each ``<rootname>_flt.stardb_ras`` file in the psf filesystem is
+converted into ``<cutout_dir>/<filter>/<rootname>_cutouts.npy`` (see
+``irpsf.cutouts.ras_store``).  Files that were already converted, and
+have not changed since, are skipped.  With ``-remove``, each text file
+is deleted once its cutout file has been read back and verified to hold
+exactly the same values, and the exposure index (see
+``irpsf.hst1pass.exposure_index``) is pointed to the cutout file.
+
+The files are converted in parallel over ``SETTINGS['cores']``
+processes, and a log file is written to
+<log_dir>/compact_ras_files/.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python compact_ras_files.py -filter F160W
+        >>> python compact_ras_files.py -remove
+"""
+
+import argparse
+import glob
+import logging
+from multiprocessing import Pool
+import os
+
+from irpsf.cutouts.ras_store import convert_ras_file, get_cutout_path, verify_cutout_file
+from irpsf.hst1pass.exposure_index import connect_index, update_ras_path
+from irpsf.psf_logging.psf_logging import setup_logging
+from irpsf.settings.settings import *
+
+
+def compact_ras_file(job):
+    """Convert, and optionally verify and remove, a stardb_ras file.
+
+    Parameters
+    ----------
+    job : tuple
+        The path to the .stardb_ras file, its filter, and whether to
+        remove it once converted.
+
+    Returns
+    -------
+    status : str
+        'skipped', 'converted', 'removed' or 'failed'.
+    """
+
+    ras_file_path, filt, remove = job
+    cutout_path = get_cutout_path(os.path.basename(ras_file_path)[0:9], filt)
+
+    try:
+        status = 'skipped'
+        if not os.path.exists(cutout_path) or os.path.getmtime(cutout_path) < os.path.getmtime(ras_file_path):
+            convert_ras_file(ras_file_path, filt)
+            status = 'converted'
+        if remove:
+            if not verify_cutout_file(ras_file_path, cutout_path):
+                logging.error('{} does not match {}; not removed'.format(cutout_path, ras_file_path))
+                return 'failed'
+            os.remove(ras_file_path)
+            status = 'removed'
+    except Exception:
+        logging.exception('Failed to compact {}'.format(ras_file_path))
+        return 'failed'
+
+    return status
+
+
+def main_compact_ras_files(filt='all', remove=False):
+    """The main controller for the compact_ras_files module.
+
+    Parameters
+    ----------
+    filt : str, default=all
+        The filter to process. If all, process all filters.
+    remove : bool, default=False
+        Delete each stardb_ras file once its conversion is verified.
+    """
+
+    filter_list = [filt]
+    if filt == 'all':
+        filter_list = [os.path.basename(x) for x in glob.glob(SETTINGS['output_dir'] + '/F*')]
+
+    jobs = []
+    for filt in filter_list:
+        with os.scandir(os.path.join(SETTINGS['output_dir'], filt)) as entries:
+            jobs.extend((entry.path, filt, remove) for entry in entries
+                        if entry.name.endswith('.stardb_ras'))
+    logging.info('{} stardb_ras files to compact'.format(len(jobs)))
+
+    counts = {}
+    index = connect_index()
+    with Pool(SETTINGS['cores']) as pool:
+        for job, status in zip(jobs, pool.imap(compact_ras_file, jobs, chunksize=16)):
+            counts[status] = counts.get(status, 0) + 1
+            if status == 'removed':
+                rootname = os.path.basename(job[0])[0:9]
+                update_ras_path(index, rootname[0:8], get_cutout_path(rootname, job[1]))
+    logging.info('Done: {}'.format(counts))
+    print(counts)
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Convert stardb_ras files into the binary cutout store.')
+    parser.add_argument(
+        '-filter',
+        required=False,
+        default='all',
+        help='The filter to the processed.')
+    parser.add_argument(
+        '-remove',
+        action='store_true',
+        help='Delete each stardb_ras file once its conversion is verified.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    module = os.path.basename(__file__).strip('.py')
+    setup_logging(module)
+
+    main_compact_ras_files(args.filter, args.remove)
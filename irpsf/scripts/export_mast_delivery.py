@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+
+"""Export the ir_psf_mast records not yet delivered to MAST.
+
+This replaces dumping the whole ir_psf_mast table and diffing it
+against the previous dump with make_mast_deliverable.py: only the rows
+after the high-watermark of the previous export are read, through a
+server-side cursor, and written to
+<output_dir>/ir_psf_mast_YYYY_MM_DD_deliver.csv.  Each export is
+recorded in the ir_psf_mast_delivery table (see
+irpsf.database.mast_delivery).
+
+For the first export after deliveries made from full dumps, give the
+largest id of the last delivered dump with -after_id.
+
+With -format parquet, the rows are written as a Parquet dataset
+partitioned by filter and year, in the <output_dir>/ir_psf_mast_YYYY_MM_DD_deliver
+directory (see irpsf.database.parquet_export).  With -full, the whole
+table is exported to <output_dir>/ir_psf_mast_YYYY_MM_DD[.csv], and no
+delivery is recorded.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python export_mast_delivery.py
+        >>> python export_mast_delivery.py -output_dir /grp/hst/wfc3p/psf/main_ir/db_dumps
+        >>> python export_mast_delivery.py -after_id 123456789
+        >>> python export_mast_delivery.py -format parquet -full
+"""
+
+import argparse
+import datetime
+import logging
+import os
+
+from irpsf.database.ir_psf_database_interface import get_engine
+from irpsf.database.mast_delivery import export_all_rows, export_new_rows, write_rows
+from irpsf.psf_logging.psf_logging import setup_logging
+from irpsf.settings.settings import *
+
+
+def main_export_mast_delivery(output_dir='.', after_id=None, export_format='csv', full=False):
+    """The main controller for the export_mast_delivery module.
+
+    Parameters
+    ----------
+    output_dir : str, default='.'
+        The directory of the deliverable CSV file.
+    after_id : int, optional
+        Export the rows after this id rather than after the previous
+        export.
+    export_format : str, default='csv'
+        'csv' or 'parquet'.
+    full : bool, default=False
+        Export the whole table, without recording a delivery.
+    """
+
+    name = 'ir_psf_mast_{}'.format(datetime.date.today().strftime('%Y_%m_%d'))
+    if not full:
+        name += '_deliver'
+    if export_format == 'csv':
+        name += '.csv'
+        writer = write_rows
+    else:
+        from irpsf.database.parquet_export import write_parquet_dataset
+        writer = write_parquet_dataset
+    path = os.path.join(output_dir, name)
+
+    chunk_size = SETTINGS.get('export_chunk_size', 10000)
+    if full:
+        n_rows = export_all_rows(get_engine(), path, chunk_size, writer)
+    else:
+        n_rows = export_new_rows(get_engine(), path, after_id, chunk_size, writer)
+    logging.info('Exported {} rows to {}'.format(n_rows, path))
+    print('Exported {} rows to {}'.format(n_rows, path) if n_rows else 'No new rows to export')
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Export the ir_psf_mast records not yet delivered.')
+    parser.add_argument(
+        '-output_dir',
+        default='.',
+        help='The directory of the deliverable CSV file.')
+    parser.add_argument(
+        '-after_id',
+        type=int,
+        default=None,
+        help='Export the rows after this ir_psf_mast id instead of after the previous export.')
+    parser.add_argument(
+        '-format',
+        choices=['csv', 'parquet'],
+        default='csv',
+        help='Write a CSV file or a Parquet dataset partitioned by filter and year.')
+    parser.add_argument(
+        '-full',
+        action='store_true',
+        help='Export the whole table, without recording a delivery.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    module = os.path.basename(__file__).strip('.py')
+    setup_logging(module)
+
+    main_export_mast_delivery(args.output_dir, args.after_id, args.format, args.full)
@@ -0,0 +1,169 @@
+#! /usr/bin/env python
+
+"""Summarize the resource usage of the hst1pass jobs.
+
+This script reads the job_metrics table of the exposure index (see
+irpsf.hst1pass.job_metrics) and prints:
+
+(1) the throughput of each filter: the number of jobs and failures, the
+    total and mean wall time, the mean CPU time, the peak memory and the
+    number of stars and output bytes per second of wall time,
+(2) the slowest exposures, and
+(3) the projected runtime of the current backlog: the exposures in the
+    QL database that run_hst1pass_IR.py has yet to process, estimated
+    as by irpsf.hst1pass.scheduler and divided over SETTINGS['cores']
+    (or -cores) concurrent jobs.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python hst1pass_report.py
+        >>> python hst1pass_report.py -n_slowest 50 -filter F160W -cores 10
+        >>> python hst1pass_report.py -no_backlog
+"""
+
+import argparse
+
+from irpsf.hst1pass.exposure_index import connect_index, get_filter_wall_times, get_new_records
+from irpsf.hst1pass.job_metrics import get_filter_throughput, get_slowest_jobs
+from irpsf.hst1pass.scheduler import estimate_costs
+from irpsf.settings.settings import *
+
+
+def print_throughput(index):
+    """Print the throughput of each filter.
+
+    Parameters
+    ----------
+    index : sqlite3.Connection
+        The connection to the exposure index.
+    """
+
+    print('{:>6} {:>7} {:>6} {:>9} {:>8} {:>8} {:>8} {:>9} {:>9}'.format(
+        'filter', 'jobs', 'failed', 'wall [h]', 'wall [s]', 'cpu [s]', 'rss [MB]',
+        'stars/s', 'MB/s'))
+    for filt, n_jobs, n_failed, total_wall, mean_wall, mean_cpu, max_rss, n_stars, n_bytes \
+            in get_filter_throughput(index):
+        total_wall = total_wall or 0.
+        rate = 1. / total_wall if total_wall else 0.
+        print('{:>6} {:>7d} {:>6d} {:>9.2f} {:>8.1f} {:>8.1f} {:>8.0f} {:>9.1f} {:>9.3f}'.format(
+            filt, n_jobs, n_failed, total_wall / 3600., mean_wall or 0., mean_cpu or 0.,
+            max_rss or 0., (n_stars or 0) * rate, (n_bytes or 0) * rate / 1e6))
+
+
+def print_slowest_jobs(index, n_jobs):
+    """Print the slowest exposures.
+
+    Parameters
+    ----------
+    index : sqlite3.Connection
+        The connection to the exposure index.
+    n_jobs : int
+        The number of exposures to print.
+    """
+
+    print('{:>9} {:>6} {:>10} {:>8} {:>8} {:>8} {:>7}'.format(
+        'rootname', 'filter', 'status', 'wall [s]', 'cpu [s]', 'rss [MB]', 'stars'))
+    for ql_root, filt, status, wall_time, cpu_time, peak_rss_mb, n_stars \
+            in get_slowest_jobs(index, n_jobs):
+        print('{:>9} {:>6} {:>10} {:>8.1f} {:>8.1f} {:>8.0f} {:>7}'.format(
+            ql_root, filt, status, wall_time or 0., cpu_time or 0., peak_rss_mb or 0.,
+            n_stars if n_stars is not None else '-'))
+
+
+def print_backlog_projection(index, filters, cores):
+    """Print the projected runtime of the exposures yet to be processed.
+
+    Parameters
+    ----------
+    index : sqlite3.Connection
+        The connection to the exposure index.
+    filters : list
+        The filters of the backlog, or ['all'].
+    cores : int
+        The number of concurrent hst1pass jobs.
+    """
+
+    # Imported here so that the rest of the report works without QL
+    from irpsf.scripts.run_hst1pass_IR import get_ql_records
+
+    backlog = get_new_records(index, get_ql_records(filters))
+    costs = estimate_costs(backlog, get_filter_wall_times(index))
+    per_filter = {}
+    for record, cost in zip(backlog, costs):
+        n_jobs, total = per_filter.get(record[0], (0, 0.))
+        per_filter[record[0]] = (n_jobs + 1, total + cost)
+
+    print('{:>6} {:>7} {:>10}'.format('filter', 'jobs', 'job-h'))
+    for filt, (n_jobs, total) in sorted(per_filter.items(), key=lambda item: -item[1][1]):
+        print('{:>6} {:>7d} {:>10.2f}'.format(filt, n_jobs, total / 3600.))
+    print('{} exposures, about {:.2f} h on {} cores'.format(
+        len(backlog), sum(costs) / 3600. / max(cores, 1), cores))
+
+
+def main_hst1pass_report(n_slowest=20, filters=['all'], cores=None, backlog=True):
+    """The main controller for the hst1pass_report module.
+
+    Parameters
+    ----------
+    n_slowest : int, default=20
+        The number of slowest exposures to print.
+    filters : list, default=['all']
+        The filters of the backlog.
+    cores : int, optional
+        The number of concurrent jobs of the projection.  Defaults to
+        SETTINGS['cores'].
+    backlog : bool, default=True
+        Query QL for the backlog and print its projected runtime.
+    """
+
+    index = connect_index()
+
+    print('Throughput per filter')
+    print_throughput(index)
+    print('\nSlowest exposures')
+    print_slowest_jobs(index, n_slowest)
+    if backlog:
+        print('\nProjected runtime of the backlog')
+        print_backlog_projection(index, filters, cores or SETTINGS['cores'])
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Summarize the resource usage of the hst1pass jobs.')
+    parser.add_argument(
+        '-n_slowest',
+        type=int,
+        default=20,
+        help='The number of slowest exposures to print.')
+    parser.add_argument(
+        '-filter',
+        nargs='+',
+        default=['all'],
+        help='The filters of the backlog, all filters by default.')
+    parser.add_argument(
+        '-cores',
+        type=int,
+        default=None,
+        help='The number of concurrent jobs of the projection.')
+    parser.add_argument(
+        '-no_backlog',
+        action='store_true',
+        help='Do not query QL for the projected runtime of the backlog.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    main_hst1pass_report(args.n_slowest, args.filter, args.cores, not args.no_backlog)
@@ -18,77 +18,176 @@ Use
         >>> python make_focus_model_table.py
 """
 
-import datetime
 import glob
 import logging
+from multiprocessing import Pool
 import os
 
-from irpsf.database.ir_psf_database_interface import engine, session, FocusModel
+import numpy as np
+from sqlalchemy import select
+
+from irpsf.database.bulk_ingest import get_insert_ignore_statement
+from irpsf.database.ir_psf_database_interface import get_engine, retry_on_disconnect, FocusModel
 from irpsf.psf_logging.psf_logging import setup_logging
 from irpsf.settings.settings import *
-from sqlalchemy.exc import IntegrityError
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+N_FIELDS = 8
+WHITESPACE = np.frombuffer(b' \t\n\r\x0b\x0c', dtype=np.uint8)
 
 
-def get_record_dict(record):
-    """Return a dictionary containing the focus measurements.
+def parse_focus_file(data_file):
+    """Read the focus measurements of a Focus<year>.txt file.
+
+    Each line of the file holds the MJD (followed by a separator
+    character), the date as ``Mon DD YYYY HH:MM:SS`` and the focus value.
+    Lines without these fields are skipped with a warning.  The file is
+    split at once, the lines with the wrong number of tokens are found
+    from the positions of the tokens, and the columns of the other lines
+    are converted with vectorized NumPy operations.
 
     Parameters
     ----------
-    record : list
-        A list containing the focus measurements for the given record
-        Each element in the list must map to a column in the
-        focus_model table.
+    data_file : str
+        The path to the focus model file.
 
     Returns
     -------
-    record_dict : dict
-        A dictionary containing the focus measurements for the given
-        record.  Each key in the dict is a column in the focus_model
-        table.
+    data_file : str
+        The path to the focus model file.
+    mjds : numpy.ndarray
+        The time of each measurement, in MJD.
+    dates : numpy.ndarray
+        The date and time of each measurement, as datetime64.
+    focus : numpy.ndarray
+        The focus model values.
     """
 
-    record_dict = {}
-    record_dict['mjd'] = record[0][:-1]
-    date_string = '{} {} {} {}'.format(record[1], record[2], record[3], record[4])
-    record_dict['date'] = datetime.datetime.strptime(date_string, '%b %d %Y %H:%M:%S')
-    record_dict['focus'] = record[5]
+    # Splitting on the colons as well gives N_FIELDS tokens per line: mjd,
+    # month, day, year, hours, minutes, seconds and focus
+    with open(data_file, 'rb') as f:
+        text = f.read()
+    data = np.frombuffer(text.replace(b':', b' ') + b'\n', dtype=np.uint8).copy()
+
+    # The line of every token, from the positions of the token boundaries
+    space = np.isin(data, WHITESPACE)
+    newlines = np.flatnonzero(data == ord('\n'))
+    starts = np.flatnonzero(~space & np.r_[True, space[:-1]])
+    ends = np.flatnonzero(space & np.r_[False, ~space[:-1]])
+    token_lines = np.searchsorted(newlines, starts)
+    n_tokens = np.bincount(token_lines, minlength=len(newlines))
+
+    # Blank the separator ending the MJD, the first token of each line
+    first = (np.diff(token_lines, prepend=-1) != 0) & (ends - starts > 1)
+    data[ends[first] - 1] = ord(' ')
+
+    tokens = np.array(data.tobytes().split())
+    tokens = tokens[(n_tokens == N_FIELDS)[token_lines]].reshape(-1, N_FIELDS)
+    valid = np.isin(tokens[:, 1], [name.encode() for name in MONTHS])
+    n_valid = np.count_nonzero(n_tokens == N_FIELDS) - np.count_nonzero(~valid)
+    if n_valid < np.count_nonzero(n_tokens):
+        for number, line in enumerate(text.decode().splitlines(), 1):
+            fields = line.replace(':', ' ').split()
+            if fields and not (len(fields) == N_FIELDS and fields[1] in MONTHS):
+                logging.warning('Skipping malformed line {} of {}: {}'.format(number, data_file, line.strip()))
+    tokens = tokens[valid]
+
+    mjds = tokens[:, 0].astype(float)
 
-    #print(record_dict)
+    months = np.zeros(len(tokens), dtype=np.int64)
+    for number, name in enumerate(MONTHS, 1):
+        months[tokens[:, 1] == name.encode()] = number
+    years, days, hours, minutes, seconds = tokens[:, [3, 2, 4, 5, 6]].astype(np.int64).T
+    dates = ((years - 1970) * 12 + months - 1).astype('datetime64[M]').astype('datetime64[s]')
+    dates += ((days - 1) * 86400 + hours * 3600 + minutes * 60 + seconds).astype('timedelta64[s]')
 
-    return record_dict
+    focus = tokens[:, 7].astype(float)
+
+    return data_file, mjds, dates, focus
+
+
+def get_existing_mjds(mjd_min, mjd_max):
+    """Return the MJDs already in the focus_model table within a range.
+
+    Parameters
+    ----------
+    mjd_min : float
+        The start of the range, in MJD.
+    mjd_max : float
+        The end of the range, in MJD.
+
+    Returns
+    -------
+    mjd_keys : numpy.ndarray
+        The MJDs in the table, as integers in units of 1e-5 days (the
+        precision of the mjd column).
+    """
+
+    table = FocusModel.__table__
+    results = get_engine().execute(select([table.c.mjd])
+                             .where(table.c.mjd >= mjd_min)
+                             .where(table.c.mjd <= mjd_max)).fetchall()
+
+    return np.round(np.array([item[0] for item in results], dtype=float) * 1e5).astype(np.int64)
+
+
+def insert_focus_records(mjds, dates, focus, batch_size):
+    """Insert new focus measurements in batches within one transaction.
+
+    Parameters
+    ----------
+    mjds : numpy.ndarray
+        The time of each measurement, in MJD.
+    dates : numpy.ndarray
+        The date and time of each measurement, as datetime64.
+    focus : numpy.ndarray
+        The focus model values.
+    batch_size : int
+        The number of rows per executemany call.
+    """
+
+    engine = get_engine()
+    statement = get_insert_ignore_statement(FocusModel.__table__, engine.dialect.name)
+    with engine.begin() as connection:
+        for start in range(0, len(mjds), batch_size):
+            stop = start + batch_size
+            records = [{'mjd': mjd, 'date': date, 'focus': value} for mjd, date, value in
+                       zip(np.round(mjds[start:stop], 5).tolist(),
+                           dates[start:stop].astype(object).tolist(),
+                           focus[start:stop].tolist())]
+            connection.execute(statement, records)
 
 
 def make_focus_table_main():
     """The main controller for the make_focus_model_table module.
 
     The focus information is stored in the
-    /grp/hst/wfc3p/psf/main/focus-models/Focus<year> files.
+    /grp/hst/wfc3p/psf/main/focus-models/Focus<year> files. The files are
+    parsed in parallel over SETTINGS['cores'] processes, measurements
+    already in the table are dropped, and the rest are inserted in batches
+    of SETTINGS['insert_batch_size'] rows (default 10000).
     """
 
     logging.info('Process Starting')
     data_files = glob.glob(SETTINGS['focus_models'] +'/*Focus*.txt')
+    batch_size = SETTINGS.get('insert_batch_size', 10000)
 
-    # Get list of mjds that already exist in the table
-    results = session.query(FocusModel.mjd).all()
-    mjd_list = [str(item[0]) for item in results]
-
-    for data_file in data_files:
+    with Pool(min(SETTINGS['cores'], max(len(data_files), 1))) as pool:
+        for data_file, mjds, dates, focus in pool.imap_unordered(parse_focus_file, data_files):
 
-        logging.info('Reading data from {}'.format(data_file))
+            logging.info('Read {} records from {}'.format(len(mjds), data_file))
+            if len(mjds) == 0:
+                continue
 
-        with open(data_file, 'r') as f:
-            data = f.readlines()
+            # Keep the first occurrence of each measurement in the file,
+            # unless it already exists in the table
+            mjd_keys = np.round(mjds * 1e5).astype(np.int64)
+            new = np.zeros(len(mjd_keys), dtype=bool)
+            new[np.unique(mjd_keys, return_index=True)[1]] = True
+            new &= ~np.isin(mjd_keys, retry_on_disconnect(get_existing_mjds, mjds.min(), mjds.max()))
 
-        for record in data:
-            record = record.split()
-            record_dict = get_record_dict(record)
-            if record_dict['mjd'] not in mjd_list:
-                #print(record_dict)
-                logging.info('Inserting records for {}'.format(record_dict['date']))
-                try:
-                    engine.execute(FocusModel.__table__.insert(), record_dict)
-                except IntegrityError:
-                    print ('{} already in table'.format(record_dict['date']))
+            retry_on_disconnect(insert_focus_records, mjds[new], dates[new], focus[new], batch_size)
+            logging.info('Inserted {} records from {}'.format(new.sum(), data_file))
 
     logging.info('Process Complete')
 
@@ -1,24 +1,25 @@
 #! /usr/bin/env python
 
 import argparse
-from astropy.io import ascii, fits
-from astropy.wcs import WCS
 import datetime
 import glob
-import numpy as np
 import logging
 import os
-from astropy.time import Time
 
-from irpsf.database.ir_psf_database_interface import engine, session, FocusModel, PSFTableMAST
+from irpsf.database.healpix import ang2pix, get_healpix_order
+from irpsf.database.ingest_ledger import get_changed_xym_files, make_ledger_record, write_ingested_exposures
+from irpsf.database.ir_psf_database_interface import dispose_engines, get_engine, get_ql_session, get_session
+from irpsf.database.ir_psf_database_interface import retry_on_disconnect
+from irpsf.database.ir_psf_database_interface import ProprietaryExposure
+from irpsf.database.ql_metadata import chunks, get_public_rootnames, get_ql_metadata
+from irpsf.ingest.focus_model import interpolate_focus, load_focus_model
+from irpsf.ingest.pipeline import run_pipeline
+from irpsf.ingest.wcs_service import get_ra_dec
+from irpsf.ingest.xym_cache import evict_xym_cache, load_xym_file
+from irpsf.ingest.xym_parser import get_quality_mask
 from irpsf.psf_logging.psf_logging import setup_logging
 from irpsf.settings.settings import *
 
-from pyql.database.ql_database_interface import Master
-from pyql.database.ql_database_interface import IR_flt_0
-from pyql.database.ql_database_interface import IR_flt_1
-from pyql.database.ql_database_interface import session as ql_session
-
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -37,6 +38,7 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 | mjd          | decimal(12,5) | YES  | MUL | NULL    |                |
 | date         | datetime      | YES  | MUL | NULL    |                |
 | focus	       | float         | YES  |     | NULL    |                |
+| healpix      | bigint(20)    | YES  | MUL | NULL    |                |
 """
 def parse_args():
     """Parse the command line arguments.
@@ -57,10 +59,90 @@ def parse_args():
 
     return args
 
+def shift_years(date, years):
+    """Return ``date`` shifted by a whole number of years.
+
+    February 29 is mapped to February 28 in non-leap years.
+
+    Parameters
+    ----------
+    date : datetime.date
+        The date to shift.
+    years : int
+        The number of years to shift by; may be negative.
+
+    Returns
+    -------
+    shifted_date : datetime.date
+        The shifted date.
+    """
+
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:
+        return date.replace(year=date.year + years, day=28)
+
+
+def get_still_proprietary_rootnames(filt, today):
+    """Return the recorded rootnames that are not yet public.
+
+    Parameters
+    ----------
+    filt : str
+        The filter being processed.
+    today : datetime.date
+        The current date.
+
+    Returns
+    -------
+    rootnames : set
+        The rootnames whose recorded public date is after ``today``.
+    """
+
+    results = get_session().query(ProprietaryExposure.rootname)\
+        .filter(ProprietaryExposure.filter == filt)\
+        .filter(ProprietaryExposure.public_date > today).all()
+
+    return set(result[0] for result in results)
+
+
+def update_proprietary_records(filt, public, proprietary):
+    """Record proprietary exposures and forget those now public.
+
+    Parameters
+    ----------
+    filt : str
+        The filter being processed.
+    public : list
+        Rootnames that are out of their proprietary period.
+    proprietary : dict
+        Maps rootnames still in their proprietary period to their
+        observation dates.
+    """
+
+    table = ProprietaryExposure.__table__
+    records = [{'rootname': rootname, 'filter': filt, 'date_obs': date_obs,
+                'public_date': shift_years(date_obs, 1)}
+               for rootname, date_obs in proprietary.items()]
+
+    with get_engine().begin() as connection:
+        for chunk in chunks(list(public) + list(proprietary), SETTINGS.get('ql_chunk_size', 1000)):
+            connection.execute(table.delete().where(table.c.rootname.in_(chunk)))
+        if records:
+            connection.execute(table.insert(), records)
+
+
 def get_new_files_to_ingest(filt):
-	"""For a given filter, checks files in filesystem against files already in database.
+    """For a given filter, checks files in filesystem against files already in database.
+
+    Returns the stardb_xym files in filesystem that are NOT in the ingest
+    ledger, or that changed since they were ingested, i.e. new files, to
+    process. Next, checks if files are out of the proprietary period.
 
-    Returns a list of rootnames of files in filesystem but NOT in database, i.e. new files, to process. Next, checks if files are out of the proprietary period.
+    The proprietary check is done with a few chunked QL queries. Exposures
+    found to be proprietary are recorded in the ir_psf_proprietary table
+    along with the date they become public, and are not checked against QL
+    again until then.
 
     Parameters
     ----------
@@ -69,57 +151,51 @@ def get_new_files_to_ingest(filt):
 
     Returns
     -------
-    new_rootnames_public : list
-        The new rootnames to be processed.
+    new_files_public : dict
+        Maps the new rootnames to be processed to the (path, size, mtime_ns)
+        of their xym files.
+    changed : set
+        The rootnames in new_files_public that were ingested before and
+        whose xym file has since changed.
     """
 
-	logging.info('Getting list of new files to ingest for {}'.format(filt))
-
-	#Determine which rootnames are in the filesystem
-	files_in_psf_filesystem = glob.glob(SETTINGS['output_dir'] + '/{}/*ras'.format(filt))
-	rootnames_in_psf_filesystem = set([os.path.basename(x)[0:9] for x in files_in_psf_filesystem])
-
-	# #Determine which rootnames are already in the database
-	# psf_session, psf_base, psf_engine = loadConnection(SETTINGS['psf_connection_string'])
-	# rootnames_in_database = psf_session.query(distinct(PSFTableMAST.rootname)).all()
-	# rootnames_in_database = [item[0] for item in rootnames_in_database]
-	# new_rootnames = set(rootnames_in_psf_filesystem) - rootnames_in_database
-
-	new_rootnames = list(rootnames_in_psf_filesystem) #delete once block above is uncommented
-	logging.info('{} total new files for {}'.format(len(new_rootnames), filt))
-
-	# Remove any new rootnames that are proprietary
-	today = datetime.datetime.today()
-	one_year_ago = today.replace(year=today.year-1)
-	new_rootnames_public = []
-
-	for rootname in new_rootnames:
-		results = ql_session.query(IR_flt_0.ql_root, IR_flt_0.date_obs)\
-			.filter(IR_flt_0.ql_root == rootname[:-1]).one()
-		date_obs = datetime.datetime.combine(results[1], datetime.time.min)
-		if date_obs < one_year_ago:
-			new_rootnames_public.append(rootname)
-	logging.info('{} new non-proprietary files to ingest for {}'.format(len(new_rootnames_public), filt))
-
-	return new_rootnames_public
-
-def parse_xym_file(xym_file_path, include_saturated_stars=False):
-	""" Reads in <filename>.stardb_xym file, returns an `astropy.table.Table`
-	with data. Each row is a psf detected in <filename>.
-
-	<filename>.stardb_xym has a list of detected stars, with 13 columns.
-	1) xfit (x position)
-	2) yfit (y position)
-	3) mfit (instrumental magnitude)
-	4) qfit (quality of fit, the absolute fractional residual, 0 = perfect fit)
-	5) zfit  --- the fitted flux; 10**(-mfit/2.5) aka psf_flux
-	6) sfit (the fitted sky) aka sky
-	7) cobs (the central pixel value) aka pixc
-	8) cexp (the fraction of light expected in the central pixel)
-	9) N + star number
-	10) sat (saturation)
-	11) g1
-	12) g2
+    logging.info('Getting list of new files to ingest for {}'.format(filt))
+
+    #Determine which files in the filesystem are not in the ledger
+    new_files, changed = retry_on_disconnect(get_changed_xym_files, get_session(), filt,
+                                             os.path.join(SETTINGS['output_dir'], filt))
+    new_rootnames = list(new_files)
+    logging.info('{} total new files for {} ({} changed since ingest)'.format(len(new_rootnames), filt, len(changed)))
+
+    # Remove any new rootnames that are proprietary, skipping those
+    # already known to be proprietary
+    today = datetime.date.today()
+    still_proprietary = retry_on_disconnect(get_still_proprietary_rootnames, filt, today)
+    candidates = [rootname for rootname in new_rootnames if rootname not in still_proprietary]
+    logging.info('{} files known to be proprietary for {}'.format(len(new_rootnames) - len(candidates), filt))
+
+    new_rootnames_public, proprietary, missing = get_public_rootnames(
+        get_ql_session(), candidates, shift_years(today, -1), SETTINGS.get('ql_chunk_size', 1000))
+    retry_on_disconnect(update_proprietary_records, filt, new_rootnames_public, proprietary)
+    if missing:
+        logging.warning('{} rootnames not found in QL: {}'.format(len(missing), ', '.join(missing)))
+    logging.info('{} new non-proprietary files to ingest for {}'.format(len(new_rootnames_public), filt))
+
+    new_files_public = {rootname: new_files[rootname] for rootname in new_rootnames_public}
+    changed = changed.intersection(new_files_public)
+
+    return new_files_public, changed
+
+def parse_xym_file(xym_file_path, include_saturated_stars=False, size=None, mtime_ns=None):
+    """ Reads in <filename>.stardb_xym file, returns a structured array
+    with data. Each row is a psf detected in <filename>.
+
+    The parsed file is cached (see irpsf.ingest.xym_cache), so it is only
+    read as text once. See irpsf.ingest.xym_parser for the columns of the
+    file. Stars are
+    required to have a qfit, g1, and g2 no larger than
+    SETTINGS['qfit_max'], SETTINGS['g1_max'] and SETTINGS['g2_max']
+    (0.15 by default).
 
     Parameters
     ----------
@@ -129,46 +205,47 @@ def parse_xym_file(xym_file_path, include_saturated_stars=False):
     include_saturated_stars : bool, default=False
         Include saturated stars in the catalog or not.
 
+    size : int, optional
+        The size of the file, if already known.
+
+    mtime_ns : int, optional
+        The modification time of the file in nanoseconds, if already known.
+
     Returns
     -------
-    xym_tab : astropy.io.ascii Table
-        Table containing the image metadata - psf_x_center, psf_y_center, qfit,
-        psf_flux, sky, pixc, N, and sat - requiring all stars to have a qfit,
-        g1, and g2 less than 0.15. mfit, cexp, N, g1, and g2 are removed.
-        If xym_tab is 1, then the Table is empty and no PSFs were in the image.
-	"""
-
-	root = os.path.basename(xym_file_path)[0:9]
-	colnames = ['psf_x_center' ,'psf_y_center', 'mfit', 'qfit', 'psf_flux', 'sky', 'pixc', 'cexp', 'N', 'sat', 'g1', 'g2']
-    #colnames = ['psf_x_center' ,'psf_y_center', 'mfit', 'qfit', 'psf_flux', 'sky',
-    #            'pixc', 'cexp', 'aobs', 'aexp', 'bobs', 'bexp', 'N', 'sat']
-	try:
-		xym_tab = ascii.read(xym_file_path, names = colnames, guess=False, data_start=0, header_start=None, Reader=ascii.NoHeader)
-		xym_tab['rootname'] = [root] * len(xym_tab)
-
-		#cut on qfit, g1, g2, FROM CLARE'S DIRECTORY
-		xym_tab = xym_tab[xym_tab['qfit'] <= 0.15]
-		xym_tab = xym_tab[xym_tab['g1'] <= 0.15]
-		xym_tab = xym_tab[xym_tab['g2'] <= 0.15]
-
-
-		if include_saturated_stars is False:
-			logging.info('Omiting {} saturated stars from table.'.format(len(xym_tab[xym_tab['sat'] == 1])))
-			#print(xym_file_path, 'Omiting {} saturated stars from table.'.format(len(xym_tab[xym_tab['sat'] == 1])))
-			xym_tab = xym_tab[xym_tab['sat'] == 0]
-		xym_tab.remove_columns(['mfit', 'cexp', 'N', 'g1', 'g2'])
-        	#xym_tab.remove_columns(['mfit', 'cexp', 'aobs', 'aexp', 'bobs', 'bexp', 'N'])
-		logging.info('{} PSFs in {}'.format(len(xym_tab), root))
-	except ValueError:
-		logging.info('No PSFs in {}'.format(root))
-		return 1
-
-	#table has columns : ['psf_x_center' ,'psf_y_center', 'mfit', 'qfit', 'psf_flux', 'sky']
-	return xym_tab
+    xym_tab : numpy.ndarray
+        Structured array containing the image metadata - psf_x_center,
+        psf_y_center, mfit, qfit, psf_flux, sky, pixc, cexp, N, sat, g1 and
+        g2 - of the stars passing the cuts. Empty if no PSFs were in the
+        image.
+    """
+
+    root = os.path.basename(xym_file_path)[0:9]
+    stars = load_xym_file(xym_file_path, size, mtime_ns)
+    mask = get_quality_mask(stars, SETTINGS.get('qfit_max', 0.15), SETTINGS.get('g1_max', 0.15),
+                            SETTINGS.get('g2_max', 0.15), include_saturated_stars=True)
+
+    if include_saturated_stars is False:
+        saturated = mask & (stars['sat'] != 0)
+        logging.info('Omiting {} saturated stars from table.'.format(saturated.sum()))
+        mask &= ~saturated
+    xym_tab = stars[mask]
+
+    if len(xym_tab) == 0:
+        logging.info('No PSFs in {}'.format(root))
+    else:
+        logging.info('{} PSFs in {}'.format(len(xym_tab), root))
+
+    return xym_tab
 
 
 def get_files_metadata(rootnames):
-    """Retrieve metadata for a rootname from QL.
+    """Retrieve metadata for the rootnames from QL.
+
+    The rootnames are resolved with chunked queries of
+    ``SETTINGS['ql_chunk_size']`` rootnames each (default 1000).
+    Rootnames that are missing from QL are logged and left out of the
+    returned metadata.
 
     Parameters
     ----------
@@ -177,220 +254,237 @@ def get_files_metadata(rootnames):
 
     Returns
     -------
-    metadata : tuple
-        The complimentary metadata - ql directory, mid exposure times, filter,
-        aperture, exposure time, sun angle, and FGS lock.
+    metadata : dict
+        The complimentary metadata - rootname, ql directory, mid exposure
+        times, filter, aperture, exposure time, sun angle, and FGS lock -
+        as arrays with one element per rootname found in QL.
     """
 
-	logging.info('Getting metadata from QL database.')
-
-	midexps, filterss, apertures, ql_dirs, sun_angs, exptimes, fgs_locks = [], [], [], [], [], [], []
-	for root in rootnames:
-		results = ql_session.query(IR_flt_0.expstart, IR_flt_0.expend, IR_flt_0.filter,
-                                    IR_flt_0.aperture, Master.dir, IR_flt_0.sunangle,
-                                    IR_flt_0.exptime, IR_flt_0.fgslock).join(Master).filter(IR_flt_0.ql_root == root[0:8]).all()
-
-		midexps.append(np.mean([results[0][0], results[0][1]]))
-		filterss.append(results[0][2])
-		apertures.append(results[0][3])
-		ql_dirs.append(results[0][4])
-		sun_angs.append(results[0][5])
-		exptimes.append(results[0][6])
-		fgs_locks.append(results[0][7])
+    logging.info('Getting metadata from QL database.')
 
-	metadata = (ql_dirs, midexps, filterss, apertures, exptimes, sun_angs, fgs_locks)
+    metadata, missing = get_ql_metadata(get_ql_session(), rootnames,
+                                        SETTINGS.get('ql_chunk_size', 1000))
+    if missing:
+        logging.warning('{} rootnames not found in QL: {}'.format(len(missing), ', '.join(missing)))
 
     return metadata
 
 
-def get_ra_dec_wcs(file_path, x, y):
-    """Calculate the right ascension and declination from an image.
+def get_ra_dec_wcs(rootname, ql_dir, x, y):
+    """Calculate the right ascension and declination of the PSFs of an image.
+
+    Only the SCI header of the image is read, and it is cached (see
+    irpsf.ingest.wcs_service), so the image is read at most once.
 
     Parameters
     ----------
-    file_path : str
-        Path to the image.
+    rootname : str
+        The rootname of the image.
+
+    ql_dir : str
+        The QL directory of the image.
 
-    x : float
-        The x coordinate of the PSF.
+    x : array_like
+        The x coordinates of the PSFs.
 
-    y : float
-        The y coordinate of the PSF.
+    y : array_like
+        The y coordinates of the PSFs.
 
     Returns
     -------
-    ra : float
+    ra : numpy.ndarray
         Right ascension.
 
-    dec : float
+    dec : numpy.ndarray
         Declination.
     """
 
-	hdu = fits.open(file_path)
-	wcss = WCS(hdu[1].header, hdu)
+    return get_ra_dec(rootname, ql_dir, x, y)
+
+def get_focus_parameters(midexps, focus_model):
+    """Get the focus model related information for many exposures.
+
+    The focus related parameters include the date/mjd of the
+    observation ('midexp', used to match against the model
+    measurements) and the focus value, interpolated from the model
+    measurements within six minutes of the middle of the observation.
+    See irpsf.ingest.focus_model for the interpolation rules.
+
+    Parameters
+    ----------
+    midexps : array_like
+        The times of the middle of the observations, in MJD.
+
+    focus_model : tuple
+        The (mjds, focus) arrays of the focus model, as returned by
+        load_focus_model.
+
+    Returns
+    -------
+    mjds : numpy.ndarray
+        The time of the middle of the observations, in MJD (same as
+        midexps), NaN if no focus estimate can be made.
+
+    dates : numpy.ndarray
+        MJD, in datetime (yyyy-mm-dd hh:mm:ss), None if no focus estimate
+        can be made.
+
+    focus : numpy.ndarray
+        The estimated focus of the images in microns. If no estimation can
+        be made, NaN (stored as NULL) is returned.
+    """
+
+    model_mjds, model_focus = focus_model
 
-	ra, dec = wcss.all_pix2world(x, y, 1)
+    return interpolate_focus(model_mjds, model_focus, midexps)
 
-	return(ra, dec)
 
-def get_focus_parameters(midexp):
-    """Update the psf_dict with focus model related information.
+def process_exposure(task):
+    """Parse an exposure's xym file and compute the coordinates of its PSFs.
 
-    The focus related parameters include the date/mjd of the closest
-    model measurement in time to the observation, the time of the
-    middle of the observation ('midexp', used to match against the
-    model measurements) and the focus value.
+    This runs in the worker processes of the ingest pipeline and does not
+    use the database.
 
     Parameters
     ----------
-    midexp : float
-        The time of the middle of the observation, in MJD.
+    task : dict
+        The exposure's rootname, xym file (path, size, mtime_ns), QL
+        directory, the filter being processed, and the values shared by all
+        of its PSFs (filter, aperture, midexp, mjd, date and focus).
 
     Returns
     -------
-    mjd : float
-        The time of the middle of the observation, in MJD (same as midexp).
+    exposure_batch : dict or None
+        The column batch of the exposure's PSFs, or None if it has none.
+    ledger_record : dict
+        The exposure's ingest ledger record.
+    replace : bool
+        Whether previously ingested records of the exposure are replaced.
+    """
 
-    date : datetime
-        MJD, in datetime (yyyy-mm-dd hh:mm:ss).
+    root = task['rootname']
+    xym_file_path, size, mtime_ns = task['xym_file']
+    psf_tab = parse_xym_file(xym_file_path, size=size, mtime_ns=mtime_ns)
+    if len(psf_tab) == 0:
+        return None, make_ledger_record(task['filt'], root, task['xym_file'], 0), task['replace']
+
+    ra_psfs, dec_psfs = get_ra_dec_wcs(root, task['ql_dir'], psf_tab['psf_x_center'], psf_tab['psf_y_center'])
+
+    exposure_batch = {
+        'rootname': root,
+        'filter': task['filter'],
+        'aperture': task['aperture'],
+        'psf_x_center': psf_tab['psf_x_center'],
+        'psf_y_center': psf_tab['psf_y_center'],
+        'psf_ra': ra_psfs,
+        'psf_dec': dec_psfs,
+        'psf_flux': psf_tab['psf_flux'],
+        'sky': psf_tab['sky'],
+        'qfit': psf_tab['qfit'],
+        'pixc': psf_tab['pixc'],
+        'midexp': task['midexp'],
+        'mjd': task['mjd'],
+        'date': task['date'],
+        'focus': task['focus'],
+        'healpix': ang2pix(ra_psfs, dec_psfs, get_healpix_order())}
+
+    return exposure_batch, make_ledger_record(task['filt'], root, task['xym_file'], len(psf_tab)), task['replace']
+
+
+def write_exposures(results):
+    """Commit the PSFs and ledger records of a batch of exposures together.
+
+    This runs in the writer process of the ingest pipeline, so an
+    interrupted run resumes after the last committed batch.
 
-    focus : float
-        The estimated focus of the image in microns. If no estimation can be
-        made, None is returned.
-    """
+    Parameters
+    ----------
+    results : list
+        The results of process_exposure for the exposures in the batch.
 
-    # Find all of the focus values within six minutes
-    # Note that a separate session and engine must be created and closed
-    # as to allow many parallel connections
-    six_minutes = 0.00416667  # six minutes in units of days
-
-    results = session.query(FocusModel.mjd, FocusModel.date, FocusModel.focus)\
-        .filter(FocusModel.mjd >= float(midexp - six_minutes))\
-        .filter(FocusModel.mjd <= float(midexp + six_minutes)).all()
-
-    ################old method################
-    #if len(results) > 0:
-    #    mjds = [item[0] for item in results]
-    #    dates = [item[1] for item in results]
-    #    focus_values = [item[2] for item in results]
-
-        # Find the focus closest in time to the observation
-    #    delta_times = [abs(float(midexp) - float(mjd)) for mjd in mjds]
-    #    index = delta_times.index(min(delta_times))
-    #    mjd = float(mjds[index])
-    #    date = dates[index]
-    #    focus = focus_values[index]
-
-    # If there are no surrounding focus measurements, then set the focus
-    # measurements to NULL
-    #else:
-    #    date, mjd, focus = None, None, None
-
-    ################new method################
-    # If there are no surrounding focus measurements, then set the focus
-    # measurements to NULL
-    if len(results) == 0:
-        date, mjd, focus = None, None, None
-
-    elif len(results) == 1:
-    # If there is only one surrounding focus measurement, then set the focus
-    # measurement to that value
-        mjd = float(midexp)
-        date = Time(mjd, format='mjd').datetime
-        focus = results[0][2]
+    Returns
+    -------
+    counts : dict
+        The number of inserted and skipped psf records.
+    """
 
-    else:
-    #If there are two or more surrounding focus measurements, then
-    #linearly interpolate the focus with respect to midexp
-        mjds = [item[0] for item in results]
-        focus_values = [item[2] for item in results]
-        mjds = np.array(mjds).astype(float)
-        focus_values = np.array(focus_values).astype(float)
+    exposure_batches = [result[0] for result in results if result[0] is not None]
+    ledger_records = [result[1] for result in results]
+    replace_rootnames = [result[1]['rootname'] for result in results if result[2]]
 
-        mjd = float(midexp)
-        date = Time(mjd, format='mjd').datetime
-        focus = float(np.interp(mjd, mjds, focus_values))
+    # A batch interrupted by a lost connection is rolled back and written again
+    counts = retry_on_disconnect(write_ingested_exposures, get_engine(), exposure_batches,
+                                 ledger_records, replace_rootnames)
 
-    return (mjd, date, focus)
+    return {'inserted': sum(count[0] for count in counts.values()),
+            'skipped': sum(count[1] for count in counts.values())}
 
 
 def main_make_ir_psf_table(filt='all'):
     """The main controller for the make_ir_psf_table module.
 
+    Only xym files that are new or changed since their last ingest are
+    processed. The exposures of each filter run through a pipeline of
+    ``SETTINGS['cores']`` worker processes, which parse the xym files and
+    compute the PSF coordinates, and a single writer process, which owns
+    the database connection. PSF records are inserted in bulk: the column
+    batches of ``SETTINGS['insert_batch_exposures']`` exposures (default
+    10) are written together with their ingest ledger records in a single
+    transaction. Exposures whose xym file changed have their previous
+    records replaced.
+
     Parameters
     ----------
     filt : str, default=all
         The filter being processed. If all, process all filters.
     """
 
-	filter_list = [filt]
-	if filt == 'all':
-		filter_list = [os.path.basename(x) for x in glob.glob(SETTINGS['output_dir']+'/F*')]
-
-	for filt in filter_list:
-		duplicate_entries = 0
-		logging.info('Starting Processing for {}'.format(filt))
-		#Get list of new rootnames to ingest
-		new_rootnames = get_new_files_to_ingest(filt)
-
-		new_xym_file_paths = [SETTINGS['output_dir'] + '/{}/{}_flt.stardb_xym'.format(filt, root) for root in new_rootnames]
-		ql_dirs, midexps, filterss, apertures, exptimes, sun_angs, fgs_locks = get_files_metadata(new_rootnames)
-
-		for i, xym_file_path in enumerate(new_xym_file_paths):
-			root = os.path.basename(xym_file_path)[0:9]
-			ql_path = glob.glob(ql_dirs[i] + '/{}*flt.fits'.format(root))[0]
-			psf_tab = parse_xym_file(xym_file_path)
-			if psf_tab == 1:
-				continue
-			ra_psfs, dec_psfs = get_ra_dec_wcs(ql_path, psf_tab['psf_x_center'], psf_tab['psf_y_center'])
-
-			psf_tab['psf_ra'] = ra_psfs
-			psf_tab['psf_dec'] = dec_psfs
-			psf_tab['midexp'] = [midexps[i]] * len(psf_tab)
-			psf_tab['filter'] = [filterss[i]] * len(psf_tab)
-			psf_tab['aperture'] = [apertures[i]] * len(psf_tab)
-			psf_tab['exptime'] = [exptimes[i]] * len(psf_tab)
-			psf_tab['sun_ang'] = [sun_angs[i]] * len(psf_tab)
-			psf_tab['fgs_lock'] = [fgs_locks[i]] * len(psf_tab)
-
-			# #focus model values
-			mjd, date, focus = get_focus_parameters(midexps[i])
-			psf_tab['mjd'] = [mjd] * len(psf_tab)
-			psf_tab['date'] = [date] * len(psf_tab)
-			psf_tab['focus'] = [focus] * len(psf_tab)
-
-            #insert each psf into database
-			for i, roww in enumerate(psf_tab):
-				#Make row into dictionary
-				psf_record = dict()
-				dict_keys = psf_tab.colnames
-				for key in dict_keys:
-					if str(psf_tab[key][i]) != 'None':
-						psf_record[key] = str(psf_tab[key][i])
-					else:
-						psf_record[key] = None
-
-				try:
-					engine.execute(PSFTableMAST.__table__.insert(), psf_record)
-				except:
-					pass
-			logging.info('Inserted {} psf records for {} into database'.format(len(psf_tab), root))
-
-
-		# try:
-		# 	engine.execute(PSFTableMAST.__table__.insert(), psf_record)
-		# 	logging.info('Inserted {} psf records for {} into database'.format(len(psf_tab), root))
-		# except:
-		# 	duplicate_entries += 1
+    batch_exposures = SETTINGS.get('insert_batch_exposures', 10)
+    focus_model = retry_on_disconnect(load_focus_model, get_session())
+
+    filter_list = [filt]
+    if filt == 'all':
+        filter_list = [os.path.basename(x) for x in glob.glob(SETTINGS['output_dir']+'/F*')]
+
+    for filt in filter_list:
+        logging.info('Starting Processing for {}'.format(filt))
+        #Get list of new rootnames to ingest
+        new_files, changed = get_new_files_to_ingest(filt)
 
+        metadata = get_files_metadata(list(new_files))
+        mjds, dates, focuses = get_focus_parameters(metadata['midexp'], focus_model)
+
+        tasks = ({'filt': filt,
+                  'rootname': root,
+                  'xym_file': new_files[root],
+                  'ql_dir': metadata['ql_dir'][i],
+                  'filter': metadata['filter'][i],
+                  'aperture': metadata['aperture'][i],
+                  'midexp': metadata['midexp'][i],
+                  'mjd': mjds[i],
+                  'date': dates[i],
+                  'focus': focuses[i],
+                  'replace': root in changed} for i, root in enumerate(metadata['rootname']))
+
+        # The pipeline processes create their own connections; release
+        # this process's while they run
+        dispose_engines()
+        totals = run_pipeline(tasks, process_exposure, write_exposures,
+                              n_workers=SETTINGS['cores'], batch_size=batch_exposures)
+
+        logging.info('Inserted {} psf records for {} ({} duplicates skipped)'.format(
+            totals.get('inserted', 0), filt, totals.get('skipped', 0)))
+
+    evict_xym_cache(SETTINGS.get('xym_cache_max_gb', 20) * 1e9)
 
 
 if __name__ == '__main__':
 
 
-	module = os.path.basename(__file__).strip('.py')
-	setup_logging(module)
+    args = parse_args()
+
+    module = os.path.basename(__file__).strip('.py')
+    setup_logging(module)
 
-	args = parse_args()
-	print (args.filter)
-	main_make_ir_psf_table(args.filter)
+    print (args.filter)
+    main_make_ir_psf_table(args.filter)
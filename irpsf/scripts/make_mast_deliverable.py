@@ -10,6 +10,14 @@ in the new text file but don't exist in the old text file and write
 the new records to a separate ir_psf_mast_YYYY_MM_DD_deliver.txt text
 file.  This file can then be delivered to the MAST PSF group.
 
+Records are matched on the natural key of the table (rootname,
+psf_x_center, psf_y_center), so a record whose id or number formatting
+changed between the dumps is not delivered again.  Both dumps are
+streamed: the keys of the old dump are hashed into a compact array of
+128-bit digests when it fits in the memory budget (-memory_mb), otherwise both dumps
+are sorted externally, in temporary files, and merged.  Either way the
+new records are written sorted by their natural key.
+
 Authors
 -------
     Matthew Bourque
@@ -20,6 +28,7 @@ Use
     This module is intended to be run via the command line as such:
 
     >>> python make_mast_deliverable old_table new_table
+    >>> python make_mast_deliverable old_table new_table -memory_mb 4096
 
     Required arguments:
     old_table - Path to text file containing the most-recently
@@ -30,9 +39,273 @@ Use
 
 from __future__ import print_function
 import argparse
+from hashlib import blake2b
+import heapq
+import itertools
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+HEADER = ('id,rootname,filter,aperture,psf_x_center,psf_y_center,psf_ra,'
+          'psf_dec,psf_flux,sky,qfit,pixc,midexp,mjd,date,focus\n')
+N_COLUMNS = HEADER.count(',') + 1
+
+# The approximate memory taken by a buffered row besides its characters
+ROW_OVERHEAD = 250
+
+# The size of the digests of the keys of the old dump, which take twice
+# as much memory while they are sorted
+HASH_BYTES = 16
+KEY_COORDINATES = struct.Struct('<dd')
+
+PROGRESS_INTERVAL = 10.
+CHUNK_ROWS = 10000
+CHUNK_BYTES = 2**20
+
+
+def get_key(row):
+    """Return the natural key of a row of an ir_psf_mast dump.
+
+    Parameters
+    ----------
+    row : str
+        A comma-separated row, starting with the id, rootname, filter,
+        aperture, psf_x_center and psf_y_center columns.
+
+    Returns
+    -------
+    key : tuple
+        The (rootname, psf_x_center, psf_y_center) of the row, with the
+        coordinates as floats so that their formatting does not matter.
+    """
+
+    fields = row.split(',', 6)
+    return fields[1], float(fields[4]), float(fields[5])
+
+
+def get_key_digest(key):
+    """Return the 128-bit BLAKE2 digest of a natural key.
+
+    Parameters
+    ----------
+    key : tuple
+        The (rootname, psf_x_center, psf_y_center) of a row, see get_key.
+
+    Returns
+    -------
+    digest : bytes
+        The HASH_BYTES bytes digest.
+    """
+
+    return blake2b(key[0].encode() + KEY_COORDINATES.pack(key[1], key[2]), digest_size=HASH_BYTES).digest()
+
+
+def read_rows(path, label):
+    """Yield the rows of a dump, reporting progress every PROGRESS_INTERVAL seconds.
+
+    Parameters
+    ----------
+    path : str
+        The path to the dump.
+    label : str
+        The name of the dump in the progress messages.
+
+    Yields
+    ------
+    row : str
+        A non-empty row, without its line ending.
+    """
+
+    total = max(os.path.getsize(path), 1)
+    last_report = time.monotonic()
+    with open(path, 'r') as f:
+        while True:
+            rows = f.readlines(CHUNK_BYTES)
+            if not rows:
+                break
+            yield from filter(None, map(str.strip, rows))
+            if time.monotonic() - last_report > PROGRESS_INTERVAL:
+                print('Reading {}: {:.1f}% complete'.format(label, 100. * f.tell() / total))
+                last_report = time.monotonic()
+    print('Read {}'.format(label))
+
+
+def write_run(rows, temp_dir):
+    """Write sorted rows to a temporary file.
+
+    Parameters
+    ----------
+    rows : list
+        The sorted rows.
+    temp_dir : str
+        The directory of the file.
+
+    Returns
+    -------
+    path : str
+        The path to the file.
+    """
+
+    with tempfile.NamedTemporaryFile('w', dir=temp_dir, suffix='.run', delete=False) as f:
+        for row in rows:
+            f.write(row + '\n')
+    return f.name
+
+
+def read_run(path):
+    """Yield the rows of a temporary file written by write_run."""
+
+    with open(path, 'r') as f:
+        for row in f:
+            yield row[:-1]
 
 
-def make_mast_deliverable(old_table, new_table):
+def sort_rows(rows, memory_bytes, temp_dir):
+    """Sort rows by their natural key within a memory budget.
+
+    Rows are sorted in memory until the budget is exceeded; sorted runs
+    are then written to temporary files and merged.
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows to sort.
+    memory_bytes : int
+        The approximate memory available to the rows held in memory.
+    temp_dir : str
+        The directory of the temporary files.
+
+    Yields
+    ------
+    row : str
+        The rows, sorted by their natural key.
+    """
+
+    runs, buffer, buffer_bytes = [], [], 0
+    for row in rows:
+        buffer.append(row)
+        buffer_bytes += len(row) + ROW_OVERHEAD
+        if buffer_bytes > memory_bytes:
+            buffer.sort(key=get_key)
+            runs.append(write_run(buffer, temp_dir))
+            buffer, buffer_bytes = [], 0
+    buffer.sort(key=get_key)
+
+    if not runs:
+        yield from buffer
+        return
+
+    print('Merging {} sorted runs'.format(len(runs) + 1))
+    yield from heapq.merge(buffer, *[read_run(run) for run in runs], key=get_key)
+
+
+def hash_old_keys(old_table, max_keys):
+    """Return the sorted hashes of the keys of the old dump, if they fit.
+
+    Parameters
+    ----------
+    old_table : str
+        The path to the old dump.
+    max_keys : int
+        The largest number of keys to hash.
+
+    Returns
+    -------
+    hashes : numpy.ndarray or None
+        The sorted unique digests of the natural keys, see
+        get_key_digest, or None if the dump has more than ``max_keys``
+        rows.
+    """
+
+    chunks, n_keys = [], 0
+    rows = read_rows(old_table, old_table)
+    while True:
+        chunk = np.array([get_key_digest(get_key(row)) for row in itertools.islice(rows, CHUNK_ROWS)],
+                         dtype='S{}'.format(HASH_BYTES))
+        if len(chunk) == 0:
+            break
+        n_keys += len(chunk)
+        if n_keys > max_keys:
+            return None
+        chunks.append(chunk)
+    chunks.append(np.zeros(0, dtype='S{}'.format(HASH_BYTES)))
+
+    return np.unique(np.concatenate(chunks))
+
+
+def get_new_rows_hashed(new_table, old_hashes, memory_bytes, temp_dir):
+    """Yield the rows of the new dump whose key is not in the old dump.
+
+    Parameters
+    ----------
+    new_table : str
+        The path to the new dump.
+    old_hashes : numpy.ndarray
+        The sorted digests of the keys of the old dump.
+    memory_bytes : int
+        The memory budget of sorting the new rows.
+    temp_dir : str
+        The directory of the temporary files.
+
+    Yields
+    ------
+    row : str
+        The new rows, sorted by their natural key.
+    """
+
+    def new_rows():
+        rows = read_rows(new_table, new_table)
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK_ROWS))
+            if not chunk:
+                return
+            hashes = np.array([get_key_digest(get_key(row)) for row in chunk], dtype='S{}'.format(HASH_BYTES))
+            index = np.minimum(np.searchsorted(old_hashes, hashes), max(len(old_hashes) - 1, 0))
+            known = old_hashes[index] == hashes if len(old_hashes) else np.zeros(len(chunk), bool)
+            for i in np.flatnonzero(~known):
+                yield chunk[i]
+
+    yield from sort_rows(new_rows(), memory_bytes, temp_dir)
+
+
+def get_new_rows_merged(old_table, new_table, memory_bytes, temp_dir):
+    """Yield the rows of the new dump whose key is not in the old dump.
+
+    Both dumps are sorted by their natural key, externally if needed,
+    and merged.
+
+    Parameters
+    ----------
+    old_table : str
+        The path to the old dump.
+    new_table : str
+        The path to the new dump.
+    memory_bytes : int
+        The memory budget, shared by both sorts.
+    temp_dir : str
+        The directory of the temporary files.
+
+    Yields
+    ------
+    row : str
+        The new rows, sorted by their natural key.
+    """
+
+    old_keys = (get_key(row) for row in
+                sort_rows(read_rows(old_table, old_table), memory_bytes // 2, temp_dir))
+    old_key = next(old_keys, None)
+    for row in sort_rows(read_rows(new_table, new_table), memory_bytes // 2, temp_dir):
+        key = get_key(row)
+        while old_key is not None and old_key < key:
+            old_key = next(old_keys, None)
+        if old_key != key:
+            yield row
+
+
+def make_mast_deliverable(old_table, new_table, memory_mb=1024):
     """The main function of the make_mast_deliverable module.
 
     See module docstrings for further information.
@@ -45,34 +318,48 @@ def make_mast_deliverable(old_table, new_table):
     new_table: str
         The path to the file that holds the most recent ir_psf_mast
         table database dump.
+    memory_mb: int, default=1024
+        The approximate memory budget, in MB.
+
+    Returns
+    -------
+    nrows : int
+        The number of rows written to the delivery table.
     """
 
-    # Read in the old table
-    print('Reading in {}'.format(old_table))
-    with open(old_table, 'r') as f:
-        old_tab = f.readlines()
-    old_tab = [item.strip() for item in old_tab]
+    memory_bytes = memory_mb * 2**20
+    deliverable_table = new_table.replace('.txt', '_deliver.csv')
+    temp_dir = tempfile.mkdtemp(prefix='.deliverable_', dir=os.path.dirname(os.path.abspath(deliverable_table)))
+    try:
+        print('Hashing the keys of {}'.format(old_table))
+        old_hashes = hash_old_keys(old_table, memory_bytes // (2 * HASH_BYTES))
+        if old_hashes is not None:
+            new_rows = get_new_rows_hashed(new_table, old_hashes, memory_bytes - old_hashes.nbytes, temp_dir)
+        else:
+            print('{} does not fit in {} MB, sorting both tables'.format(old_table, memory_mb))
+            new_rows = get_new_rows_merged(old_table, new_table, memory_bytes, temp_dir)
 
-    # Read in the new_table
-    print('Reading in {}'.format(new_table))
-    with open(new_table, 'r') as f:
-        new_tab = f.readlines()
-    new_tab = [item.strip() for item in new_tab]
+        # Build the new deliverable table
+        print('Building delivery table')
+        nrows = 0
+        temp_table = os.path.join(temp_dir, os.path.basename(deliverable_table))
+        with open(temp_table, 'w') as f:
+            f.write(HEADER)
+            for row in new_rows:
+                # Columns added to the table after the delivered ones, e.g. healpix, are not delivered
+                if row.count(',') >= N_COLUMNS:
+                    row = ','.join(row.split(',', N_COLUMNS)[:N_COLUMNS])
+                f.write(row + '\n')
+                nrows += 1
+        os.replace(temp_table, deliverable_table)
+    finally:
+        for name in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, name))
+        os.rmdir(temp_dir)
 
-    # Build the new deliverable table
-    print('Building delivery table')
-    deliverable_table = new_table.replace('.txt', '_deliver.csv')
-    header = 'id,rootname,filter,aperture,psf_x_center,psf_y_center,psf_ra,'
-    header += 'psf_dec,psf_flux,sky,qfit,pixc,midexp,mjd,date,focus\n'
-    delivery_table = set(new_tab) - set(old_tab)
-    nrows = len(delivery_table)
-    with open(deliverable_table, 'w') as f:
-        f.write(header)
-        for i, row in enumerate(delivery_table):
-            print('{} of {} rows: {}% Complete'.format(i, nrows,
-                  round((i/nrows)*100, 2)), end='\r')
-            f.write(row + '\n')
-    print('Deliverable psf_mast table written to {}'.format(deliverable_table))
+    print('{} rows of the deliverable psf_mast table written to {}'.format(nrows, deliverable_table))
+
+    return nrows
 
 
 def parse_args():
@@ -91,6 +378,11 @@ def parse_args():
     parser.add_argument(
         'new_table',
         help='The path to the most recent dump of the ir_psf_mast table.')
+    parser.add_argument(
+        '-memory_mb',
+        type=int,
+        default=1024,
+        help='The approximate memory budget in MB, above which the tables are sorted on disk.')
     args = parser.parse_args()
 
     return args
@@ -99,4 +391,4 @@ def parse_args():
 if __name__ == '__main__':
 
     args = parse_args()
-    make_mast_deliverable(args.old_table, args.new_table)
+    make_mast_deliverable(args.old_table, args.new_table, args.memory_mb)
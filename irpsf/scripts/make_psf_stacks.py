@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+"""Build empirical PSF stacks from the cutouts of catalog stars.
+
+The stars are selected in the ir_psf_mast catalog by filter and qfit,
+split into bins by filter, -focus_bins and detector regions of
+-region_size pixels, and their cutouts are stacked as described in
+irpsf.cutouts.stacking.  The stacks are saved with NumPy to -output,
+an .npz file with the stacks, counts, n_stars, filter, focus_min,
+focus_max, region_x and region_y arrays.
+
+The cutout store must be built first, see compact_ras_files.py.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python make_psf_stacks.py -output stacks.npz
+        >>> python make_psf_stacks.py -output stacks.npz -filter F160W -qfit_max 0.05
+        >>> python make_psf_stacks.py -output stacks.npz -focus_bins -4 -2 0 2 4 -region_size 507 -method clipped
+"""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+
+from irpsf.cutouts.stacking import make_psf_stacks
+from irpsf.database.psf_query import make_selector
+from irpsf.psf_logging.psf_logging import setup_logging
+from irpsf.settings.settings import *
+
+
+def main_make_psf_stacks(output, filters=None, focus_bins=None, region_size=None, qfit_max=None,
+                         method='mean', oversample=4):
+    """The main controller for the make_psf_stacks module.
+
+    Parameters
+    ----------
+    output : str
+        The path of the .npz file.
+    filters : list, optional
+        The filters of the stars, all of them by default.
+    focus_bins : list, optional
+        The edges of the focus bins, one bin for any focus by default.
+    region_size : int, optional
+        The size of the detector regions, the whole detector by default.
+    qfit_max : float, optional
+        The largest qfit of the stars.
+    method : str, default='mean'
+        'mean', or 'clipped' for a 3 sigma clipped mean.
+    oversample : int, default=4
+        The number of grid nodes per pixel.
+    """
+
+    selector = make_selector(filters=filters, qfit_max=qfit_max)
+    clip_iterations = 3 if method == 'clipped' else 0
+    stacks = make_psf_stacks(selector, focus_bins, region_size, oversample, clip_iterations=clip_iterations)
+    np.savez(output, **stacks)
+
+    n_stacks = int(np.sum(stacks['n_stars'] > 0))
+    logging.info('Saved {} stacks of {} stars to {}'.format(n_stacks, stacks['n_stars'].sum(), output))
+    print('Saved {} stacks of {} stars to {}'.format(n_stacks, stacks['n_stars'].sum(), output))
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Build empirical PSF stacks from the cutouts of catalog stars.')
+    parser.add_argument(
+        '-output',
+        required=True,
+        help='The path of the .npz file.')
+    parser.add_argument(
+        '-filter',
+        nargs='+',
+        default=None,
+        help='The filters of the stars, all of them by default.')
+    parser.add_argument(
+        '-focus_bins',
+        nargs='+',
+        type=float,
+        default=None,
+        help='The edges of the focus bins, in microns.')
+    parser.add_argument(
+        '-region_size',
+        type=int,
+        default=None,
+        help='The size of the square detector regions, in pixels.')
+    parser.add_argument(
+        '-qfit_max',
+        type=float,
+        default=None,
+        help='The largest qfit of the stars.')
+    parser.add_argument(
+        '-method',
+        choices=['mean', 'clipped'],
+        default='mean',
+        help='A mean, or a 3 sigma clipped mean.')
+    parser.add_argument(
+        '-oversample',
+        type=int,
+        default=4,
+        help='The number of grid nodes per pixel.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    module = os.path.basename(__file__).strip('.py')
+    setup_logging(module)
+
+    main_make_psf_stacks(args.output, args.filter, args.focus_bins, args.region_size, args.qfit_max,
+                         args.method, args.oversample)
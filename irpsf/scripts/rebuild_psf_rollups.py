@@ -0,0 +1,74 @@
+#! /usr/bin/env python
+
+"""Compute the PSF rollups again from the ir_psf_mast table.
+
+make_ir_psf_table.py keeps the rollups of the ir_psf_rollup table (PSF
+counts and qfit, sky and focus statistics by filter, day and detector
+cell, see irpsf.database.psf_rollups) up to date as it ingests.  This
+script replaces them with rollups computed from every ir_psf_mast
+record, in one transaction: run it once to create them, and after
+changing the rollup_cell_size setting.  Do not run it while
+make_ir_psf_table.py is running.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python rebuild_psf_rollups.py
+        >>> python rebuild_psf_rollups.py -chunk_size 500000
+"""
+
+import argparse
+import logging
+import os
+
+from irpsf.database.ir_psf_database_interface import get_engine, PSFRollup
+from irpsf.database.psf_rollups import rebuild_rollups
+from irpsf.psf_logging.psf_logging import setup_logging
+from irpsf.settings.settings import *
+
+
+def main_rebuild_psf_rollups(chunk_size=100000):
+    """The main controller for the rebuild_psf_rollups module.
+
+    Parameters
+    ----------
+    chunk_size : int, default=100000
+        The number of PSFs read and added at a time.
+    """
+
+    engine = get_engine()
+    PSFRollup.__table__.create(engine, checkfirst=True)
+    n_psfs = rebuild_rollups(engine, chunk_size)
+    logging.info('Rebuilt the rollups of {} psf records'.format(n_psfs))
+    print('Rebuilt the rollups of {} psf records'.format(n_psfs))
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Compute the PSF rollups again from ir_psf_mast.')
+    parser.add_argument(
+        '-chunk_size',
+        type=int,
+        default=100000,
+        help='The number of PSFs read and added at a time.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    module = os.path.basename(__file__).strip('.py')
+    setup_logging(module)
+
+    main_rebuild_psf_rollups(args.chunk_size)
@@ -15,7 +15,7 @@ Use
 
 """
 
-from irpsf.database.ir_psf_database_interface import Base, engine, FocusModel, PSFTableMAST
+from irpsf.database.ir_psf_database_interface import Base, get_engine, FocusModel, PSFTableMAST
 from irpsf.settings.settings import *
 
 if __name__ == '__main__':
@@ -29,6 +29,7 @@ if __name__ == '__main__':
         print ('Resetting FocusModel and PSFTableMAST tables in the database')
 #        Base.metadata.drop_all(engine, tables=[FocusModel.__table__])
  #       Base.metadata.create_all(engine, tables=[FocusModel.__table__])
+        engine = get_engine()
         Base.metadata.drop_all(engine, tables=[PSFTableMAST.__table__])
         Base.metadata.create_all(engine, tables=[PSFTableMAST.__table__])
 
@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+
+"""Run the offline benchmarks and compare them against the baselines.
+
+This script needs neither the production databases, pyql's QL
+database, hst1pass nor any real data: it writes a config.yaml pointing
+to SQLite databases and directories in a workspace, generates synthetic
+inputs there, and runs each benchmark of irpsf.benchmarks.suite in its
+own process.  Each benchmark's rows per second and peak memory are
+printed next to the baselines stored in irpsf/benchmarks/baselines.json,
+and the script exits with status 1 if any benchmark is slower or uses
+more memory than its baseline allows, or fails.  Each benchmark is
+timed -repeats times and its fastest run is kept, which makes the
+throughput stable enough for a -tolerance of 20%.
+
+Baselines are machine dependent; after a deliberate change, or on a new
+machine, store the current results of every benchmark with
+-update_baselines.  They are
+only compared when the benchmarks are run at the scale the baselines
+were measured at.  The environment they were measured in (python and
+numpy versions, platform and CPU) is stored with them, and printed when
+it differs from the current one.
+
+Use
+---
+    This script is intended to be run via the command line as such:
+
+        >>> python run_benchmarks.py
+        >>> python run_benchmarks.py -only xym_parsing database_insert -scale 5
+        >>> python run_benchmarks.py -update_baselines
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import yaml
+
+BASELINES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'benchmarks', 'baselines.json')
+
+
+def setup_workspace(workspace):
+    """Create the workspace directories and its config.yaml.
+
+    Parameters
+    ----------
+    workspace : str
+        The workspace directory.
+    """
+
+    settings = {
+        'cores': os.cpu_count(),
+        'psf_connection_string': 'sqlite:///{}'.format(os.path.join(workspace, 'ir_psf.db')),
+        'ql_connection_string': 'sqlite:///{}'.format(os.path.join(workspace, 'ql.db')),
+        'log_dir': os.path.join(workspace, 'psf_logs'),
+        'jays_code': os.path.join(workspace, 'benchmarks', 'bin'),
+        'psf_models': os.path.join(workspace, 'psf_models'),
+        'focus_models': os.path.join(workspace, 'benchmarks', 'focus'),
+        'output_dir': os.path.join(workspace, 'raw_outputs')}
+    for key in ['log_dir', 'jays_code', 'psf_models', 'focus_models', 'output_dir']:
+        os.makedirs(settings[key], exist_ok=True)
+    with open(os.path.join(workspace, 'config.yaml'), 'w') as f:
+        yaml.safe_dump(settings, f)
+
+
+def main_run_benchmarks(names=None, scale=1., tolerance=0.2, update_baselines=False,
+                        workspace=None, repeats=5):
+    """The main controller for the run_benchmarks module.
+
+    Parameters
+    ----------
+    names : list, optional
+        The benchmarks to run.  All of them by default.
+    scale : float, default=1.
+        The scale of the synthetic inputs.
+    tolerance : float, default=0.2
+        The allowed fractional slowdown and memory growth.
+    update_baselines : bool, default=False
+        Store the results as the new baselines.  Only allowed when
+        every benchmark is run, so that all the baselines are measured
+        under the same conditions.
+    workspace : str, optional
+        The workspace directory, kept after the run.  A temporary
+        directory is used and removed by default.
+    repeats : int, default=5
+        The number of times each benchmark is timed, the fastest
+        being kept.
+
+    Returns
+    -------
+    status : int
+        0 if every benchmark ran within its baseline, 1 otherwise.
+    """
+
+    if update_baselines and names:
+        print('-update_baselines stores the baselines of every benchmark; do not combine it with -only')
+        return 1
+
+    temporary = workspace is None
+    workspace = os.path.abspath(workspace or tempfile.mkdtemp(prefix='irpsf_benchmarks_'))
+    os.makedirs(workspace, exist_ok=True)
+    setup_workspace(workspace)
+
+    # The settings are read from the working directory when first used
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        from irpsf.benchmarks.suite import (BENCHMARKS, compare_to_baseline, get_environment,
+                                            load_baselines, run_benchmark, save_baselines)
+
+        baselines = load_baselines(BASELINES_FILE)
+        compare = baselines.get('scale') == scale
+        if not compare:
+            print('No baselines at scale {}; results are not compared'.format(scale))
+        elif baselines.get('environment') != get_environment():
+            print('The baselines were measured in another environment, {}'.format(
+                baselines.get('environment', 'unknown')))
+
+        results, status = {}, 0
+        print('{:>20} {:>10} {:>9} {:>12} {:>12} {:>9} {:>9}'.format(
+            'benchmark', 'rows', 'seconds', 'rows/s', 'baseline', 'peak MB', 'baseline'))
+        for name in names or BENCHMARKS:
+            result = results[name] = run_benchmark(name, scale, repeats)
+            if 'skipped' in result:
+                print('{:>20} skipped: {}'.format(name, result['skipped']))
+                continue
+            if 'error' in result:
+                print('{:>20} FAILED\n{}'.format(name, result['error']))
+                status = 1
+                continue
+
+            baseline = baselines.get('benchmarks', {}).get(name) if compare else None
+            print('{:>20} {:>10d} {:>9.2f} {:>12.0f} {:>12} {:>9.1f} {:>9}'.format(
+                name, result['rows'], result['seconds'], result['rows_per_s'],
+                '{:.0f}'.format(baseline['rows_per_s']) if baseline else '-', result['peak_mb'],
+                '{:.1f}'.format(baseline['peak_mb']) if baseline else '-'))
+            if baseline:
+                for regression in compare_to_baseline(result, baseline, tolerance):
+                    print('{:>20} REGRESSION: {}'.format(name, regression))
+                    status = 1
+
+        if update_baselines:
+            save_baselines(BASELINES_FILE, results, scale)
+            print('Baselines written to {}'.format(BASELINES_FILE))
+    finally:
+        os.chdir(cwd)
+        if temporary:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    return status
+
+
+def parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : obj
+        An agparse object containing all of the added arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Run the offline benchmarks.')
+    parser.add_argument(
+        '-only',
+        nargs='+',
+        default=None,
+        help='The benchmarks to run, all by default.')
+    parser.add_argument(
+        '-scale',
+        type=float,
+        default=1.,
+        help='The scale of the synthetic inputs.')
+    parser.add_argument(
+        '-tolerance',
+        type=float,
+        default=0.2,
+        help='The allowed fractional slowdown and memory growth.')
+    parser.add_argument(
+        '-repeats',
+        type=int,
+        default=5,
+        help='The number of times each benchmark is timed, the fastest being kept.')
+    parser.add_argument(
+        '-update_baselines',
+        action='store_true',
+        help='Store the results as the new baselines.')
+    parser.add_argument(
+        '-workspace',
+        default=None,
+        help='A directory to keep the workspace in, instead of a temporary one.')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    sys.exit(main_run_benchmarks(args.only, args.scale, args.tolerance,
+                                 args.update_baselines, args.workspace, args.repeats))
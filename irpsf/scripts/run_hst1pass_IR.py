@@ -36,20 +36,37 @@ The program hst1pass.e outputs two files:
 		 (fobs, the observed fraction will just be (p-s)/z
 	9) N + star number
 
+All the filters (or those given with -filter) are processed in a single
+run, from one job queue ordered by estimated cost (see
+irpsf.hst1pass.scheduler).  The jobs are run by irpsf.hst1pass.launcher,
+at most SETTINGS['cores'] (or -cores) at a time over all filters, and
+without a shell.  Each job runs in a temporary directory
+and its outputs are only moved into <output_dir>/<filter> once hst1pass
+succeeds.  Jobs running longer than SETTINGS['hst1pass_timeout'] seconds
+are killed, and failed or timed out jobs are retried
+SETTINGS['hst1pass_retries'] times (1 by default).
+
+The outcome of every job (succeeded, zero stars, failed or timed out),
+its output paths and timings are recorded in the exposure index (see
+irpsf.hst1pass.exposure_index), which is used to find the new files.
+Failed and timed out exposures are only processed again with -retry.
+The wall time, CPU time, peak memory, number of stars and output size of
+every job are recorded in its job_metrics table (see
+irpsf.hst1pass.job_metrics), summarized by hst1pass_report.py.
 """
-import glob
-from multiprocessing import Pool
 import logging
 import os
-import subprocess
 
 import argparse
+from irpsf.database.ir_psf_database_interface import get_ql_session, retry_on_disconnect
+from irpsf.hst1pass.exposure_index import FAILED, TIMED_OUT
+from irpsf.hst1pass.exposure_index import connect_index, get_filter_wall_times, get_new_records
+from irpsf.hst1pass.exposure_index import get_output_paths, record_result
+from irpsf.hst1pass.job_metrics import record_metrics
+from irpsf.hst1pass.launcher import run_jobs
+from irpsf.hst1pass.scheduler import order_by_cost
 from irpsf.settings.settings import *
 from irpsf.psf_logging.psf_logging import setup_logging
-from pyql.database.ql_database_interface import Master
-from pyql.database.ql_database_interface import IR_flt_0
-from pyql.database.ql_database_interface import IR_flt_1
-from pyql.database.ql_database_interface import session as ql_session
 
 def filter_psf_model_map(filt):
 	"""Determine which PSF model to use.
@@ -85,40 +102,26 @@ def filter_psf_model_map(filt):
 
 	return filter_model
 
-def get_psf_records():
-	"""Return a list containing filenames that already exist as raw
-	outputs in the psf filesystem.
-
-	Returns
-	-------
-	psf_rootnames : list
-		A list containing all rootnames of PSF files that already
-		exist as raw outputs in the psf filesystem.
-	"""
-
-	psf_files = glob.glob(os.path.join(SETTINGS['output_dir'], '*/*ras'))
-	psf_rootnames = [os.path.basename(item).split('_')[0][0:8] for item in psf_files]
-
-	return psf_rootnames
-
-def get_ql_records(filt):
-	"""Return a dictionary containing rootnames, paths, and filters
-	from all filenames in the QL database.
+def get_ql_records(filters):
+	"""Return a list containing the filters, rootnames, paths and
+	exposure times of all filenames in the QL database.
 
 	Parameters
 	----------
-	filt : str
-		The filter to process.	Can be 'all' to process all filters.
+	filters : list
+		The filters to process.	Can be ['all'] to process all filters.
 
 	Returns
 	-------
-	ql_records : dict
-		A dictionary whose keys are image rootnames and whose values
-		are a list containing the images' path and filter.
+	ql_records : list
+		A list of (filter, rootname, path, exptime) records.
 	"""
 
+	# Imported here so that importing this module does not load pyql
+	from pyql.database.ql_database_interface import IR_flt_0, IR_flt_1, Master
+
 	# Build query
-	ql_query = ql_session.query(IR_flt_0.filter, Master.ql_root, Master.dir)\
+	ql_query = get_ql_session().query(IR_flt_0.filter, Master.ql_root, Master.dir, IR_flt_0.exptime)\
 		.join(Master, Master.id == IR_flt_0.master_id)\
 		.join(IR_flt_1, IR_flt_1.id == IR_flt_0.id)
 
@@ -144,11 +147,11 @@ def get_ql_records(filt):
 		(IR_flt_0.quality != 'LOCKLOST') & \
 		(IR_flt_0.quality != 'ACQ2FAIL'))
 
-	# If specific filter specified, select for that only.
-	if filt != 'all':
-		ql_query = ql_query.filter(IR_flt_0.filter == filt.upper())
+	# If specific filters specified, select for those only.
+	if 'all' not in filters:
+		ql_query = ql_query.filter(IR_flt_0.filter.in_([filt.upper() for filt in filters]))
 
-	ql_query = ql_query.all()
+	ql_query = retry_on_disconnect(ql_query.all)
 
 	# Build ql_records list
 	ql_records = []
@@ -161,50 +164,52 @@ def get_job_list(new_records):
 	"""Create a list containing individual calls to hst1pass.e.
 
 	Each item in the job_list will be a call to hst1pass.e with
-	the appropriate parameters to process an image, beginning with a command
-	to cd into the correct output directory (FMIN could be lowered to 2500).
+	the appropriate parameters to process an image (FMIN could be lowered
+	to 2500).  The launcher runs it in a temporary directory, into which
+	hst1pass writes its outputs.
 
 	Parameters
 	----------
-	new_records : dict
-		A list of tuples, containing (<input file path>, <filter>).
+	new_records : list
+		A list of (filter, rootname, path, exptime) records.
 
 	Returns
 	-------
 	job_list : list
-		A list of strings containing calls to the img2psf_wfc3uv.F
-		routine with appropriate parameters.
+		A list of (filter, rootname, args) tuples, where each args is
+		the command line of a call to the hst1pass.F routine with
+		appropriate parameters.
 	"""
 
 	job_list = []
 	for record in new_records:
-		filt, rootname, path = record
-		output_loc = os.path.join(SETTINGS['output_dir']+'/'+format(filt),'')
+		filt, rootname, path, exptime = record
 		exe_loc = SETTINGS['jays_code'] + '/hst1pass.e'
 		path = os.path.join(path, '')
 #		print (path, rootname)
 		psf_model_path=SETTINGS['psf_models'] + '/{}'.format(filter_psf_model_map(filt))
-		job_list.append('cd {}; {} STARDB+ HMIN=7 FMIN=10000 PSF={}, {}'.format(output_loc, exe_loc, psf_model_path, path+rootname+'q_flt.fits'))
+		args = [exe_loc, 'STARDB+', 'HMIN=7', 'FMIN=10000', 'PSF={},'.format(psf_model_path), path+rootname+'q_flt.fits']
+		job_list.append((filt, rootname, args))
 
 	return job_list
 
-def run_process(cmd):
-	"""Calls subprocess with the command cmd.
+def record_job(index, result):
+	"""Record the outcome and metrics of a finished job in the exposure
+	index.
 
 	Parameters
 	----------
-	cmd : str
-		The subprocess command to execute.
-
-	Returns
-	-------
-	subprocess.call(cmd, shell=True) : obj
-		The subprocess call.
+	index : sqlite3.Connection
+		The connection to the exposure index.
+	result : dict
+		The result of the job, as returned by the launcher.
 	"""
 
-	logging.info('Beginning to process {}'.format(cmd.split()[-1]))
-
-	return subprocess.call(cmd, shell=True)
+	xym_path, ras_path = get_output_paths(result['rootname'], result['filter'])
+	record_result(index, result['rootname'], result['filter'], result['status'],
+		xym_path, ras_path, result['started_at'], result['finished_at'],
+		result['return_code'], result['attempts'])
+	record_metrics(index, result)
 
 def parse_args():
 	"""Parse the command line arguments.
@@ -221,42 +226,65 @@ def parse_args():
 	parser.add_argument(
 		'-filter',
 		required=False,
-		default='all',
-		help='The filter to the processed.')
+		nargs='+',
+		default=['all'],
+		help='The filters to the processed, all filters by default.')
+	parser.add_argument(
+		'-cores',
+		type=int,
+		default=None,
+		help="The number of hst1pass jobs to run at once, over all filters, SETTINGS['cores'] by default.")
+	parser.add_argument(
+		'-retry',
+		action='store_true',
+		help='Also process the files that previously failed or timed out.')
 	args = parser.parse_args()
 
 	return args
 
-def main_run_hst1pass_IR():
+def main_run_hst1pass_IR(filters=['all'], cores=None, retry=False):
 	"""The main controller for the run_hst1pass_IR module.
+
+	Parameters
+	----------
+	filters : list, default=['all']
+		The filters to process.
+	cores : int, optional
+		The number of hst1pass jobs to run at once.  Defaults to
+		SETTINGS['cores'].
+	retry : bool, default=False
+		Also process the files that previously failed or timed out.
 	"""
 
-	# Parse command line args
-	args = parse_args()
-	logging.info('Beginning processing. Filter = {}'.format(args.filter))
+	logging.info('Beginning processing. Filters = {}'.format(filters))
 
 	# Query QL
-	ql_records = get_ql_records(args.filter)
+	ql_records = get_ql_records(filters)
 	logging.info('{} records found in QL database.'.format(len(ql_records)))
 
-	#Check QL files against files already in database
-	psf_rootnames = get_psf_records()
-
-	new_records = []
-	for record in ql_records:
-		if record[1] not in psf_rootnames:
-			new_records.append(record)
+	#Check QL files against the exposures already processed
+	index = connect_index()
+	retry_statuses = [FAILED, TIMED_OUT] if retry else []
+	new_records = get_new_records(index, ql_records, retry_statuses)
 
 	logging.info('{} new files to process.'.format(len(new_records)))
-	# Make list of calls to hst1pass to be run as subprocesses
+	# Make list of calls to hst1pass to be run as subprocesses, the
+	# longest first so that the run ends with short jobs
+	new_records = order_by_cost(new_records, get_filter_wall_times(index))
 	job_list = get_job_list(new_records)
 
-	# Run processes in parallel
-	p = Pool(SETTINGS['cores'])
-	p.map(run_process, job_list)
+	# Run the jobs of all filters from one queue, recording each
+	# outcome in the index as it completes
+	counts = run_jobs(job_list, cores or SETTINGS['cores'],
+		timeout=SETTINGS.get('hst1pass_timeout'),
+		retries=SETTINGS.get('hst1pass_retries', 1),
+		on_result=lambda result: record_job(index, result))
+	logging.info('Done: {}'.format(counts))
 
 if __name__ == '__main__':
+	args = parse_args()
+
 	module = os.path.basename(__file__).strip('.py')
 	setup_logging(module)
 
-	main_run_hst1pass_IR()
+	main_run_hst1pass_IR(args.filter, args.cores, args.retry)
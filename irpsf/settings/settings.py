@@ -10,6 +10,11 @@ Authors
     Clare Shanahan
     Frederick Dauphin 2021
 
+The file is only read the first time a setting is used, not when this
+module is imported, so that e.g. ``--help`` works without it.  Its path
+can be set with the IRPSF_CONFIG environment variable, and defaults to
+config.yaml in the current working directory.
+
 Use
 ---
     This module is intended to be used by various modules, for example:
@@ -18,15 +23,69 @@ Use
     my_connection_string = SETTINGS['connection_string']
 """
 
+from collections.abc import Mapping
 import os
 import yaml
 
+_SETTINGS = None
+
+
 def get_settings():
     """Gets the setting information that we don't want burned into the repo.
+
+    The configuration file is read once per process and cached.
+
+    Returns
+    -------
+    settings : dict
+        The contents of the configuration file.
     """
 
-    with open('config.yaml', 'r') as f:
-        data = yaml.load(f)
-    return data
+    global _SETTINGS
+    if _SETTINGS is None:
+        with open(os.environ.get('IRPSF_CONFIG', 'config.yaml'), 'r') as f:
+            _SETTINGS = yaml.safe_load(f) or {}
+    return _SETTINGS
+
+
+class LazySettings(Mapping):
+    """Read-only view of the settings, reading them on first access."""
+
+    def __getitem__(self, key):
+        return get_settings()[key]
+
+    def __iter__(self):
+        return iter(get_settings())
+
+    def __len__(self):
+        return len(get_settings())
+
+    def __repr__(self):
+        # Only the keys: the values include database credentials
+        return 'LazySettings(keys={!r})'.format(sorted(get_settings()))
+
+
+SETTINGS = LazySettings()
+
+
+def get_cache_dir(name):
+    """Return (and create if necessary) a directory for cached files.
+
+    Cached files are kept under ``SETTINGS['cache_dir']``, which
+    defaults to a ``cache`` directory next to ``SETTINGS['output_dir']``.
+
+    Parameters
+    ----------
+    name : str
+        The name of the cache, used as the subdirectory name.
+
+    Returns
+    -------
+    cache_dir : str
+        The path to the cache directory.
+    """
 
-SETTINGS = get_settings()
+    default = os.path.join(os.path.dirname(SETTINGS['output_dir'].rstrip('/')), 'cache')
+    cache_dir = os.path.join(SETTINGS.get('cache_dir', default), name)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
@@ -8,4 +8,5 @@ setup(name = 'irpsf',
       author = 'Space Telescope Science Institute',
       url = 'https://github.com/spacetelescope/ir_psf',
       packages = find_packages(),
-      install_requires = ['astropy', 'matplotlib', 'numpy', 'pyyaml', 'scipy', 'sqlalchemy'])
+      install_requires = ['astropy', 'matplotlib', 'numpy', 'pyyaml', 'scipy', 'sqlalchemy'],
+      extras_require = {'parquet': ['pyarrow']})